@@ -37,17 +37,271 @@ How to use this driver:
 
     pyb.close()
 """
+import ast
+import sys
 import time
 import json
+import array
+import base64
+import hashlib
+import asyncio
+import queue
+import functools
+import itertools
 import threading
 
 import ampy.pyboard as pyboard
 
 from stublogger import StubLogger
+from UPYRPC_latency import LatencyRecorder
+from UPYRPC_transport import Transport, open_transport
 from target.upyrpc_const import *
+from target.upyrpc_frame import encode_obj, read_frame
 
 VERSION = "0.2.0"
 
+try:
+    import numpy
+except ImportError:
+    numpy = None  # samples are decoded to array('H') instead
+
+
+def decode_u16(raw):
+    """ Decode raw little endian uint16 samples
+    - a read only numpy uint16 array over raw, or array('H') when numpy is not installed
+
+    :param raw: bytes
+    :return: samples
+    """
+    if numpy is not None:
+        return numpy.frombuffer(raw, dtype="<u2")
+
+    samples = array.array('H')
+    samples.frombytes(raw)
+    if sys.byteorder == "big": samples.byteswap()
+    return samples
+
+
+def decode_samples(value):
+    """ Decode the sample buffers of an ADC result value, in place
+    - values with "encoding": "b64" have the raw little endian samples of each pin base64 encoded,
+      see uPyRPC._adc_samples() on the target
+    - samples become a read only numpy uint16 array over the decoded bytes, or array('H') when
+      numpy is not installed, no python int is made per sample
+
+    :param value: result value dict
+    :return: value
+    """
+    if value.get("encoding", None) != "b64":
+        return value
+
+    for pin in value.get("pins", []):
+        value[pin] = decode_u16(base64.b64decode(value[pin]))
+
+    del value["encoding"]
+    return value
+
+
+def decode_gpio_ports(value):
+    """ Levels of the named gpios in a get_gpio_ports() result value
+
+    :param value: result value dict, {'ports': {<port>: <bitmask>, ...}, 'pins': {<name>: [<port>, <bit>], ...}}
+    :return: {<name>: 0|1, ...}
+    """
+    levels = {}
+    for name, (port, bit) in value["pins"].items():
+        levels[name] = (value["ports"][port] >> bit) & 1
+    return levels
+
+
+def _decode_results(results):
+    """ decode_samples() of every result in a list of results
+    """
+    for r in results:
+        if isinstance(r.get("value", None), dict): decode_samples(r["value"])
+    return results
+
+
+class UPYRPCBatch(object):
+    """ Collects wrapper calls and sends them to the server as one batch command
+    - the wrappers of the UPYRPC instance that send one command, see METHODS, are available on the
+      batch, calling one queues the command and returns (True, <index>)
+    - the batch is sent when the with block exits, or by calling send()
+    - after sending, self.results has a (success, result) per queued command
+
+        with pyb.batch() as b:
+            b.init_gpio("foo", "Y1", PYB_PIN_OUT_PP, PYB_PIN_PULLNONE)
+            b.set_gpio("foo", True)
+            b.adc_read("X19")
+        logging.info("{} {}".format(b.success, b.results))
+
+    AsyncUPYRPC batches are sent with "async with", or by awaiting send().
+    """
+    # wrappers that send one command and get its result, the others send several commands, or wait
+    # for results posted later (gpio_seq, adc_capture, adc_stream, adc_read_multi, ...), and can't be batched
+    METHODS = ("unique_id", "version", "ping", "debug", "queue_stats", "stats", "led", "led_toggle", "reset",
+               "pwm", "long_running_example", "adc_read", "adc_capture_start", "adc_capture_stop",
+               "adc_monitor_start", "adc_monitor_query", "adc_monitor_stop", "adc_stream_start", "adc_stream_stop",
+               "init_gpio", "get_gpio", "set_gpio", "set_gpios", "get_gpios", "get_gpio_ports",
+               "gpio_seq_start", "gpio_seq_stop")
+
+    def __init__(self, pyb, stop_on_fail=False):
+        self._pyb = pyb
+        self.logger = pyb.logger
+        self.stop_on_fail = stop_on_fail
+        self.cmds = []
+        self.success = None
+        self.results = None
+        self.result = None
+
+    def __getattr__(self, name):
+        func = getattr(type(self._pyb), name, None)
+        if name not in self.METHODS or not callable(func):
+            raise AttributeError("{} can not be used in a batch".format(name))
+        # the wrappers only use self._verify_single_cmd_ret() and self._error(), which queue on this batch
+        return functools.partial(func, self)
+
+    def _verify_single_cmd_ret(self, cmd_dict, delay_poll_s=None):
+        self.cmds.append(cmd_dict)
+        return True, len(self.cmds) - 1
+
+    def _error(self, msg):
+        # the wrapper rejected its arguments, the command is not queued
+        self.logger.error(msg)
+        return False, msg
+
+    def _results(self, success, result):
+        self.success = success
+        self.result = result
+        if isinstance(result, dict) and result.get("method", False) == "batch":
+            self.results = [(r["success"], r) for r in result["value"]["results"]]
+        return success, result
+
+    def send(self):
+        """ send the queued commands to the server
+
+        :return: success, result
+        """
+        c = {'method': 'batch', 'args': {'cmds': self.cmds, 'stop': self.stop_on_fail}}
+        ret = self._pyb._verify_single_cmd_ret(c)
+        if asyncio.iscoroutine(ret):
+            return self._send_async(ret)
+        return self._results(*ret)
+
+    async def _send_async(self, ret):
+        success, result = await ret
+        return self._results(success, result)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.send()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            await self.send()
+
+
+class UPYRPCRecipe(UPYRPCBatch):
+    """ A recipe, a list of wrapper calls with limits on their results, that the server runs with one
+    consolidated result, see MicroPyServer.recipe()
+    - build it like a batch, limit() sets limits on the result of the last call
+    - the server caches recipes by hash, the steps are only sent the first time a recipe is run (or
+      when the server no longer has it), after that only the hash is sent
+
+        recipe = pyb.recipe()
+        recipe.init_gpio("foo", "Y1", PYB_PIN_OUT_PP, PYB_PIN_PULLNONE)
+        recipe.adc_read("X19")
+        recipe.limit("value", 1000, 3000)
+        success, result = recipe.run()
+        logging.info("{} {}".format(recipe.passed, recipe.results))
+
+    AsyncUPYRPC recipes are run by awaiting run().
+    """
+    def __init__(self, pyb, stop_on_fail=False, save=False, full=False):
+        super().__init__(pyb, stop_on_fail)
+        self.save = save
+        self.full = full
+        self.limits = []
+        self.passed = None
+
+    def _verify_single_cmd_ret(self, cmd_dict, delay_poll_s=None):
+        self.limits.append({})
+        return super()._verify_single_cmd_ret(cmd_dict, delay_poll_s)
+
+    def limit(self, key, lo=None, hi=None):
+        """ limits on a value of the result of the last call
+
+        :param key: key of the result value, like "value", or "mean" of adc_read() with stats
+        :param lo: lowest passing value, None for no limit
+        :param hi: highest passing value, None for no limit
+        """
+        if not self.cmds:
+            raise ValueError("limit() must follow a call")
+        self.limits[-1][key] = [lo, hi]
+
+    @property
+    def steps(self):
+        steps = []
+        for cmd, limits in zip(self.cmds, self.limits):
+            step = dict(cmd)
+            if limits: step["limits"] = limits
+            steps.append(step)
+        return steps
+
+    @property
+    def hash(self):
+        data = json.dumps(self.steps, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()[:16]
+
+    def _cmd(self, upload):
+        args = {'hash': self.hash, 'stop': self.stop_on_fail, 'full': self.full}
+        if upload:
+            args['steps'] = self.steps
+            args['save'] = self.save
+        return {'method': 'recipe', 'args': args}
+
+    @staticmethod
+    def _not_cached(success, result):
+        if success or not isinstance(result, dict): return False
+        value = result.get("value", None)
+        return isinstance(value, dict) and value.get("cached", None) is False
+
+    def _results(self, success, result):
+        self.success = success
+        self.result = result
+        if success and isinstance(result, dict) and result.get("method", False) == "recipe":
+            self.passed = result["value"]["passed"]
+            self.results = result["value"]["results"]
+        return success, result
+
+    def run(self):
+        """ run the recipe on the server, the steps are only sent if the server does not have them
+
+        :return: success, result, see MicroPyServer.recipe(), self.passed is the outcome
+        """
+        ret = self._pyb._verify_single_cmd_ret(self._cmd(False))
+        if asyncio.iscoroutine(ret):
+            return self._run_async(ret)
+
+        if self._not_cached(*ret):
+            ret = self._pyb._verify_single_cmd_ret(self._cmd(True))
+        return self._results(*ret)
+
+    async def _run_async(self, ret):
+        success, result = await ret
+        if self._not_cached(success, result):
+            success, result = await self._pyb._verify_single_cmd_ret(self._cmd(True))
+        return self._results(success, result)
+
+    def send(self):
+        return self.run()
+
 
 class UPYRPC(pyboard.Pyboard):
     """ Extend the base pyboard class with a little exec helper method, exec_cmd
@@ -55,17 +309,74 @@ class UPYRPC(pyboard.Pyboard):
 
     There is a lock on self.server_cmd() to sequence clients
 
+    With framed=True the server is driven with the binary frame protocol (see target/upyrpc_frame.py)
+    after it is started, instead of exec'ing a python string for every call.  The exec path
+    is kept as the fallback.
+
+    With push=True (implies framed) the server writes results to the serial port as soon as
+    they are ready.  A reader thread collects them, and waiters are woken right away instead of
+    sleeping and polling the server with ret().
+
+    With attach=True start_server() reuses a server that is still running from an earlier session,
+    instead of soft resetting the target and starting a new one, see start_server().
+
+    The latency of every call is recorded per method and phase in self.latency, see UPYRPC_latency.py.
+    Pass latency=False to turn it off.
+
+    device is a serial port, or a transport URL like tcp://host:port, see UPYRPC_transport.py.
+
     """
-    def __init__(self, device, baudrate=115200, user='micro', password='python', wait=0, rawdelay=0, loggerIn=None):
-        super().__init__(device, baudrate, user, password, wait, rawdelay)
+    FRAME_TIMEOUT_S = 10
+    PUSH_TIMEOUT_S = 5
+    PUSH_MAX_ITEMS = 1000  # pushed results nobody asked for are dropped, oldest first
+    ATTACH_TIMEOUT_S = 1
+    ATTACH_POLL_S = 0.02   # ping poll delay when attaching, the server answers right away when idle
+
+    def __init__(self, device, baudrate=115200, user='micro', password='python', wait=0, rawdelay=0, loggerIn=None,
+                 framed=False, push=False, attach=False, latency=True):
+        # instead of Pyboard.__init__(), which only opens serial ports and telnet
+        pyboard._rawdelay = rawdelay  # used by Pyboard.enter_raw_repl()
+        self.serial = open_transport(device, baudrate, wait, user, password)
 
         if loggerIn: self.logger = loggerIn
         else: self.logger = StubLogger()
 
         self.device = device
+        self.framed = framed or push
+        self.push = push
+        self.attach = attach
+        self.startup = None  # report of the last start_server(), see start_server()
+        self.latency = LatencyRecorder() if latency else None
+        self._call = threading.local()  # phase times of the call in progress on this thread
+        self._framing = False  # True while the target is in serve_frames()
+        self._pushing = False  # True while the target is pushing results
+        self._ids = itertools.count(1)  # request ids, echoed by the server in results
+
+        self._reader = None
+        self._reader_stop = False
+        self._reader_exit = False  # stop the reader after the next reply, the REPL owns the stream again
+        self._replies = queue.Queue()
+        self._pushed = []
+        self._pushed_cv = threading.Condition()
 
         self.lock = threading.Lock()
 
+    def read_until(self, min_num_bytes, ending, timeout=10, data_consumer=None):
+        """ Pyboard.read_until() on the transport buffer, Pyboard reads a byte at a time
+        """
+        if not isinstance(self.serial, Transport):  # telnet
+            return super().read_until(min_num_bytes, ending, timeout, data_consumer)
+        return self.serial.read_until(min_num_bytes, ending, timeout, data_consumer)
+
+    def close(self):
+        with self.lock:
+            if self._framing:
+                try:
+                    self._frames_exit()
+                except pyboard.PyboardError as er:
+                    self.logger.error(er)
+        super().close()
+
     def server_cmd(self, cmds, repl_enter=True, repl_exit=True, blocking=True):
         """ execute a buffer on the open pyboard
 
@@ -78,16 +389,24 @@ class UPYRPC(pyboard.Pyboard):
             self.logger.error("cmd should be a list of micropython code (strings)")
             return False, "cmds should be a list"
 
+        t = time.perf_counter()
         cmd = "\n".join(cmds)
+        self._phase("encode", t)
         self.logger.debug("{} cmd: {}".format(self.device, cmd))
 
         with self.lock:
+            framing = self._framing
             # this was copied/ported from pyboard.py
             try:
+                if framing: self._frames_exit()
                 if repl_enter: self.enter_raw_repl()
 
                 if blocking:
-                    ret, ret_err = self.exec_raw(cmd + '\n', timeout=10, data_consumer=None)
+                    t = time.perf_counter()
+                    self.exec_raw_no_follow(cmd + '\n')
+                    t = self._phase("write", t)
+                    ret, ret_err = self.follow(timeout=10, data_consumer=None)
+                    self._phase("exec", t)
                 else:
                     self.exec_raw_no_follow(cmd)
                     ret_err = False
@@ -99,6 +418,9 @@ class UPYRPC(pyboard.Pyboard):
                 return False, msg
             except KeyboardInterrupt:
                 return False, "KeyboardInterrupt"
+            finally:
+                # framed mode is entered again on errors too, so _framing matches self.framed
+                if framing and not repl_exit and not self._framing: self._frames_reenter()
 
             if repl_exit: self.exit_raw_repl()
 
@@ -110,6 +432,7 @@ class UPYRPC(pyboard.Pyboard):
 
             #print("A: {}".format(ret))
             if ret:
+                t = time.perf_counter()
                 pyb_str = ret.decode("utf-8")
 
                 # expecting a JSON like dict object in string format, convert this string JSON to python dict
@@ -118,15 +441,300 @@ class UPYRPC(pyboard.Pyboard):
                 try:
                     self.logger.debug(fixed_string.strip())
                     items = json.loads(fixed_string)
-                except Exception as e:
-                    self.logger.error(e)
-                    return False, []
+                except ValueError:
+                    try:
+                        # strings with quotes in them, like error messages, are only a Python literal
+                        items = ast.literal_eval(pyb_str.strip())
+                    except (ValueError, SyntaxError) as e:
+                        self.logger.error(e)
+                        return False, []
+                finally:
+                    self._phase("decode", t)
 
                 return True, items
 
             return True, []
 
+    # -------------------------------------------------------------------------------------------------
+    # framed protocol
+
+    def _read_stream(self, n):
+        """ read exactly n bytes for the reader thread, serial reads time out while framing
+        """
+        data = b""
+        while len(data) < n:
+            if self._reader_stop:
+                raise pyboard.PyboardError("reader stopped")
+            data += self.serial.read(n - len(data))
+        return data
+
+    def _reader_run(self):
+        """ Reader thread, owns the read side of the serial port while framing
+        - replies are handed to _frame_request() in order
+        - pushed results are collected in self._pushed and waiters are notified
+        """
+        while True:
+            try:
+                frame = read_frame(self._read_stream)
+            except (pyboard.PyboardError, OSError) as er:
+                if not self._reader_stop: self.logger.error(er)
+                break
+
+            if frame is None:
+                self.logger.error("{} frame crc error".format(self.device))
+                continue
+
+            ftype, payload = frame
+            t = time.perf_counter()
+            try:
+                obj = json.loads(payload.decode("utf-8"))
+            except (ValueError, UnicodeDecodeError) as er:
+                self.logger.error("{} frame not decoded, {}: {}".format(self.device, er, payload[:80]))
+                continue
+            if ftype != FRAME_PUSH:
+                self._replies.put((ftype, obj, time.perf_counter() - t))
+                if self._reader_exit: break
+                continue
+
+            self.logger.debug("{} push: {}".format(self.device, obj))
+            if obj.get("method", False) == "_debug":
+                self.logger.debug("PYBOARD DEBUG: {}".format(obj["value"]))
+                continue
+
+            with self._pushed_cv:
+                self._pushed.append(obj)
+                if len(self._pushed) > self.PUSH_MAX_ITEMS:
+                    dropped = self._pushed.pop(0)
+                    self.logger.warning("{} dropped pushed result {}".format(self.device, dropped))
+                self._pushed_cv.notify_all()
+
+    def _attach_raw_repl(self):
+        """ Enter the raw REPL without the soft reset of enter_raw_repl(), so a running server is kept,
+        the lock must be held
+        """
+        self.serial.write(b'\r\x03\x03')  # ctrl-C twice: interrupt any running program
+        time.sleep(0.05)
+        n = self.serial.inWaiting()
+        while n > 0:
+            self.serial.read(n)
+            n = self.serial.inWaiting()
+
+        self.serial.write(b'\r\x01')  # ctrl-A: enter raw REPL, the prompt is left for exec_raw()
+        data = self.read_until(1, b'raw REPL; CTRL-B to exit\r\n', timeout=self.ATTACH_TIMEOUT_S)
+        if not data.endswith(b'raw REPL; CTRL-B to exit\r\n'):
+            raise pyboard.PyboardError('could not enter raw repl')
+
+    def _attach_server(self, version=None):
+        """ Attach to a server left running by an earlier session
+        - results left on the server by the earlier session are discarded, their ids would
+          clash with the ids of this session
+
+        :param version: server version required, None for any
+        :return: success, ping result or the reason the server can't be attached
+        """
+        with self.lock:
+            try:
+                self._attach_raw_repl()
+            except pyboard.PyboardError as er:
+                return False, str(er)
+
+        # ret() prints the discarded results, or None if the server was never started
+        cmds = ["try:", "    upyrpc_main.upyrpc.ret(all=True)", "except NameError:", "    print(None)"]
+        success, result = self.server_cmd(cmds, repl_enter=False, repl_exit=False)
+        if not success or result is None:
+            return False, "no server running"
+        if result:
+            self.logger.info("{} discarded {} results of an earlier session".format(self.device, len(result)))
+
+        # the ping goes through the command queue, so the server thread is known to be alive
+        success, result = UPYRPC._verify_single_cmd_ret(self, {'method': 'ping', 'args': {}}, self.ATTACH_POLL_S)
+        if not success:
+            return False, "server did not answer ping"
+
+        running = result["value"]["version"]
+        if version is not None and running != version:
+            return False, "server version {} is not {}".format(running, version)
+
+        return True, result
+
+    def _frames_enter(self):
+        """ Switch the target to framed mode, the lock must be held
+        """
+        self.exec_raw_no_follow("upyrpc_main.upyrpc.serve_frames()")
+        self.serial.timeout = 0.1
+        self._reader_stop = False
+        self._reader_exit = False
+        self._replies = queue.Queue()
+        self._reader = threading.Thread(target=self._reader_run, name="upyrpc-reader", daemon=True)
+        self._reader.start()
+        self._framing = True
+
+        if self.push:
+            success, result = self._frame_request(FRAME_CONFIG, {"push": True})
+            self._pushing = success and result.get("push", False)
+            if not self._pushing:
+                self.logger.error("failed to enable push mode: {}".format(result))
+
+    def _frames_reenter(self):
+        """ Switch the target back to framed mode after an exec, the lock must be held
+        - failures are logged, the client stays in exec mode, which still works
+        """
+        try:
+            self._frames_enter()
+        except (pyboard.PyboardError, OSError) as er:
+            self.logger.error("{} failed to enter framed mode again, using exec: {}".format(self.device, er))
+
+    def _frames_exit(self):
+        """ Switch the target back to the raw REPL, the lock must be held
+        """
+        self._framing = False
+        self._pushing = False
+        self._reader_exit = True
+        success, result = self._frame_request(FRAME_EXIT, None)
+        if not success:
+            self._reader_stop = True
+        self._reader.join()
+        self._reader = None
+        self.serial.timeout = None
+        if not success:
+            raise pyboard.PyboardError("failed to exit framed mode: {}".format(result))
+        self.follow(timeout=self.FRAME_TIMEOUT_S)
+
+    def _frame_request(self, ftype, obj):
+        """ send a frame and wait for the reply, the lock must be held
+        """
+        try:
+            t = time.perf_counter()
+            frame = encode_obj(ftype, obj)
+            t = self._phase("encode", t)
+            self.serial.write(frame)
+            t = self._phase("write", t)
+            rtype, result, decode_s = self._replies.get(timeout=self.FRAME_TIMEOUT_S)
+            self._phase("exec", t)
+            self._phase("decode", 0, decode_s)
+        except queue.Empty:
+            self.logger.error("{} timeout waiting for reply".format(self.device))
+            return False, "timeout waiting for reply"
+        except OSError as er:
+            self.logger.error(er)
+            return False, str(er)
+
+        self.logger.debug("{} frame {}: {}".format(self.device, rtype, result))
+        if rtype != FRAME_REPLY:
+            self.logger.error(result)
+            return False, result
+
+        return True, result
+
+    def frame_cmd(self, ftype, obj):
+        """ send a frame to the target, and return its reply
+
+        :param ftype: one of FRAME_*
+        :param obj: JSON serializable payload
+        :return: success (True/False), result
+        """
+        with self.lock:
+            if not self._framing:
+                return False, "server is not in framed mode"
+            return self._frame_request(ftype, obj)
+
+    def _wait_pushed(self, match, all=False, remove=True, timeout=None):
+        """ wait for pushed result(s)
+
+        :param match: function(item), True for the wanted items
+        :param all: return all matching items, else only the oldest
+        :param remove: remove the returned items
+        :param timeout: seconds
+        :return: [item, ...], empty on timeout
+        """
+        if timeout is None: timeout = self.PUSH_TIMEOUT_S
+        deadline = time.time() + timeout
+        with self._pushed_cv:
+            while True:
+                items = [r for r in self._pushed if match(r)]
+                if items:
+                    if not all: items = items[:1]
+                    if remove:
+                        for r in items: self._pushed.remove(r)
+                    return items
+
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self._pushing:
+                    return []
+                self._pushed_cv.wait(remaining)
+
+    # -------------------------------------------------------------------------------------------------
+    # server queue access, uses frames when available, else exec
+
+    def _server_put(self, cmd_dict):
+        if self._framing:
+            success, result = self.frame_cmd(FRAME_CMD, cmd_dict)
+            if success and not result:
+                return False, "server rejected cmd {}".format(cmd_dict.get("method", None))
+            return success, result
+
+        t = time.perf_counter()
+        cmds = ["upyrpc_main.upyrpc.cmd({})".format(str(cmd_dict))]
+        self._phase("encode", t)
+        return self.server_cmd(cmds, repl_enter=False, repl_exit=False)
+
+    def _server_ret(self, method=None, all=False, id=None):
+        if self._framing:
+            return self.frame_cmd(FRAME_RET, {"method": method, "all": all, "id": id})
+
+        cmds = ["upyrpc_main.upyrpc.ret(method={}, all={}, id={})".format(repr(method), all, id)]
+        return self.server_cmd(cmds, repl_enter=False, repl_exit=False)
+
+    def _server_peek(self, method=None, all=False, id=None):
+        if self._framing:
+            return self.frame_cmd(FRAME_PEEK, {"method": method, "all": all, "id": id})
+
+        cmds = ["upyrpc_main.upyrpc.peek(method={}, all={}, id={})".format(repr(method), all, id)]
+        return self.server_cmd(cmds, repl_enter=False, repl_exit=False)
+
+    def _error(self, msg):
+        """ result of a wrapper that fails before anything is sent to the server
+        """
+        self.logger.error(msg)
+        return False, msg
+
+    def _phase(self, phase, start, seconds=None):
+        """ add the time since start to a phase of the call in progress on this thread, see UPYRPC_latency.py
+
+        :param phase: one of UPYRPC_latency.PHASES
+        :param start: time.perf_counter() at the start of the phase
+        :param seconds: length of the phase, instead of the time since start
+        :return: time.perf_counter(), the start of the next phase
+        """
+        now = time.perf_counter()
+        phases = getattr(self._call, "phases", None)
+        if phases is not None:
+            if seconds is None: seconds = now - start
+            phases[phase] = phases.get(phase, 0.0) + seconds
+        return now
+
     def _verify_single_cmd_ret(self, cmd_dict, delay_poll_s=0.1):
+        """ send a command, and get its result
+        - the latency of the call is recorded in self.latency
+
+        :param cmd_dict: {"method": <method>, "args": {<args>}}
+        :param delay_poll_s: seconds between polls for the result, when not in push mode
+        :return: success, result
+        """
+        if self.latency is None:
+            return self._cmd_ret(cmd_dict, delay_poll_s)
+
+        self._call.phases = phases = {}
+        self._call.retries = None
+        start = time.perf_counter()
+        try:
+            return self._cmd_ret(cmd_dict, delay_poll_s)
+        finally:
+            self._call.phases = None
+            phases["total"] = time.perf_counter() - start
+            self.latency.record(cmd_dict.get("method", None), phases, self._call.retries)
+
+    def _cmd_ret(self, cmd_dict, delay_poll_s):
         method = cmd_dict.get("method", None)
         args = cmd_dict.get("args", None)
 
@@ -136,30 +744,44 @@ class UPYRPC(pyboard.Pyboard):
         if args is None:
             return False, "args not specified"
 
-        cmds = []
-        c = str(cmd_dict)
-        cmds.append("upyrpc_main.upyrpc.cmd({})".format(c))
-        success, result = self.server_cmd(cmds, repl_enter=False, repl_exit=False)
+        rid = next(self._ids)
+        success, result = self._server_put(dict(cmd_dict, id=rid))
         if not success:
             self.logger.error("{} {}".format(success, result))
             return success, result
 
-        cmds = ["upyrpc_main.upyrpc.ret(method='{}')".format(method)]
+        if self._pushing:
+            t = time.perf_counter()
+            result = self._wait_pushed(lambda r: r.get("id", None) == rid)
+            self._phase("wait", t)
+            if not result:
+                return False, "Failed to verify method {} was executed".format(method)
+            if result[0].get("method", False) == "cmd":
+                self.logger.error("{} {}".format(method, result[0]["value"]))
+                return False, result[0]  # server rejected the command
+            return result[0]["success"], result[0]
 
         # it is assumed the command sent will post a return, with success set
         retry = 5
         succeeded = False
+        self._call.retries = 0
         while retry and not succeeded:
+            t = time.perf_counter()
             time.sleep(delay_poll_s)
-            success, result = self.server_cmd(cmds, repl_enter=False, repl_exit=False)
+            self._phase("wait", t)
+            self._call.retries += 1
+            success, result = self._server_ret(id=rid)
             self.logger.debug("{} {}".format(success, result))
             if success:
                 for r in result:
                     if r.get("method", False) == "_debug":
                         self.logger.debug("PYBOARD DEBUG: {}".format(r["value"]))
                         retry += 1  # debug lines don't count against retrying
-                    if r.get("method", False) == method:
+                    elif r.get("method", False) == method:
                         succeeded = True
+                    elif r.get("method", False) == "cmd":
+                        self.logger.error("{} {}".format(method, r["value"]))
+                        return False, r  # server rejected the command
             else:
                 return success, result
 
@@ -178,16 +800,50 @@ class UPYRPC(pyboard.Pyboard):
     # API (wrapper functions)
     # these are the important functions
 
-    def start_server(self):
+    def start_server(self, version=None):
         """ Starts the Server on the target
         - this is the only time that REPL is entered, which will do a soft reset on the target and
           start the server
-
-        :return:
+        - with attach=True, a server still running from an earlier session is used as is, and the
+          target is only reset if there is no server, it does not answer ping(), or it is not the
+          required version.  The state of the server (GPIOs, PWMs, ...) is kept, call reset()
+          if that matters.
+        - self.startup reports how the server was started,
+          {"attached": True|False, "time_s": <seconds>, "reason": <why the server was not attached>}
+
+        :param version: server version required to attach to a running server, None for any
+        :return: success, result
         """
-        cmds = ["import upyrpc_main"]
-        success, result = self.server_cmd(cmds, repl_enter=True, repl_exit=False)
-        self.logger.info("{} {}".format(success, result))
+        start = time.time()
+        attached, reason = False, None
+        if self.attach:
+            attached, result = self._attach_server(version)
+            if not attached:
+                reason = result
+                self.logger.info("{} not attaching: {}".format(self.device, reason))
+
+        if attached:
+            success = True
+            self.startup = {"attached": True, "time_s": time.time() - start, "reason": None}
+            self.startup.update(result["value"])
+            self.logger.info("{} attached to server {} up {}s, in {:.3f}s".format(
+                self.device, self.startup["version"], self.startup["uptime_s"], self.startup["time_s"]))
+        else:
+            cmds = ["import upyrpc_main"]
+            success, result = self.server_cmd(cmds, repl_enter=True, repl_exit=False)
+            self.logger.info("{} {}".format(success, result))
+            self.startup = {"attached": False, "time_s": time.time() - start, "reason": reason}
+            if success:
+                self.logger.info("{} started server in {:.3f}s".format(self.device, self.startup["time_s"]))
+
+        if success and self.framed:
+            with self.lock:
+                try:
+                    self._frames_enter()
+                except pyboard.PyboardError as er:
+                    self.logger.error(er)
+                    return False, str(er)
+
         return success, result
 
     def unique_id(self):
@@ -198,6 +854,14 @@ class UPYRPC(pyboard.Pyboard):
         c = {'method': 'version', 'args': {}}
         return self._verify_single_cmd_ret(c)
 
+    def ping(self):
+        """ Cheap handshake with the server
+
+        :return: success, result, the value is {'version': <server version>, 'uptime_s': <seconds>}
+        """
+        c = {'method': 'ping', 'args': {}}
+        return self._verify_single_cmd_ret(c)
+
     def debug(self, enable=True):
         """ Set Server debug mode
 
@@ -207,6 +871,25 @@ class UPYRPC(pyboard.Pyboard):
         c = {'method': 'debug', 'args': {"enable": enable}}
         return self._verify_single_cmd_ret(c)
 
+    def queue_stats(self):
+        """ Statistics of the server command and return queues
+        - items dropped because a queue was full are counted here
+
+        :return: success, result
+        """
+        c = {'method': 'queue_stats', 'args': {}}
+        return self._verify_single_cmd_ret(c)
+
+    def stats(self, reset=False):
+        """ Server health statistics, per method call counts and execution times, queue depths
+        and high water marks, dropped results, and heap usage, see MicroPyServer.stats()
+
+        :param reset: start the statistics over, after reading them
+        :return: success, result
+        """
+        c = {'method': 'stats', 'args': {'reset': reset}}
+        return self._verify_single_cmd_ret(c)
+
     def get_server_method(self, method, all=False):
         """ Get return value message(s) from the server for a specific method
         - this function will remove the message(s) from the server queue
@@ -215,12 +898,17 @@ class UPYRPC(pyboard.Pyboard):
         :param all: set True for all the return messages
         :return: success, result
         """
-        cmds = ["upyrpc_main.upyrpc.ret(method='{}', all={})".format(method, all)]
+        if self._pushing:
+            result = self._wait_pushed(lambda r: r.get("method", None) == method, all, timeout=0.5)
+            if not result:
+                return False, "Failed to find method {}".format(method)
+            return True, _decode_results(result)
+
         retry = 5
         succeeded = False
         while retry and not succeeded:
             time.sleep(0.1)
-            success, result = self.server_cmd(cmds, repl_enter=False, repl_exit=False)
+            success, result = self._server_ret(method, all)
             self.logger.debug("{} {}".format(success, result))
             if success:
                 for r in result:
@@ -234,7 +922,7 @@ class UPYRPC(pyboard.Pyboard):
         if not succeeded:
             return False, "Failed to find method {}".format(method)
 
-        return success, result
+        return success, _decode_results(result)
 
     def peek_server_method(self, method=None, all=False):
         """ Peek return message value(s from the server for a specific method
@@ -244,12 +932,18 @@ class UPYRPC(pyboard.Pyboard):
         :param all: set True for all the return messages
         :return:
         """
-        cmds = ["upyrpc_main.upyrpc.peek(method='{}', all='{}')".format(method, all)]
+        if self._pushing:
+            result = self._wait_pushed(lambda r: method is None or r.get("method", None) == method, all,
+                                       remove=False, timeout=0.5)
+            if not result:
+                return False, "Failed to find method {}".format(method)
+            return True, _decode_results(result)
+
         retry = 5
         succeeded = False
         while retry and not succeeded:
             time.sleep(0.1)
-            success, result = self.server_cmd(cmds, repl_enter=False, repl_exit=False)
+            success, result = self._server_peek(method, all)
             self.logger.debug("{} {}".format(success, result))
             if success:
                 for r in result:
@@ -263,7 +957,31 @@ class UPYRPC(pyboard.Pyboard):
         if not succeeded:
             return False, "Failed to find method {}".format(method)
 
-        return success, result
+        return success, _decode_results(result)
+
+    def batch(self, stop_on_fail=False):
+        """ Batch of commands, sent to the server in one go, see UPYRPCBatch
+        - use in a with block,
+
+            with pyb.batch() as b:
+                b.set_gpio("foo", True)
+                b.adc_read("X19")
+
+        :param stop_on_fail: server stops running the batch at the first command that fails
+        :return: UPYRPCBatch
+        """
+        return UPYRPCBatch(self, stop_on_fail)
+
+    def recipe(self, stop_on_fail=False, save=False, full=False):
+        """ Recipe, a list of commands with limits, run by the server with one consolidated result,
+        see UPYRPCRecipe
+
+        :param stop_on_fail: server stops running the recipe at the first step that fails, or is out of limits
+        :param save: server saves the recipe to a file, so it is still cached after a reset
+        :param full: results have the whole result of every step, not only the failed and limited ones
+        :return: UPYRPCRecipe
+        """
+        return UPYRPCRecipe(self, stop_on_fail, save, full)
 
     def led(self, set):
         """ LED on/off
@@ -271,7 +989,7 @@ class UPYRPC(pyboard.Pyboard):
         :return:
         """
         if not isinstance(set, list):
-            return False, "argument must be a list of tuples"
+            return self._error("argument must be a list of tuples")
         c = {'method': 'led', 'args': {'set': set}}
         return self._verify_single_cmd_ret(c)
 
@@ -286,23 +1004,33 @@ class UPYRPC(pyboard.Pyboard):
         c = {'method': 'led_toggle', 'args': {'led': led, 'on_ms': on_ms, 'off_ms': off_ms, 'once': once}}
         return self._verify_single_cmd_ret(c)
 
-    def adc_read(self, pin, samples=1, samples_ms=1):
+    def adc_read(self, pin, samples=1, samples_ms=1, stats=None, bins=0, hist_range=None):
         """ Read an ADC pin
         - This is a BLOCKING function
         - result is raw ADC value, client needs to scale to VREF (3.3V)
+        - the samples are reduced on the target as they are taken, so samples can be large
 
         :param pin: pin name, X2, X3, etc
         :param samples: Number of samples to average over
         :param samples_ms: Delay between samples
+        :param stats: list of statistics to return as well, any of "mean", "min", "max", "rms", "var", "std"
+        :param bins: number of histogram bins, the result has "hist", a count per bin
+        :param hist_range: [lo, hi] of the histogram bins, default [0, 4096]
         :return: success, result
         """
-        c = {'method': 'adc_read', 'args': {'pin': pin, 'samples': samples, 'samples_ms': samples_ms}}
+        args = {'pin': pin, 'samples': samples, 'sample_ms': samples_ms}
+        if stats: args['stats'] = stats
+        if bins:
+            args['bins'] = bins
+            if hist_range: args['range'] = hist_range
+        c = {'method': 'adc_read', 'args': args}
         return self._verify_single_cmd_ret(c)
 
     def adc_read_multi(self, pins, samples=100, freq=100):
         """ Read single or Multiple pins at Freq rate
         - NON-BLOCKING
-        - the result is a list of samples
+        - the result, "adc_read_multi_results" from get_server_method(), has the samples of each pin,
+          see decode_samples()
         - results are raw ADC values, client needs to scale to VREF (3.3V)
 
         :param pins: list of pins
@@ -310,9 +1038,233 @@ class UPYRPC(pyboard.Pyboard):
         :param freq: rate of taking samples
         :return: success, result
         """
-        c = {'method': 'adc_read_multi', 'args': {'pins': pins, 'samples': samples, 'freq': freq}}
+        c = {'method': 'adc_read_multi', 'args': {'pins': pins, 'samples': samples, 'freq': freq, 'encoding': 'b64'}}
+        return self._verify_single_cmd_ret(c)
+
+    def adc_capture_start(self, pins, trigger, pre=100, post=400, freq=1000):
+        """ Arm a triggered capture of single or multiple pins at freq rate
+        - NON-BLOCKING, the result, "adc_capture_results", is posted with the request id after the trigger,
+          see adc_capture()
+
+        :param pins: list of pins
+        :param trigger: {"gpio": <name>, "edge": "rising"|"falling"|"both"} or
+                        {"adc": <pin of pins>, "level": <0 - 4095>, "edge": "rising"|"falling"|"both"}
+        :param pre: # of samples before the trigger
+        :param post: # of samples from the trigger
+        :param freq: rate of taking samples
+        :return: success, result
+        """
+        c = {'method': 'adc_capture', 'args': {'pins': pins, 'trigger': trigger, 'pre': pre, 'post': post,
+                                               'freq': freq, 'encoding': 'b64'}}
+        return self._verify_single_cmd_ret(c)
+
+    def adc_capture_stop(self):
+        """ Disarm a triggered capture
+
+        :return: success, result
+        """
+        c = {'method': 'adc_capture', 'args': {'enable': False}}
+        return self._verify_single_cmd_ret(c)
+
+    def adc_capture(self, pins, trigger, pre=100, post=400, freq=1000, timeout=10):
+        """ Triggered capture of single or multiple pins at freq rate, with samples from before the trigger
+        - BLOCKING until the trigger and the post samples, or timeout, the capture is disarmed on timeout
+        - the target samples into ring buffers and checks the trigger on every sample, the trigger is
+          sample pre of the capture
+        - result["value"] is {"freq": #, "pre": #, "post": #, "trigger": <trigger>, "trigger_us": <us from arming
+          to the trigger>, "ticks_us": <target time.ticks_us() of the trigger>, <pin>: <samples>, ...}, where
+          samples are a numpy array, or array('H') without numpy, see decode_samples()
+
+            success, result = pyb.adc_capture(["X19"], {"gpio": "EN", "edge": "rising"}, pre=50, post=450)
+
+        :param pins: list of pins
+        :param trigger: see adc_capture_start()
+        :param pre: # of samples before the trigger
+        :param post: # of samples from the trigger
+        :param freq: rate of taking samples
+        :param timeout: seconds to wait for the trigger, and the post samples
+        :return: success, result
+        """
+        success, result = self.adc_capture_start(pins, trigger, pre, post, freq)
+        if not success:
+            return success, result
+
+        items = self._fetch_results("adc_capture_results", result["id"], timeout, min(0.1, max(0.01, post / freq / 2)))
+        if not items:
+            self.adc_capture_stop()
+            self._fetch_results("adc_capture_results", result["id"], 0, 0)  # in case it triggered as it was stopped
+            return False, "timeout waiting for the adc_capture trigger"
+
+        decode_samples(items[0]["value"])
+        return items[0]["success"], items[0]
+
+    def adc_monitor_start(self, pins, freq=100, window_ms=1000, limits=None, hysteresis=0):
+        """ Start a background monitor of pins and internal channels on the target
+        - NON-BLOCKING, the target posts "adc_monitor_window" as each window closes, and "adc_monitor_alarm"
+          when a pin crosses its limits, see adc_monitor_windows() and adc_monitor_alarms()
+        - pins are raw 0 - 4095, internal channels (VBAT, TEMP, VREF, VDD) are in their units, limits are the same
+
+            pyb.adc_monitor_start(["X19", "VBAT"], freq=100, window_ms=5000, limits={"VBAT": [3.0, None]})
+
+        :param pins: list of pins
+        :param freq: rate of taking samples, up to 1kHz
+        :param window_ms: window of the min/max/mean stats, 0 for no windows, only alarms
+        :param limits: {<pin>: [<lo>, <hi>], ...}, lo or hi can be None
+        :param hysteresis: how far within the limits a pin has to come back to clear its alarm
+        :return: success, result
+        """
+        c = {'method': 'adc_monitor', 'args': {'pins': pins, 'freq': freq, 'window_ms': window_ms,
+                                               'limits': limits or {}, 'hysteresis': hysteresis}}
+        return self._verify_single_cmd_ret(c)
+
+    def adc_monitor_query(self):
+        """ Stats of the monitor window so far, the monitor keeps running
+        - result["value"] is {"seq": #, "samples": #, "late": #, <pin>: {"min": #, "max": #, "mean": #,
+          "alarm": "ok"|"low"|"high"}, ...}
+
+        :return: success, result
+        """
+        c = {'method': 'adc_monitor', 'args': {'query': True}}
+        return self._verify_single_cmd_ret(c)
+
+    def adc_monitor_stop(self):
+        """ Stop the monitor, result["value"] is the stats of the window so far, see adc_monitor_query()
+
+        :return: success, result
+        """
+        c = {'method': 'adc_monitor', 'args': {'enable': False}}
         return self._verify_single_cmd_ret(c)
 
+    def adc_monitor_windows(self, timeout=0):
+        """ Windows the monitor has posted, oldest first
+        - each is {"seq": #, "samples": #, "late": #, "ticks_us": #, <pin>: {"min": #, "max": #, "mean": #,
+          "alarm": <state>}, ...}, the target keeps the last few, see RET_QUEUE_LANES
+
+        :param timeout: seconds to wait for a window, 0 to return what is there
+        :return: success, [window, ...]
+        """
+        items = self._fetch_results("adc_monitor_window", None, timeout, 0.1)
+        return True, [item["value"] for item in items]
+
+    def adc_monitor_alarms(self, timeout=0):
+        """ Alarms the monitor has posted, oldest first
+        - each is {"pin": <pin>, "alarm": "ok"|"low"|"high", "value": #, "limits": [lo, hi], "ticks_us": #},
+          "ok" is posted when the pin comes back within its limits
+
+        :param timeout: seconds to wait for an alarm, 0 to return what is there
+        :return: success, [alarm, ...]
+        """
+        items = self._fetch_results("adc_monitor_alarm", None, timeout, 0.1)
+        return True, [item["value"] for item in items]
+
+    def adc_stream_start(self, pins, freq=1000, chunk=100, chunks=0):
+        """ Start streaming single or multiple pins at freq rate
+        - NON-BLOCKING, samples are posted in chunks as "adc_stream_chunk" results, see adc_stream()
+        - results are raw ADC values, client needs to scale to VREF (3.3V)
+
+        :param pins: list of pins
+        :param freq: rate of taking samples
+        :param chunk: # of samples per chunk
+        :param chunks: # of chunks to take, 0 streams until adc_stream_stop()
+        :return: success, result
+        """
+        c = {'method': 'adc_stream', 'args': {'pins': pins, 'freq': freq, 'chunk': chunk, 'chunks': chunks,
+                                              'encoding': 'b64'}}
+        return self._verify_single_cmd_ret(c)
+
+    def adc_stream_stop(self):
+        """ Stop streaming
+
+        :return: success, result
+        """
+        c = {'method': 'adc_stream', 'args': {'enable': False}}
+        return self._verify_single_cmd_ret(c)
+
+    def adc_stream(self, pins, freq=1000, chunk=100, chunks=0, timeout=None):
+        """ Stream single or multiple pins at freq rate, for as long as needed
+        - a generator, the stream is stopped when the generator is closed, or after chunks chunks,
+
+            for c in pyb.adc_stream(["X19"], freq=1000, chunk=250):
+                process(c["X19"])
+                if done: break
+
+        - each chunk is a dict, {"seq": #, "samples": #, "freq": #, "overruns": #, "last": bool, <pin>: <samples>, ...}
+          where samples are a numpy array, or array('H') without numpy, see decode_samples()
+          "overruns" counts chunks the target dropped because the host did not keep up, whether
+          overwritten in the chunk buffers or dropped from the full result queue
+        - push mode (push=True) is recommended, so chunks are sent as they are made
+
+        :param pins: list of pins
+        :param freq: rate of taking samples
+        :param chunk: # of samples per chunk
+        :param chunks: # of chunks to take, 0 streams until the generator is closed
+        :param timeout: seconds to wait for a chunk, default is twice the chunk time, at least 1 second
+        :return: generator of chunks
+        """
+        success, result = self.adc_stream_start(pins, freq, chunk, chunks)
+        if not success:
+            self.logger.error("adc_stream failed to start: {}".format(result))
+            return
+
+        rid = result["id"]
+        if timeout is None: timeout = max(1.0, 2.0 * chunk / freq)
+        poll_s = min(0.1, max(0.01, chunk / freq / 2))
+
+        last = False
+        try:
+            while not last:
+                items = self._fetch_results("adc_stream_chunk", rid, timeout, poll_s)
+                if not items:
+                    self.logger.error("adc_stream timeout waiting for a chunk")
+                    return
+
+                for item in items:
+                    value = decode_samples(item["value"])
+                    last = value.get("last", False)
+                    yield value
+
+        finally:
+            if not last:
+                self.adc_stream_stop()
+                self._fetch_results("adc_stream_chunk", rid, 0, 0)  # discard chunks made before it stopped
+
+    def _fetch_results(self, method, rid, timeout, poll_s):
+        """ get the results of a request that are ready, waits up to timeout for at least one
+        - for results posted after the request returned, like the chunks of adc_stream()
+
+        :param method: method of the results
+        :param rid: request id, None for any
+        :param timeout: seconds
+        :param poll_s: delay between polls, when not in push mode
+        :return: [item, ...] in order ("seq" of the value), empty on timeout
+        """
+        def _match(r):
+            return (rid is None or r.get("id", None) == rid) and r.get("method", None) == method
+
+        if self._pushing:
+            return self._wait_pushed(_match, all=True, timeout=timeout)
+
+        deadline = time.time() + timeout
+        while True:
+            success, result = self._server_ret(method, all=True, id=rid)
+            if not success:
+                self.logger.error(result)
+                return []
+            items = []
+            for r in result:  # the other results of the request, and _debug results, come with it
+                if _match(r):
+                    items.append(r)
+                elif r.get("method", False) == "_debug":
+                    self.logger.debug("PYBOARD DEBUG: {}".format(r["value"]))
+                else:
+                    self.logger.warning("{} unexpected result dropped {}".format(self.device, r))
+            result = items
+            if result:
+                return sorted(result, key=lambda r: r["value"].get("seq", 0))
+            if time.time() >= deadline:
+                return []
+            time.sleep(poll_s)
+
     def init_gpio(self, name, pin, mode, pull):
         """ Init GPIO
 
@@ -342,6 +1294,87 @@ class UPYRPC(pyboard.Pyboard):
         c = {'method': 'set_gpio', 'args': {'name': name, 'value': value}}
         return self._verify_single_cmd_ret(c)
 
+    def set_gpios(self, values):
+        """ Set many GPIOs in one command
+        - nothing is set if any of the GPIOs has not been initialized
+
+        :param values: {<name>: True|False, ...}
+        :return: success, result
+        """
+        c = {'method': 'set_gpios', 'args': {'values': values}}
+        return self._verify_single_cmd_ret(c)
+
+    def get_gpios(self, names):
+        """ Get many GPIOs in one command
+
+        :param names: list of GPIO names
+        :return: success, result, result["value"]["values"] is {<name>: 0|1, ...}
+        """
+        c = {'method': 'get_gpios', 'args': {'names': names}}
+        return self._verify_single_cmd_ret(c)
+
+    def get_gpio_ports(self, ports=None):
+        """ Snapshot of whole GPIO ports, all the pins of a port are read at the same instant
+        - use decode_gpio_ports() on the result value for the levels of the named GPIOs
+
+        :param ports: list of port letters, ["A", "C"], None for the ports of the initialized GPIOs
+        :return: success, result, result["value"] is {'ports': {<port>: <bitmask>, ...},
+                 'pins': {<name>: [<port>, <bit>], ...}}
+        """
+        args = {}
+        if ports is not None: args['ports'] = ports
+        c = {'method': 'get_gpio_ports', 'args': args}
+        return self._verify_single_cmd_ret(c)
+
+    def gpio_seq_start(self, steps, tick_us=100):
+        """ Start a sequence of GPIO steps, timed on the target
+        - NON-BLOCKING, the result, "gpio_seq_results", is posted with the request id when the sequence is
+          done, see gpio_seq()
+
+        :param steps: [(<name>, <level>, <delay_us>), ...], set GPIO <name> to <level>, then wait <delay_us>
+                      before the next step
+        :param tick_us: timer tick on the target, delays are rounded to it
+        :return: success, result
+        """
+        steps = [[name, bool(level), int(delay_us)] for name, level, delay_us in steps]
+        c = {'method': 'gpio_seq', 'args': {'steps': steps, 'tick_us': tick_us}}
+        return self._verify_single_cmd_ret(c)
+
+    def gpio_seq_stop(self):
+        """ Stop a sequence, the steps run so far are posted as "gpio_seq_results" with "stopped": True
+
+        :return: success, result
+        """
+        c = {'method': 'gpio_seq', 'args': {'enable': False}}
+        return self._verify_single_cmd_ret(c)
+
+    def gpio_seq(self, steps, tick_us=100, timeout=None):
+        """ Run a sequence of GPIO steps on the target, one command instead of a set_gpio() and a sleep
+        per edge, the edges are timed by a timer interrupt on the target
+        - BLOCKING until the sequence is done
+        - result["value"] is {"steps": #, "tick_us": #, "edges_us": [...], "expected_us": [...], "max_error_us": #,
+          "stopped": bool}, the time of every edge relative to the first step, as run and as asked
+
+            success, result = pyb.gpio_seq([("reset", 0, 10000), ("reset", 1, 0)])
+
+        :param steps: [(<name>, <level>, <delay_us>), ...], see gpio_seq_start()
+        :param tick_us: timer tick on the target, delays are rounded to it
+        :param timeout: seconds to wait for the results, default is twice the sequence time plus 1 second
+        :return: success, result
+        """
+        success, result = self.gpio_seq_start(steps, tick_us)
+        if not success:
+            return success, result
+
+        duration_s = sum(int(step[2]) for step in steps) / 1000000
+        if timeout is None: timeout = 1.0 + 2.0 * duration_s
+        items = self._fetch_results("gpio_seq_results", result["id"], timeout, min(0.1, max(0.01, duration_s / 10)))
+        if not items:
+            self.gpio_seq_stop()
+            self._fetch_results("gpio_seq_results", result["id"], 0.5, 0.1)  # discard the stopped results
+            return False, "timeout waiting for gpio_seq results"
+        return items[0]["success"], items[0]
+
     def reset(self):
         """ Reset the I2C devices to a known/default state
 
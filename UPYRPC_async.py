@@ -0,0 +1,491 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+MIT License
+
+Copyright (c) 2019 sistemicorp
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+asyncio client for the MicroPython server, the same wrapper API as UPYRPC, but every wrapper
+returns an awaitable.  Many requests can be outstanding at once, on one board or many,
+
+    async def main():
+        pyb = AsyncUPYRPC("/dev/ttyACM0")
+        success, result = await pyb.start_server()
+        # check for success, and error handle...
+
+        results = await asyncio.gather(pyb.adc_read("X19"), pyb.adc_read("X20"), pyb.version())
+
+        await pyb.close()
+
+    asyncio.run(main())
+
+The server is always driven in push mode.  The serial port is read by the event loop
+(loop.add_reader), so this only works on event loops that support add_reader, ie not on
+the Windows proactor loop.
+"""
+import json
+import time
+import struct
+import asyncio
+import collections
+
+import ampy.pyboard as pyboard
+
+from UPYRPC import UPYRPC, decode_samples, _decode_results
+from target.upyrpc_const import *
+from target.upyrpc_frame import FRAME_MAGIC, crc16, encode_obj
+
+VERSION = "0.2.0"
+
+
+class FrameDecoder(object):
+    """ Incremental frame decoder, for reading frames from a non-blocking stream
+    - see target/upyrpc_frame.py for the frame format
+    """
+    def __init__(self):
+        self._buf = bytearray()
+        self.crc_errors = 0
+        self.last = False  # set to stop at the next reply, the bytes after it are kept for rest()
+
+    def feed(self, data):
+        """ add received bytes
+
+        :param data: bytes
+        :return: [(ftype, payload), ...] of the frames completed by data
+        """
+        self._buf += data
+        frames = []
+        while True:
+            start = self._buf.find(FRAME_MAGIC)
+            if start < 0:
+                self._buf.clear()
+                break
+            del self._buf[:start]
+
+            if len(self._buf) < 4: break
+            ftype, length = struct.unpack_from("<BH", self._buf, 1)
+            end = 4 + length + 2
+            if len(self._buf) < end: break
+
+            header = bytes(self._buf[1:4])
+            payload = bytes(self._buf[4:4 + length])
+            crc = struct.unpack_from("<H", self._buf, 4 + length)[0]
+            if crc16(payload, crc16(header)) != crc:
+                # not a frame, or a corrupt one, resync on the next magic byte
+                self.crc_errors += 1
+                del self._buf[:1]
+                continue
+
+            del self._buf[:end]
+            frames.append((ftype, payload))
+            if self.last and ftype != FRAME_PUSH: break
+
+        return frames
+
+    def rest(self):
+        """ bytes received after the last reply, see FrameDecoder.last
+
+        :return: bytes
+        """
+        data = bytes(self._buf)
+        self._buf = bytearray()
+        return data
+
+
+class AsyncUPYRPC(UPYRPC):
+    """ asyncio version of UPYRPC
+
+    - the wrapper API of UPYRPC is inherited, the wrappers return awaitables
+    - replies and pushed results are read by a single reader callback on the event loop,
+      and are matched to the waiting requests by request id
+    - start_server() and close() block in an executor while the REPL is used
+
+    """
+    def __init__(self, device, baudrate=115200, user='micro', password='python', wait=0, rawdelay=0, loggerIn=None,
+                 attach=False, latency=True):
+        super().__init__(device, baudrate, user, password, wait, rawdelay, loggerIn=loggerIn, attach=attach,
+                         latency=latency)
+        self._loop = None
+        self._serving = False  # True while the target is in serve_frames()
+        self._decoder = FrameDecoder()
+        self._reply_waiters = collections.deque()  # replies come back in request order
+        self._result_waiters = {}                  # request id -> future
+        self._push_event = None
+
+    # -------------------------------------------------------------------------------------------------
+    # reader
+
+    def _on_readable(self):
+        """ event loop reader callback for the serial port
+        """
+        try:
+            data = self.serial.read(self.serial.in_waiting or 1)
+        except OSError as er:
+            self.logger.error(er)
+            self._loop.remove_reader(self.serial.fileno())
+            return
+
+        for ftype, payload in self._decoder.feed(data):
+            obj = json.loads(payload.decode("utf-8"))
+            if ftype != FRAME_PUSH:
+                if self._decoder.last:
+                    # the target is back in the REPL, stop reading so close() can follow it
+                    self._loop.remove_reader(self.serial.fileno())
+                if not self._reply_waiters:
+                    self.logger.error("{} unexpected reply {}".format(self.device, obj))
+                    continue
+                fut = self._reply_waiters.popleft()
+                if not fut.done(): fut.set_result((ftype, obj))
+                continue
+
+            self.logger.debug("{} push: {}".format(self.device, obj))
+            if obj.get("method", False) == "_debug":
+                self.logger.debug("PYBOARD DEBUG: {}".format(obj["value"]))
+                continue
+
+            fut = self._result_waiters.pop(obj.get("id", None), None)
+            if fut is not None and not fut.done():
+                fut.set_result(obj)
+                continue
+
+            self._pushed.append(obj)
+            if len(self._pushed) > self.PUSH_MAX_ITEMS:
+                dropped = self._pushed.pop(0)
+                self.logger.warning("{} dropped pushed result {}".format(self.device, dropped))
+            self._push_event.set()
+
+    async def _request(self, ftype, obj, phases=None):
+        """ send a frame and wait for the reply
+
+        :param phases: {phase: seconds}, the encode, write and exec times are added, see UPYRPC_latency.py
+        """
+        if not self._serving:
+            return False, "server is not running"
+
+        fut = self._loop.create_future()
+        self._reply_waiters.append(fut)
+        try:
+            t0 = time.perf_counter()
+            frame = encode_obj(ftype, obj)
+            t1 = time.perf_counter()
+            self.serial.write(frame)
+            t2 = time.perf_counter()
+            rtype, result = await asyncio.wait_for(fut, self.FRAME_TIMEOUT_S)
+            if phases is not None:
+                phases.update(encode=t1 - t0, write=t2 - t1, exec=time.perf_counter() - t2)
+        except asyncio.TimeoutError:
+            self.logger.error("{} timeout waiting for reply".format(self.device))
+            return False, "timeout waiting for reply"
+        except OSError as er:
+            self.logger.error(er)
+            return False, str(er)
+        finally:
+            if fut in self._reply_waiters: self._reply_waiters.remove(fut)
+
+        self.logger.debug("{} frame {}: {}".format(self.device, rtype, result))
+        if rtype != FRAME_REPLY:
+            self.logger.error(result)
+            return False, result
+
+        return True, result
+
+    async def _wait_pushed_async(self, match, all=False, remove=True, timeout=None):
+        """ wait for pushed result(s) that did not have a waiter, see UPYRPC._wait_pushed
+        """
+        if timeout is None: timeout = self.PUSH_TIMEOUT_S
+        deadline = self._loop.time() + timeout
+        while True:
+            items = [r for r in self._pushed if match(r)]
+            if items:
+                if not all: items = items[:1]
+                if remove:
+                    for r in items: self._pushed.remove(r)
+                return items
+
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                return []
+            self._push_event.clear()
+            try:
+                await asyncio.wait_for(self._push_event.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _result(self, value):
+        return value
+
+    def _error(self, msg):
+        self.logger.error(msg)
+        return self._result((False, msg))
+
+    async def _verify_single_cmd_ret(self, cmd_dict, delay_poll_s=None):
+        """ send a command, and wait for its pushed result
+        - the latency of the call is recorded in self.latency, without decode times, the
+          replies are decoded by the reader callback
+        """
+        if self.latency is None:
+            return await self._cmd_ret_async(cmd_dict, None)
+
+        phases = {}
+        start = time.perf_counter()
+        try:
+            return await self._cmd_ret_async(cmd_dict, phases)
+        finally:
+            phases["total"] = time.perf_counter() - start
+            self.latency.record(cmd_dict.get("method", None), phases)
+
+    async def _cmd_ret_async(self, cmd_dict, phases):
+        method = cmd_dict.get("method", None)
+        args = cmd_dict.get("args", None)
+
+        if method is None:
+            return False, "method not specified"
+
+        if args is None:
+            return False, "args not specified"
+
+        rid = next(self._ids)
+        fut = self._loop.create_future()
+        self._result_waiters[rid] = fut
+        try:
+            success, result = await self._request(FRAME_CMD, dict(cmd_dict, id=rid), phases)
+            if success and not result:
+                success, result = False, "server rejected cmd {}".format(method)
+            if not success:
+                self.logger.error("{} {}".format(success, result))
+                return success, result
+
+            t = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(fut, self.PUSH_TIMEOUT_S)
+            except asyncio.TimeoutError:
+                return False, "Failed to verify method {} was executed".format(method)
+            finally:
+                if phases is not None: phases["wait"] = time.perf_counter() - t
+        finally:
+            self._result_waiters.pop(rid, None)
+
+        if result.get("method", False) == "cmd":
+            self.logger.error("{} {}".format(method, result["value"]))
+            return False, result  # server rejected the command
+
+        return result["success"], result
+
+    # -------------------------------------------------------------------------------------------------
+    # API
+
+    def _start_repl(self, version):
+        success, result = UPYRPC.start_server(self, version)
+        if not success:
+            return success, result
+
+        with self.lock:
+            try:
+                self.exec_raw_no_follow("upyrpc_main.upyrpc.serve_frames()")
+            except pyboard.PyboardError as er:
+                self.logger.error(er)
+                return False, str(er)
+        return True, result
+
+    async def start_server(self, version=None):
+        """ Starts the Server on the target, see UPYRPC.start_server()
+        - must be awaited from the event loop that will be used for all requests
+
+        :param version: server version required to attach to a running server, None for any
+        :return: success, result
+        """
+        self._loop = asyncio.get_running_loop()
+        self._push_event = asyncio.Event()
+
+        success, result = await self._loop.run_in_executor(None, self._start_repl, version)
+        if not success:
+            return success, result
+
+        self.serial.timeout = 0
+        self._serving = True
+        self._decoder = FrameDecoder()
+        self._loop.add_reader(self.serial.fileno(), self._on_readable)
+        if self.serial.in_waiting: self._loop.call_soon(self._on_readable)  # already buffered by the transport
+
+        success, result = await self._request(FRAME_CONFIG, {"push": True})
+        if not success:
+            return success, result
+        self._pushing = True
+        return True, result
+
+    async def close(self):
+        if self._serving:
+            self._decoder.last = True
+            success, result = await self._request(FRAME_EXIT, None)
+            self._serving = False
+            self._pushing = False
+            self._loop.remove_reader(self.serial.fileno())
+            self.serial.timeout = None
+            if success:
+                try:
+                    await self._loop.run_in_executor(None, self._follow_rest, self._decoder.rest())
+                except pyboard.PyboardError as er:
+                    self.logger.error(er)
+        pyboard.Pyboard.close(self)
+
+    def _follow_rest(self, data):
+        """ Pyboard.follow(), for when the reader already consumed some of the REPL output
+
+        :param data: bytes received after the EXIT reply
+        """
+        for _ in range(2 - data.count(b"\x04")):
+            if not self.read_until(1, b"\x04", timeout=self.FRAME_TIMEOUT_S).endswith(b"\x04"):
+                raise pyboard.PyboardError("timeout waiting for EOF reception")
+
+    def server_cmd(self, cmds, repl_enter=True, repl_exit=True, blocking=True):
+        """ see UPYRPC.server_cmd()
+        - this is NOT a coroutine, and exec is not available once the server is started
+        """
+        if self._serving:
+            self.logger.error("server_cmd is not available while the server is running")
+            return False, "server_cmd is not available while the server is running"
+        return super().server_cmd(cmds, repl_enter, repl_exit, blocking)
+
+    async def get_server_method(self, method, all=False):
+        """ Get return value message(s) from the server for a specific method, see UPYRPC.get_server_method()
+
+        :param method:
+        :param all: set True for all the return messages
+        :return: success, result
+        """
+        result = await self._wait_pushed_async(lambda r: r.get("method", None) == method, all, timeout=0.5)
+        if not result:
+            return False, "Failed to find method {}".format(method)
+        return True, _decode_results(result)
+
+    async def peek_server_method(self, method=None, all=False):
+        """ Peek return message value(s) from the server for a specific method, see UPYRPC.peek_server_method()
+
+        :param method:
+        :param all: set True for all the return messages
+        :return: success, result
+        """
+        result = await self._wait_pushed_async(lambda r: method is None or r.get("method", None) == method, all,
+                                               remove=False, timeout=0.5)
+        if not result:
+            return False, "Failed to find method {}".format(method)
+        return True, _decode_results(result)
+
+    async def adc_monitor_windows(self, timeout=0):
+        """ Windows the monitor has posted, see UPYRPC.adc_monitor_windows()
+
+        :return: success, [window, ...]
+        """
+        items = await self._wait_pushed_async(lambda r: r.get("method", None) == "adc_monitor_window",
+                                              all=True, timeout=timeout)
+        return True, sorted([item["value"] for item in items], key=lambda v: v["seq"])
+
+    async def adc_monitor_alarms(self, timeout=0):
+        """ Alarms the monitor has posted, see UPYRPC.adc_monitor_alarms()
+
+        :return: success, [alarm, ...]
+        """
+        items = await self._wait_pushed_async(lambda r: r.get("method", None) == "adc_monitor_alarm",
+                                              all=True, timeout=timeout)
+        return True, [item["value"] for item in items]
+
+    async def adc_capture(self, pins, trigger, pre=100, post=400, freq=1000, timeout=10):
+        """ Triggered capture of single or multiple pins at freq rate, see UPYRPC.adc_capture()
+
+        :return: success, result
+        """
+        success, result = await self.adc_capture_start(pins, trigger, pre, post, freq)
+        if not success:
+            return success, result
+
+        rid = result["id"]
+
+        def _match(r):
+            return r.get("id", None) == rid and r.get("method", None) == "adc_capture_results"
+
+        items = await self._wait_pushed_async(_match, timeout=timeout)
+        if not items:
+            await self.adc_capture_stop()
+            await self._wait_pushed_async(_match, timeout=0)  # in case it triggered as it was stopped
+            return False, "timeout waiting for the adc_capture trigger"
+
+        decode_samples(items[0]["value"])
+        return items[0]["success"], items[0]
+
+    async def gpio_seq(self, steps, tick_us=100, timeout=None):
+        """ Run a sequence of GPIO steps on the target, see UPYRPC.gpio_seq()
+
+        :return: success, result
+        """
+        success, result = await self.gpio_seq_start(steps, tick_us)
+        if not success:
+            return success, result
+
+        rid = result["id"]
+        if timeout is None: timeout = 1.0 + 2.0 * sum(int(step[2]) for step in steps) / 1000000
+
+        def _match(r):
+            return r.get("id", None) == rid and r.get("method", None) == "gpio_seq_results"
+
+        items = await self._wait_pushed_async(_match, timeout=timeout)
+        if not items:
+            await self.gpio_seq_stop()
+            await self._wait_pushed_async(_match, timeout=0.5)  # discard the stopped results
+            return False, "timeout waiting for gpio_seq results"
+        return items[0]["success"], items[0]
+
+    async def adc_stream(self, pins, freq=1000, chunk=100, chunks=0, timeout=None):
+        """ Stream single or multiple pins at freq rate, see UPYRPC.adc_stream()
+        - an async generator,
+
+            async for c in pyb.adc_stream(["X19"], freq=1000, chunk=250):
+                process(c["X19"])
+
+        :return: async generator of chunks
+        """
+        success, result = await self.adc_stream_start(pins, freq, chunk, chunks)
+        if not success:
+            self.logger.error("adc_stream failed to start: {}".format(result))
+            return
+
+        rid = result["id"]
+        if timeout is None: timeout = max(1.0, 2.0 * chunk / freq)
+
+        def _match(r):
+            return r.get("id", None) == rid and r.get("method", None) == "adc_stream_chunk"
+
+        last = False
+        try:
+            while not last:
+                items = await self._wait_pushed_async(_match, all=True, timeout=timeout)
+                if not items:
+                    self.logger.error("adc_stream timeout waiting for a chunk")
+                    return
+
+                for item in items:
+                    value = decode_samples(item["value"])
+                    last = value.get("last", False)
+                    yield value
+
+        finally:
+            if not last:
+                await self.adc_stream_stop()
+                await self._wait_pushed_async(_match, all=True, timeout=0)
@@ -30,7 +30,8 @@ import time
 import logging
 import argparse
 
-from UPYRPC import UPYRPC
+from UPYRPC import UPYRPC, decode_gpio_ports
+from UPYRPC_daemon import UPYRPCClient, DEFAULT_SOCKET
 from target.upyrpc_const import *
 
 VERSION = "0.2.0"
@@ -49,11 +50,16 @@ def parse_args():
                                      epilog=epilog)
 
     parser.add_argument("-p", '--port', dest='port', default=None, type=str,
-                        action='store', help='Active serial port')
+                        action='store', help='Active serial port, or transport URL (tcp://host:port, loop://sim)')
     parser.add_argument("-a", '--all', dest='all_funcs', default=0, action='store_true', help='run all tests')
 
     parser.add_argument("-v", '--verbose', dest='verbose', default=0, action='count', help='Increase verbosity')
     parser.add_argument("-d", '--debug', dest='debug', default=False, action='store_true', help='Enable debug prints on pyboard')
+    parser.add_argument("-f", '--framed', dest='framed', default=False, action='store_true', help='Use the framed binary protocol')
+    parser.add_argument('--push', dest='push', default=False, action='store_true', help='Server pushes results (implies --framed)')
+    parser.add_argument('--attach', dest='attach', default=False, action='store_true', help='Use the server already running on the target, if there is one')
+    parser.add_argument('--daemon', dest='daemon', default=None, type=str, nargs='?', const=DEFAULT_SOCKET, help='Use the board through the UPYRPC_daemon.py on this socket, default {}'.format(DEFAULT_SOCKET))
+    parser.add_argument('--latency', dest='latency', default=False, action='store_true', help='Log call latency percentiles at the end')
     parser.add_argument("--version", dest="show_version", action='store_true', help='Show version and exit')
 
     subp = parser.add_subparsers(dest="_cmd", help='commands')
@@ -66,7 +72,11 @@ def parse_args():
     adc_parser = subp.add_parser('adc')
     adc_parser.add_argument('-a', "--all", dest="all", action='store_true', help='run all tests sequentially', default=False, required=False)
     adc_parser.add_argument('--100', dest="t100", action='store_true', help='adc_read', default=False, required=False)
+    adc_parser.add_argument('--101', dest="t101", action='store_true', help='adc_read statistics', default=False, required=False)
     adc_parser.add_argument('--200', dest="t200", action='store_true', help='adc_read_multi', default=False, required=False)
+    adc_parser.add_argument('--300', dest="t300", action='store_true', help='adc_stream', default=False, required=False)
+    adc_parser.add_argument('--400', dest="t400", action='store_true', help='adc_capture, triggered by X19 crossing mid scale', default=False, required=False)
+    adc_parser.add_argument('--500', dest="t500", action='store_true', help='adc_monitor of X19 and VBAT, 500ms windows', default=False, required=False)
 
     pwm_parser = subp.add_parser('pwm')
     pwm_parser.add_argument('-a', "--all", dest="all", action='store_true', help='run all tests sequentially', default=False, required=False)
@@ -80,6 +90,13 @@ def parse_args():
     misc_parser.add_argument('--400', dest="t400", action='store_true', help='long running example', default=False, required=False)
     misc_parser.add_argument('--500', dest="t500", action='store_true', help='Init GPIO Y1 PP', default=False, required=False)
     misc_parser.add_argument('--501', dest="t501", action='store_true', help='Init GPIO X12 Input Pull-UP', default=False, required=False)
+    misc_parser.add_argument('--102', dest="t102", action='store_true', help='server queue stats', default=False, required=False)
+    misc_parser.add_argument('--103', dest="t103", action='store_true', help='ping server', default=False, required=False)
+    misc_parser.add_argument('--104', dest="t104", action='store_true', help='server stats', default=False, required=False)
+    misc_parser.add_argument('--502', dest="t502", action='store_true', help='Set and get GPIOs Y1-Y4 in one command', default=False, required=False)
+    misc_parser.add_argument('--503', dest="t503", action='store_true', help='GPIO sequence on Y1, Y2', default=False, required=False)
+    misc_parser.add_argument('--600', dest="t600", action='store_true', help='Batch of GPIO commands', default=False, required=False)
+    misc_parser.add_argument('--601', dest="t601", action='store_true', help='Recipe of GPIO and ADC steps with limits, run twice', default=False, required=False)
 
     args = parser.parse_args()
 
@@ -177,6 +194,14 @@ def test_adc(args, pyb):
 
         if _success and not success: _success = False
 
+    if all or args.t101:
+        did_something = True
+        logging.info("T101: Reading ADC statistics of 1000 samples...")
+        success, result = pyb.adc_read("X19", samples=1000, samples_ms=0, stats=["mean", "min", "max", "std"], bins=16)
+        logging.info("{} {}".format(success, result))
+
+        if _success and not success: _success = False
+
     if all or args.t200:
         did_something = True
 
@@ -188,6 +213,58 @@ def test_adc(args, pyb):
 
         if _success and not success: _success = False
 
+    if all or args.t300:
+        did_something = True
+
+        logging.info("T300: Streaming ADC, 10 chunks of 100 samples at 1kHz...")
+        chunks = 0
+        for chunk in pyb.adc_stream(pins=["X19", "X20"], freq=1000, chunk=100, chunks=10):
+            logging.info("chunk {} overruns {}: X19 {} ... X20 {} ...".format(chunk["seq"], chunk["overruns"],
+                                                                            chunk["X19"][:4].tolist(),
+                                                                            chunk["X20"][:4].tolist()))
+            chunks += 1
+        success = chunks == 10
+        logging.info("{} {} chunks".format(success, chunks))
+
+        if _success and not success: _success = False
+
+    if all or args.t400:
+        did_something = True
+
+        logging.info("T400: Triggered ADC capture, 20 samples before and 80 from X19 crossing mid scale...")
+        success, result = pyb.adc_capture(pins=["X19", "X20"], trigger={"adc": "X19", "level": 2048, "edge": "both"},
+                                          pre=20, post=80, freq=1000, timeout=5)
+        if success:
+            value = result["value"]
+            logging.info("{} trigger at {} us: X19 {} ... X20 {} ...".format(success, value["trigger_us"],
+                                                                        value["X19"][18:22].tolist(),
+                                                                        value["X20"][18:22].tolist()))
+        else:
+            logging.info("{} {}".format(success, result))
+
+        if _success and not success: _success = False
+
+    if all or args.t500:
+        did_something = True
+
+        logging.info("T500: Monitoring X19 and VBAT at 100Hz for 2 seconds, 500ms windows, X19 limits 1000 - 3000...")
+        success, result = pyb.adc_monitor_start(pins=["X19", "VBAT"], freq=100, window_ms=500,
+                                                limits={"X19": [1000, 3000]}, hysteresis=50)
+        logging.info("{} {}".format(success, result))
+        if success:
+            time.sleep(2)
+            success, result = pyb.adc_monitor_stop()
+            logging.info("{} {}".format(success, result))
+            _, windows = pyb.adc_monitor_windows()
+            for window in windows:
+                logging.info("window {}: X19 {}, VBAT {}".format(window["seq"], window["X19"], window["VBAT"]))
+            _, alarms = pyb.adc_monitor_alarms()
+            for alarm in alarms:
+                logging.info("alarm {}".format(alarm))
+            success = success and len(windows) >= 3
+
+        if _success and not success: _success = False
+
     if did_something: return _success
     else: logging.error("No Tests were specified")
     return False
@@ -236,6 +313,30 @@ def test_misc(args, pyb):
 
         if _success and not success: _success = False
 
+    if all or args.t102:
+        did_something = True
+        logging.info("T102: Reading server queue stats...")
+        success, result = pyb.queue_stats()
+        logging.info("{} {}".format(success, result))
+
+        if _success and not success: _success = False
+
+    if all or args.t103:
+        did_something = True
+        logging.info("T103: Ping server...")
+        success, result = pyb.ping()
+        logging.info("{} {}".format(success, result))
+
+        if _success and not success: _success = False
+
+    if all or args.t104:
+        did_something = True
+        logging.info("T104: Reading server stats...")
+        success, result = pyb.stats()
+        logging.info("{} {}".format(success, result))
+
+        if _success and not success: _success = False
+
     if all or args.t200:
         did_something = True
         logging.info("T200: Reading version and uname...")
@@ -285,6 +386,67 @@ def test_misc(args, pyb):
 
         if _success and not success: _success = False
 
+    if all or args.t502:
+        did_something = True
+        logging.info("T502: set and get GPIOs Y1-Y4 in one command...")
+        pins = ["Y1", "Y2", "Y3", "Y4"]
+        for pin in pins:
+            success, result = pyb.init_gpio(pin, pin, PYB_PIN_OUT_PP, PYB_PIN_PULLNONE)
+            if _success and not success: _success = False
+
+        success, result = pyb.set_gpios({"Y1": True, "Y2": False, "Y3": True, "Y4": False})
+        logging.info("{} {}".format(success, result))
+        if _success and not success: _success = False
+
+        success, result = pyb.get_gpios(pins)
+        logging.info("{} {}".format(success, result))
+        if _success and not success: _success = False
+
+        success, result = pyb.get_gpio_ports()
+        logging.info("{} {}".format(success, result))
+        if success: logging.info("levels: {}".format(decode_gpio_ports(result["value"])))
+        if _success and not success: _success = False
+
+    if all or args.t503:
+        did_something = True
+        logging.info("T503: GPIO sequence on Y1, Y2...")
+        for pin in ["Y1", "Y2"]:
+            success, result = pyb.init_gpio(pin, pin, PYB_PIN_OUT_PP, PYB_PIN_PULLNONE)
+            if _success and not success: _success = False
+
+        steps = [("Y1", 1, 0), ("Y2", 1, 1000), ("Y1", 0, 500), ("Y1", 1, 10000), ("Y1", 0, 0), ("Y2", 0, 0)]
+        success, result = pyb.gpio_seq(steps)
+        logging.info("{} {}".format(success, result))
+
+        if _success and not success: _success = False
+
+    if all or args.t600:
+        did_something = True
+        logging.info("T600: batch of GPIO commands...")
+        with pyb.batch() as b:
+            b.init_gpio("foo", "Y1", PYB_PIN_OUT_PP, PYB_PIN_PULLNONE)
+            b.set_gpio("foo", True)
+            b.set_gpio("foo", False)
+            b.get_gpio("foo")
+        logging.info("{} {}".format(b.success, b.results))
+
+        if _success and not b.success: _success = False
+
+    if all or args.t601:
+        did_something = True
+        logging.info("T601: recipe of GPIO and ADC steps with limits, run twice...")
+        recipe = pyb.recipe()
+        recipe.init_gpio("foo", "Y1", PYB_PIN_OUT_PP, PYB_PIN_PULLNONE)
+        recipe.set_gpio("foo", True)
+        recipe.get_gpio("foo")
+        recipe.limit("value", 1, 1)
+        recipe.adc_read("X19")
+        recipe.limit("value", 0, 4095)
+        for _ in range(2):  # the second run only sends the hash of the recipe
+            success, result = recipe.run()
+            logging.info("{} {}".format(success, result))
+            if _success and not (success and recipe.passed): _success = False
+
     if did_something: return _success
     else: logging.error("No Tests were specified")
     return False
@@ -300,13 +462,17 @@ if __name__ == '__main__':
     else:
         logging.basicConfig(level=logging.DEBUG, format='%(filename)20s %(levelname)6s %(lineno)4s %(message)s')
 
-    pyb = UPYRPC(args.port, loggerIn=logging)
+    if args.daemon:
+        pyb = UPYRPCClient(args.daemon, args.port, loggerIn=logging)
+    else:
+        pyb = UPYRPC(args.port, loggerIn=logging, framed=args.framed, push=args.push, attach=args.attach)
 
     success, result = pyb.start_server()
     if not success:
         logging.error("Unable to start server")
         pyb.close()
         exit(1)
+    logging.info("startup: {}".format(pyb.startup))
 
     if args.debug:
         logging.info("Debug: enabling...")
@@ -345,6 +511,12 @@ if __name__ == '__main__':
             pyb.close()
             exit(1)
 
+    if args.latency and pyb.latency is not None:
+        for method, phases in pyb.latency.snapshot().items():
+            for phase, stats in phases.items():
+                logging.info("latency {:20s} {:8s} n {:4d} p50 {:.4f} p95 {:.4f} p99 {:.4f}".format(
+                    method, phase, stats["count"], stats["p50"], stats["p95"], stats["p99"]))
+
     logging.info("all tests passed")
     pyb.close()
 
@@ -0,0 +1,439 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+MIT License
+
+Copyright (c) 2019 sistemicorp
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Local daemon that keeps the boards open, so scripts don't pay for opening the port and starting
+the server every time they run,
+
+    $ python3 UPYRPC_daemon.py --push &
+    $ python3 UPYRPC_cli.py --daemon --port /dev/ttyACM0 misc --200
+
+Scripts use UPYRPCClient in place of UPYRPC, it has the same wrapper API,
+
+    pyb = UPYRPCClient(DEFAULT_SOCKET, "/dev/ttyACM0")
+    success, result = pyb.start_server()  # opens the board in the daemon, if it is not already open
+    success, result = pyb.version()
+    pyb.close()  # the board stays open in the daemon
+
+A board is opened the first time a client asks for it, and is shared by all the clients.  Requests
+from different clients are sent to the board as they come, their results are matched by request id.
+
+The socket is only accessible by the user running the daemon, and by default is in $XDG_RUNTIME_DIR.
+Clients can only call the RPC wrappers in DAEMON_METHODS, not server_cmd() or frame_cmd(), which
+run anything on the target.
+"""
+import os
+import sys
+import json
+import array
+import base64
+import socket
+import signal
+import logging
+import argparse
+import tempfile
+import functools
+import threading
+import socketserver
+
+import ampy.pyboard as pyboard
+
+from UPYRPC import UPYRPC, UPYRPCBatch, UPYRPCRecipe, decode_u16, numpy
+from stublogger import StubLogger
+
+VERSION = "0.2.0"
+
+DEFAULT_SOCKET = os.path.join(os.environ.get("XDG_RUNTIME_DIR", None) or tempfile.gettempdir(), "upyrpc.sock")
+
+# UPYRPC wrappers the clients can call in the daemon, also in batches and recipes,
+# _fetch_results() only reads results, adc_stream() uses it from the client side
+DAEMON_METHODS = ("unique_id", "version", "ping", "debug", "queue_stats", "stats",
+                  "get_server_method", "peek_server_method", "_fetch_results",
+                  "led", "led_toggle", "reset", "pwm", "long_running_example",
+                  "adc_read", "adc_read_multi", "adc_capture_start", "adc_capture_stop", "adc_capture",
+                  "adc_monitor_start", "adc_monitor_query", "adc_monitor_stop", "adc_monitor_windows",
+                  "adc_monitor_alarms", "adc_stream_start", "adc_stream_stop",
+                  "init_gpio", "get_gpio", "set_gpio", "set_gpios", "get_gpios", "get_gpio_ports",
+                  "gpio_seq_start", "gpio_seq_stop", "gpio_seq")
+
+
+def _json_default(obj):
+    """ JSON encoding of decoded samples, see decode_u16()
+    """
+    if numpy is not None and isinstance(obj, numpy.ndarray):
+        obj = obj.astype("<u2").tobytes()
+    elif isinstance(obj, array.array):
+        if sys.byteorder == "big":
+            obj = array.array(obj.typecode, obj)
+            obj.byteswap()
+        obj = obj.tobytes()
+    else:
+        raise TypeError("{} is not JSON serializable".format(type(obj)))
+    return {"__u16__": base64.b64encode(obj).decode()}
+
+
+def _json_hook(obj):
+    if "__u16__" in obj:
+        return decode_u16(base64.b64decode(obj["__u16__"]))
+    return obj
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """ one client connection, requests and replies are one JSON object per line,
+
+        request: {"port": <port>, "method": <method>, "args": [...], "kwargs": {...}}
+        reply:   {"success": True|False, "result": <result>}
+    """
+    def handle(self):
+        daemon = self.server.daemon
+        for line in self.rfile:
+            try:
+                req = json.loads(line.decode("utf-8"))
+                if not isinstance(req, dict):
+                    raise ValueError("not a JSON object")
+                success, result = daemon.request(req.get("port", None), req.get("method", None),
+                                                 req.get("args", []), req.get("kwargs", {}))
+            except ValueError as er:
+                success, result = False, "invalid request: {}".format(er)
+
+            reply = json.dumps({"success": success, "result": result}, default=_json_default)
+            self.wfile.write(reply.encode("utf-8") + b"\n")
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class UPYRPCDaemon(object):
+    """ Owns the UPYRPC sessions of the boards, and serves their clients on a Unix socket
+
+    Boards are opened with attach=True, so restarting the daemon does not reset the boards.
+    A board that fails with a port error is closed, and opened again by the next request, a request
+    that fails on its arguments only fails for the client that sent it.
+    """
+    def __init__(self, socket_path=DEFAULT_SOCKET, loggerIn=None, **kwargs):
+        """
+        :param socket_path: path of the Unix socket
+        :param loggerIn: logger
+        :param kwargs: passed on to UPYRPC(), ie framed=True, push=True
+        """
+        if loggerIn: self.logger = loggerIn
+        else: self.logger = StubLogger()
+
+        self.socket_path = socket_path
+        self._kwargs = dict(kwargs)
+        self._kwargs.setdefault("attach", True)
+        self.boards = {}  # port -> UPYRPC
+        self._locks = {}  # port -> lock, held while the board is opened or closed
+        self._lock = threading.Lock()
+        self._server = None
+
+    def _board_lock(self, port):
+        with self._lock:
+            return self._locks.setdefault(port, threading.Lock())
+
+    def open_board(self, port, version=None):
+        """ open a board and start its server, if it is not already open
+
+        :return: success, startup report (see UPYRPC.start_server()) or error
+        """
+        with self._board_lock(port):
+            pyb = self.boards.get(port, None)
+            if pyb is not None:
+                return True, pyb.startup
+
+            try:
+                pyb = UPYRPC(port, loggerIn=self.logger, **self._kwargs)
+            except (Exception, pyboard.PyboardError) as er:  # PyboardError is not an Exception
+                return False, str(er)
+
+            try:
+                success, result = pyb.start_server(version)
+            except (Exception, pyboard.PyboardError) as er:
+                success, result = False, str(er)
+            if not success:
+                pyb.close()
+                return False, result
+
+            self.logger.info("{} opened, {}".format(port, pyb.startup))
+            self.boards[port] = pyb
+            return True, pyb.startup
+
+    def close_board(self, port):
+        with self._board_lock(port):
+            pyb = self.boards.pop(port, None)
+            if pyb is None: return
+            try:
+                pyb.close()
+            except (Exception, pyboard.PyboardError) as er:
+                self.logger.error("{} close: {}".format(port, er))
+            self.logger.info("{} closed".format(port))
+
+    def _replay(self, pyb, method, calls, limits=None, **kwargs):
+        """ run a batch or recipe a client recorded, the calls are made on a batch or recipe of pyb
+
+        :param method: "batch" or "recipe"
+        :param calls: [[<wrapper>, args, kwargs], ...], the wrappers must be in DAEMON_METHODS
+        :param limits: limits of the recipe steps, see UPYRPCRecipe.limit()
+        :param kwargs: of UPYRPC.batch() or UPYRPC.recipe()
+        :return: success, result
+        """
+        b = getattr(pyb, method)(**kwargs)
+        for name, args, kw in calls:
+            if name not in DAEMON_METHODS:
+                return False, "method {} is not available from the daemon".format(name)
+            success, result = getattr(b, name)(*args, **kw)
+            if not success:
+                return success, result
+        if limits is not None: b.limits = limits
+        return b.send()
+
+    def request(self, port, method, args, kwargs):
+        """ run a client request
+
+        :param port: serial port of the board
+        :param method: "start_server", "boards", "batch", "recipe", or one of DAEMON_METHODS
+        :return: success, result
+        """
+        if method == "boards":
+            return True, {p: pyb.startup for p, pyb in list(self.boards.items())}
+
+        if method == "start_server":
+            return self.open_board(port, *args)
+
+        if method not in DAEMON_METHODS and method not in ("batch", "recipe"):
+            return False, "method {} is not available from the daemon".format(method)
+
+        pyb = self.boards.get(port, None)
+        if pyb is None:
+            return False, "{} is not open, call start_server()".format(port)
+
+        try:
+            if method in ("batch", "recipe"):
+                ret = self._replay(pyb, method, *args, **kwargs)
+            else:
+                ret = getattr(pyb, method)(*args, **kwargs)
+        except (OSError, pyboard.PyboardError) as er:
+            # the board is gone, it is opened again by the next start_server()
+            self.logger.error("{} {}: {}".format(port, method, er))
+            self.close_board(port)
+            return False, str(er)
+        except Exception as er:
+            # bad arguments from the client, the board is shared, so it stays open
+            self.logger.error("{} {}: {}".format(port, method, er))
+            return False, str(er)
+
+        if method == "_fetch_results":
+            return True, ret
+        return ret
+
+    def serve_forever(self):
+        """ serve clients until shutdown(), then close the boards
+        """
+        if os.path.exists(self.socket_path):
+            # a socket left by a daemon that did not exit cleanly, unless one is still running
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                s.connect(self.socket_path)
+                raise RuntimeError("a daemon is already running on {}".format(self.socket_path))
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(self.socket_path)
+            finally:
+                s.close()
+
+        self._server = _Server(self.socket_path, _Handler)
+        os.chmod(self.socket_path, 0o600)  # only this user can drive the boards
+        self._server.daemon = self
+        self.logger.info("serving on {}".format(self.socket_path))
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            os.unlink(self.socket_path)
+            for port in list(self.boards):
+                self.close_board(port)
+
+    def shutdown(self):
+        """ stop serve_forever(), call from another thread
+        """
+        if self._server is not None:
+            self._server.shutdown()
+
+
+class UPYRPCClient(object):
+    """ Client of a board opened by UPYRPCDaemon, with the same wrapper API as UPYRPC
+
+    The wrappers run here, and their commands are sent through the daemon to the board.
+    Not thread safe across clients, use one client per thread.
+    """
+    def __init__(self, socket_path, device, loggerIn=None):
+        """
+        :param socket_path: path of the daemon's Unix socket
+        :param device: serial port of the board, as the daemon knows it
+        :param loggerIn: logger
+        """
+        if loggerIn: self.logger = loggerIn
+        else: self.logger = StubLogger()
+
+        self.device = device
+        self.startup = None
+        self.latency = None  # latency is recorded by the UPYRPC in the daemon
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(socket_path)
+        self._file = self._sock.makefile("rwb")
+        self._lock = threading.Lock()
+
+    def _request(self, method, *args, **kwargs):
+        req = {"port": self.device, "method": method, "args": args, "kwargs": kwargs}
+        with self._lock:
+            try:
+                self._file.write(json.dumps(req, default=_json_default).encode("utf-8") + b"\n")
+                self._file.flush()
+                line = self._file.readline()
+            except OSError as er:
+                self.logger.error(er)
+                return False, str(er)
+
+        if not line:
+            self.logger.error("daemon closed the connection")
+            return False, "daemon closed the connection"
+
+        reply = json.loads(line.decode("utf-8"), object_hook=_json_hook)
+        return reply["success"], reply["result"]
+
+    def _fetch_results(self, method, rid, timeout, poll_s):
+        success, result = self._request("_fetch_results", method, rid, timeout, poll_s)
+        return result if success else []
+
+    def batch(self, stop_on_fail=False):
+        """ Batch of commands, see UPYRPC.batch(), the daemon sends it to the server
+        """
+        return _ClientBatch(self, stop_on_fail)
+
+    def recipe(self, stop_on_fail=False, save=False, full=False):
+        """ Recipe, see UPYRPC.recipe(), the daemon runs it on the server
+        """
+        return _ClientRecipe(self, stop_on_fail, save, full)
+
+    def start_server(self, version=None):
+        """ Open the board in the daemon, and start its server, if it is not already open
+        - self.startup is the startup report of when the daemon opened the board
+
+        :param version: server version required to attach to a running server, None for any
+        :return: success, result
+        """
+        success, result = self._request("start_server", version)
+        if success: self.startup = result
+        return success, result
+
+    def boards(self):
+        """ boards open in the daemon
+
+        :return: success, {port: startup report, ...}
+        """
+        return self._request("boards")
+
+    def close(self):
+        """ close the connection to the daemon, the board stays open in the daemon
+        """
+        self._file.close()
+        self._sock.close()
+
+
+class _ClientCalls(object):
+    """ the wrappers of a client batch or recipe record their calls, the daemon makes them again on
+    a batch or recipe of its own, see UPYRPCDaemon._replay()
+    """
+    def __getattr__(self, name):
+        if name not in DAEMON_METHODS or name not in UPYRPCBatch.METHODS:
+            raise AttributeError("{} can not be used in a batch".format(name))
+
+        def _call(*args, **kwargs):
+            return self._verify_single_cmd_ret([name, args, kwargs])
+        return _call
+
+
+class _ClientBatch(_ClientCalls, UPYRPCBatch):
+    def send(self):
+        return self._results(*self._pyb._request("batch", self.cmds, stop_on_fail=self.stop_on_fail))
+
+
+class _ClientRecipe(_ClientCalls, UPYRPCRecipe):
+    def run(self):
+        return self._results(*self._pyb._request("recipe", self.cmds, self.limits, stop_on_fail=self.stop_on_fail,
+                                                 save=self.save, full=self.full))
+
+
+def _forward(name):
+    def _call(self, *args, **kwargs):
+        return self._request(name, *args, **kwargs)
+    return functools.update_wrapper(_call, getattr(UPYRPC, name))
+
+
+# the wrappers of UPYRPC run in the daemon, except adc_stream(), a generator of the chunks it fetches
+for _name in DAEMON_METHODS:
+    if not hasattr(UPYRPCClient, _name):
+        setattr(UPYRPCClient, _name, _forward(_name))
+UPYRPCClient.adc_stream = UPYRPC.adc_stream
+
+
+def parse_args():
+    epilog = """
+    Usage examples:
+       python3 UPYRPC_daemon.py --push
+       python3 UPYRPC_daemon.py --socket /tmp/fixture1.sock --framed
+    """
+    parser = argparse.ArgumentParser(description='UPYRPC_daemon',
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog=epilog)
+
+    parser.add_argument("-s", '--socket', dest='socket', default=DEFAULT_SOCKET, type=str, help='Unix socket path')
+    parser.add_argument("-f", '--framed', dest='framed', default=False, action='store_true', help='Use the framed binary protocol')
+    parser.add_argument('--push', dest='push', default=False, action='store_true', help='Server pushes results (implies --framed)')
+    parser.add_argument('--reset', dest='reset', default=False, action='store_true', help='Always reset the boards when opening them, do not attach')
+    parser.add_argument("-v", '--verbose', dest='verbose', default=0, action='count', help='Increase verbosity')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    if args.verbose == 0:
+        logging.basicConfig(level=logging.INFO, format='%(filename)20s %(levelname)6s %(lineno)4s %(message)s')
+    else:
+        logging.basicConfig(level=logging.DEBUG, format='%(filename)20s %(levelname)6s %(lineno)4s %(message)s')
+
+    daemon = UPYRPCDaemon(args.socket, loggerIn=logging, framed=args.framed, push=args.push, attach=not args.reset)
+
+    def _stop(signum, frame):
+        raise KeyboardInterrupt()
+    signal.signal(signal.SIGTERM, _stop)
+
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError as er:
+        logging.error(er)
+        sys.exit(1)
@@ -0,0 +1,293 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+MIT License
+
+Copyright (c) 2019 sistemicorp
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Deploy the target code (./target) to one or many boards,
+
+    $ python3 UPYRPC_deploy.py --port /dev/ttyACM0 --port /dev/ttyACM1 --verify
+
+- the sources are compiled to .mpy with mpy-cross, so the board does not compile them on every
+  import of upyrpc_main.  mpy-cross must be the same version as the firmware on the board.
+  Use --source to upload the .py files instead.
+- the board keeps a manifest of the hashes of the files that were uploaded, only files that
+  changed are uploaded again, and the boards are updated at the same time
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import binascii
+import hashlib
+import tempfile
+import subprocess
+import concurrent.futures
+
+import ampy.pyboard as pyboard
+
+from UPYRPC import UPYRPC
+from stublogger import StubLogger
+
+VERSION = "0.2.0"
+
+TARGET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "target")
+MANIFEST = "upyrpc_manifest.json"
+CHUNK_SIZE = 512    # bytes of a file written per exec
+MPY_MARCH = "armv7m"  # pyboard, needed because the target uses @micropython.native
+
+
+def build(target_dir=TARGET_DIR, compile=True, mpy_cross="mpy-cross", march=MPY_MARCH):
+    """ Build the files to deploy
+
+    :param target_dir: directory of the target sources
+    :param compile: True to compile the sources to .mpy, False for the .py sources
+    :param mpy_cross: mpy-cross command
+    :param march: mpy-cross -march, None to leave it out
+    :return: {<file name on the board>: <bytes>, ...}
+    """
+    sources = sorted(f for f in os.listdir(target_dir) if f.endswith(".py"))
+    files = {}
+    if not compile:
+        for src in sources:
+            with open(os.path.join(target_dir, src), "rb") as f:
+                files[src] = f.read()
+        return files
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for src in sources:
+            name = src[:-3] + ".mpy"
+            cmd = [mpy_cross, "-o", os.path.join(tmp, name)]
+            if march: cmd.append("-march={}".format(march))
+            cmd.append(src)  # relative, it is the file name in tracebacks on the board
+
+            proc = subprocess.run(cmd, cwd=target_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            if proc.returncode != 0:
+                raise RuntimeError("{} failed: {}".format(" ".join(cmd), proc.stdout.decode("utf-8", "replace")))
+
+            with open(os.path.join(tmp, name), "rb") as f:
+                files[name] = f.read()
+    return files
+
+
+def file_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _read_manifest(pyb):
+    """ manifest on the board, the raw REPL must be entered
+
+    :return: {<file name>: <hash>, ...}, empty if there is no manifest
+    """
+    out = pyb.exec_("try:\n    print(open('{0}').read())\nexcept OSError:\n    print('{{}}')".format(MANIFEST))
+    try:
+        return json.loads(out.decode("utf-8"))
+    except ValueError:
+        return {}  # corrupt, everything is uploaded again
+
+
+def _write_file(pyb, name, data):
+    """ write a file on the board, the raw REPL must be entered
+    - the data is sent base64 encoded, in chunks
+    """
+    pyb.exec_("import binascii\nf = open('{}', 'wb')".format(name))
+    try:
+        for i in range(0, len(data), CHUNK_SIZE):
+            chunk = binascii.b2a_base64(data[i:i + CHUNK_SIZE]).decode().strip()
+            pyb.exec_("f.write(binascii.a2b_base64('{}'))".format(chunk))
+    finally:
+        pyb.exec_("f.close()")
+
+
+def _other_name(name):
+    """ the .py of a .mpy, and the .mpy of a .py, MicroPython imports the .py if there are both
+    """
+    base, ext = os.path.splitext(name)
+    return base + (".py" if ext == ".mpy" else ".mpy")
+
+
+def deploy_board(device, files, force=False, logger=None):
+    """ Deploy files to a board, only the files that changed since the last deploy are uploaded
+    - the other kind of each file (.py or .mpy) is removed from the board, as are files of the
+      last deploy that are not deployed anymore
+
+    :param device: serial port or transport URL
+    :param files: from build()
+    :param force: upload all the files
+    :param logger: logger
+    :return: success, {"uploaded": [...], "removed": [...], "unchanged": [...], "time_s": <seconds>} or error
+    """
+    if logger is None: logger = StubLogger()
+    start = time.time()
+    report = {"uploaded": [], "removed": [], "unchanged": []}
+
+    try:
+        pyb = UPYRPC(device, loggerIn=logger, latency=False)
+    except (Exception, pyboard.PyboardError) as er:  # PyboardError is not an Exception
+        return False, str(er)
+
+    try:
+        pyb.enter_raw_repl()
+        manifest = _read_manifest(pyb)
+        on_board = set(json.loads(pyb.exec_("import os, json\nprint(json.dumps(os.listdir()))")))
+
+        new_manifest = {}
+        for name, data in sorted(files.items()):
+            h = file_hash(data)
+            new_manifest[name] = h
+            if not force and manifest.get(name, None) == h and name in on_board:
+                report["unchanged"].append(name)
+                continue
+
+            logger.info("{} uploading {} ({} bytes)".format(device, name, len(data)))
+            _write_file(pyb, name, data)
+            report["uploaded"].append(name)
+
+        stale = set(_other_name(name) for name in files) | set(manifest)
+        for name in sorted(stale):
+            if name in on_board and name not in files:
+                logger.info("{} removing {}".format(device, name))
+                pyb.exec_("os.remove('{}')".format(name))
+                report["removed"].append(name)
+
+        if new_manifest != manifest:
+            _write_file(pyb, MANIFEST, json.dumps(new_manifest).encode())
+
+        pyb.exit_raw_repl()
+    except (Exception, pyboard.PyboardError) as er:
+        logger.error("{} deploy failed: {}".format(device, er))
+        return False, str(er)
+    finally:
+        pyb.close()
+
+    report["time_s"] = time.time() - start
+    return True, report
+
+
+def verify_board(device, version=None, logger=None):
+    """ Start the server on a board, and check its version
+
+    :param device: serial port
+    :param version: expected server version, None for any
+    :param logger: logger
+    :return: success, ping result value or error
+    """
+    try:
+        pyb = UPYRPC(device, loggerIn=logger)
+    except (Exception, pyboard.PyboardError) as er:
+        return False, str(er)
+
+    try:
+        success, result = pyb.start_server()
+        if success:
+            success, result = pyb.ping()
+    finally:
+        pyb.close()
+
+    if not success:
+        return False, result
+
+    value = result["value"]
+    if version is not None and value["version"] != version:
+        return False, "server version {} is not {}".format(value["version"], version)
+    return True, value
+
+
+def deploy(devices, files, force=False, verify=False, version=None, logger=None):
+    """ Deploy files to many boards, at the same time
+
+    :param devices: list of serial ports
+    :param files: from build()
+    :param force: upload all the files
+    :param verify: start the server after deploying, and check its version
+    :param version: expected server version for verify, None for any
+    :param logger: logger
+    :return: success (True if all the boards succeeded), {<port>: (success, report or error), ...}
+    """
+    def _deploy(device):
+        success, result = deploy_board(device, files, force, logger)
+        if success and verify:
+            ok, value = verify_board(device, version, logger)
+            result["verify"] = value
+            success = ok
+        return success, result
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(devices))) as executor:
+        results = dict(zip(devices, executor.map(_deploy, devices)))
+
+    return all(success for success, _ in results.values()), results
+
+
+def parse_args():
+    epilog = """
+    Usage examples:
+       python3 UPYRPC_deploy.py --port /dev/ttyACM0
+       python3 UPYRPC_deploy.py --port /dev/ttyACM0 --port /dev/ttyACM1 --verify --expect 0.2
+    """
+    parser = argparse.ArgumentParser(description='UPYRPC_deploy',
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog=epilog)
+
+    parser.add_argument("-p", '--port', dest='ports', default=[], type=str, action='append',
+                        help='Serial port of a board, repeat for many boards')
+    parser.add_argument('--source', dest='source', default=False, action='store_true',
+                        help='Upload the .py sources instead of compiling them')
+    parser.add_argument('--mpy-cross', dest='mpy_cross', default="mpy-cross", type=str,
+                        help='mpy-cross command, must match the firmware version')
+    parser.add_argument('--march', dest='march', default=MPY_MARCH, type=str, help='mpy-cross -march')
+    parser.add_argument('--force', dest='force', default=False, action='store_true',
+                        help='Upload all the files, even if they have not changed')
+    parser.add_argument('--verify', dest='verify', default=False, action='store_true',
+                        help='Start the server after deploying, and check its version')
+    parser.add_argument('--expect', dest='expect', default=None, type=str, help='Server version expected by --verify')
+    parser.add_argument("-v", '--verbose', dest='verbose', default=0, action='count', help='Increase verbosity')
+
+    args = parser.parse_args()
+    if not args.ports:
+        parser.error("--port is required")
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    if args.verbose == 0:
+        logging.basicConfig(level=logging.INFO, format='%(filename)20s %(levelname)6s %(lineno)4s %(message)s')
+    else:
+        logging.basicConfig(level=logging.DEBUG, format='%(filename)20s %(levelname)6s %(lineno)4s %(message)s')
+
+    try:
+        files = build(compile=not args.source, mpy_cross=args.mpy_cross, march=args.march)
+    except (OSError, RuntimeError) as er:
+        logging.error("build failed: {}".format(er))
+        sys.exit(1)
+
+    success, results = deploy(args.ports, files, args.force, args.verify, args.expect, logging)
+    for device, (ok, result) in results.items():
+        logging.info("{} {} {}".format(device, ok, result))
+
+    if not success:
+        logging.error("deploy failed")
+        sys.exit(1)
+    logging.info("deployed to {} boards".format(len(results)))
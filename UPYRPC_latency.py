@@ -0,0 +1,201 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+MIT License
+
+Copyright (c) 2019 sistemicorp
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Latency of UPYRPC calls, per method and per phase of the call, see UPYRPC.latency,
+
+    success, result = pyb.adc_read("X19")
+    snap = pyb.latency.snapshot()
+    logging.info(snap["adc_read"]["total"]["p99"])
+
+Phases of a call, times are summed over all the round trips of the call,
+    encode  - making the python string or frame of each request
+    write   - writing requests to the serial port
+    exec    - waiting for the reply of each request, the target runs the request in this time
+    decode  - parsing the replies
+    wait    - sleeping between polls for the result, or waiting for the pushed result
+    total   - the whole call
+    retries - number of ret() polls for the result, a count, not a time
+"""
+import json
+import threading
+
+VERSION = "0.2.0"
+
+PHASES = ("encode", "write", "exec", "decode", "wait", "total")
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class LatencyHistogram(object):
+    """ HDR style histogram of integer values
+    - values below 2 ** SUB_BITS have a bucket each, above that there are 2 ** (SUB_BITS - 1)
+      buckets per power of two, so a bucket is within 1/64 of its values
+    - buckets are kept in a dict, only the ones used take memory
+    """
+    SUB_BITS = 7
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        shift = value.bit_length() - self.SUB_BITS
+        if shift <= 0:
+            return value
+        return (shift << (self.SUB_BITS - 1)) + (value >> shift)
+
+    def _value(self, index):
+        """ middle value of a bucket
+        """
+        if index < (1 << self.SUB_BITS):
+            return index
+        half = 1 << (self.SUB_BITS - 1)
+        shift = index // half - 1
+        lo = (index - shift * half) << shift
+        return lo + ((1 << shift) - 1) / 2
+
+    def record(self, value):
+        """ add a value
+
+        :param value: int >= 0
+        """
+        value = max(0, int(value))
+        idx = self._index(value)
+        self.counts[idx] = self.counts.get(idx, 0) + 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min: self.min = value
+        if self.max is None or value > self.max: self.max = value
+
+    def quantile(self, q):
+        """ value at quantile q
+
+        :param q: 0 - 1
+        :return: value, None if there are no values
+        """
+        if not self.count:
+            return None
+        rank = max(1, int(q * self.count + 0.5))
+        seen = 0
+        for idx in sorted(self.counts):
+            seen += self.counts[idx]
+            if seen >= rank:
+                return min(max(self._value(idx), self.min), self.max)
+        return self.max
+
+
+class LatencyRecorder(object):
+    """ Latency histograms of calls, per method and phase
+    - times are kept in microseconds, and reported in seconds
+    - thread safe
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hists = {}  # method -> {phase: LatencyHistogram}
+
+    def record(self, method, phases, retries=None):
+        """ record a call
+
+        :param method: method name
+        :param phases: {phase: seconds, ...}
+        :param retries: number of polls for the result, None if the call did not poll
+        """
+        with self._lock:
+            hists = self._hists.setdefault(method, {})
+            for phase, seconds in phases.items():
+                hist = hists.get(phase, None)
+                if hist is None: hist = hists[phase] = LatencyHistogram()
+                hist.record(seconds * 1000000)
+
+            if retries is not None:
+                hist = hists.get("retries", None)
+                if hist is None: hist = hists["retries"] = LatencyHistogram()
+                hist.record(retries)
+
+    def reset(self):
+        with self._lock:
+            self._hists = {}
+
+    def snapshot(self):
+        """ statistics of all the calls so far
+
+        :return: {method: {phase: {"count": #, "mean": s, "min": s, "max": s, "p50": s, "p95": s, "p99": s}, ...}, ...}
+                 "retries" is in counts, not seconds
+        """
+        snap = {}
+        with self._lock:
+            for method, hists in self._hists.items():
+                snap[method] = {}
+                for phase, hist in hists.items():
+                    scale = 1 if phase == "retries" else 1e-6
+                    stats = {"count": hist.count, "mean": hist.sum / hist.count * scale,
+                             "min": hist.min * scale, "max": hist.max * scale}
+                    for q in QUANTILES:
+                        stats["p{}".format(int(q * 100))] = hist.quantile(q) * scale
+                    snap[method][phase] = stats
+        return snap
+
+    def to_json(self, **kwargs):
+        """ snapshot() as JSON
+
+        :param kwargs: passed on to json.dumps()
+        :return: string
+        """
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def to_prometheus(self, labels=None, prefix="upyrpc"):
+        """ snapshot() in the Prometheus text exposition format, as summaries,
+
+            upyrpc_call_seconds{method="adc_read",phase="total",quantile="0.99"} 0.0123
+            upyrpc_call_retries{method="adc_read",quantile="0.99"} 2
+
+        :param labels: {name: value, ...} added to every sample, ie {"device": "/dev/ttyACM0"}
+        :param prefix: metric name prefix
+        :return: string
+        """
+        def _labels(d):
+            items = list((labels or {}).items()) + list(d.items())
+            return "{" + ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                                  for k, v in items) + "}"
+
+        snap = self.snapshot()
+        lines = []
+        for name, desc, retries in (("call_seconds", "UPYRPC call latency per phase", False),
+                                    ("call_retries", "UPYRPC polls for a result per call", True)):
+            metric = "{}_{}".format(prefix, name)
+            lines.append("# HELP {} {}".format(metric, desc))
+            lines.append("# TYPE {} summary".format(metric))
+            for method in sorted(snap):
+                for phase, stats in sorted(snap[method].items()):
+                    if (phase == "retries") != retries: continue
+                    l = {"method": method} if retries else {"method": method, "phase": phase}
+                    for q in QUANTILES:
+                        lines.append("{}{} {}".format(metric, _labels(dict(l, quantile=q)),
+                                                      stats["p{}".format(int(q * 100))]))
+                    lines.append("{}_sum{} {}".format(metric, _labels(l), stats["mean"] * stats["count"]))
+                    lines.append("{}_count{} {}".format(metric, _labels(l), stats["count"]))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,214 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+MIT License
+
+Copyright (c) 2019 sistemicorp
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Pool of UPYRPC connections to many boards, with fan-out calls that run on all the boards at once,
+
+    with UPYRPCPool(["/dev/ttyACM0", "/dev/ttyACM1", "/dev/ttyACM2"], loggerIn=logging) as pool:
+        results = pool.map("adc_read", pin="X19")
+        for uid, r in results.items():
+            logging.info("{} {} {} {:.3f}s".format(uid, r["success"], r["result"], r["time_s"]))
+
+Each board has its own worker thread, so calls to one board run in order, and calls to
+different boards run at the same time.  Boards are known by their unique_id().
+"""
+import time
+import concurrent.futures
+
+import ampy.pyboard as pyboard
+
+from UPYRPC import UPYRPC
+from stublogger import StubLogger
+
+VERSION = "0.2.0"
+
+
+class UPYRPCPool(object):
+    """ Pool of UPYRPC connections
+
+    Results of pool calls are dicts keyed by board unique id, of dicts,
+
+        {"success": True|False, "result": <result>, "time_s": <seconds>, "device": <port>}
+
+    A wrapper that raises, for example a serial port error, is returned as a failed result, with
+    the exception as the result.
+    """
+    CALL_TIMEOUT_S = 30  # default timeout of a pool call, for all the boards
+
+    def __init__(self, devices, loggerIn=None, **kwargs):
+        """
+        :param devices: list of serial ports
+        :param loggerIn: logger
+        :param kwargs: passed on to UPYRPC(), ie framed=True, push=True
+        """
+        if loggerIn: self.logger = loggerIn
+        else: self.logger = StubLogger()
+
+        self.devices = devices
+        self._kwargs = kwargs
+        self.boards = {}    # unique id -> UPYRPC
+        self.errors = {}    # port -> error, of the boards that failed to open
+        self._workers = {}  # unique id -> executor, one thread per board
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def _open_board(self, device):
+        """ open a board and start its server, runs on the board's worker thread
+
+        :return: success, UPYRPC or error
+        """
+        try:
+            pyb = UPYRPC(device, loggerIn=self.logger, **self._kwargs)
+        except (Exception, pyboard.PyboardError) as er:  # PyboardError is not an Exception
+            return False, str(er)
+
+        try:
+            success, result = pyb.start_server()
+            if success:
+                success, result = pyb.unique_id()
+        except (Exception, pyboard.PyboardError) as er:
+            success, result = False, str(er)
+        if not success:
+            pyb.close()
+            return False, result
+
+        return True, (result["value"]["value"], pyb)
+
+    def open(self):
+        """ open all the boards, at the same time
+        - boards that fail to open are left out of the pool, and listed in self.errors
+
+        :return: success (True if all the boards opened), {unique id: port, ...}
+        """
+        workers = {}
+        futures = {}
+        for device in self.devices:
+            worker = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="upyrpc-pool")
+            workers[device] = worker
+            futures[device] = worker.submit(self._open_board, device)
+
+        opened = {}
+        for device, future in futures.items():
+            success, result = future.result()
+            if not success:
+                self.logger.error("{} failed to open: {}".format(device, result))
+                self.errors[device] = result
+                workers[device].shutdown(wait=False)
+                continue
+
+            uid, pyb = result
+            if uid in self.boards:
+                self.logger.error("{} has the same unique id as {}".format(device, self.boards[uid].device))
+                self.errors[device] = "duplicate unique id {}".format(uid)
+                pyb.close()
+                workers[device].shutdown(wait=False)
+                continue
+
+            self.boards[uid] = pyb
+            self._workers[uid] = workers[device]
+            opened[uid] = device
+
+        return not self.errors, opened
+
+    def close(self):
+        """ close all the boards
+        """
+        futures = [self._workers[uid].submit(pyb.close) for uid, pyb in self.boards.items()]
+        concurrent.futures.wait(futures, timeout=self.CALL_TIMEOUT_S)
+        for worker in self._workers.values():
+            worker.shutdown(wait=False)
+
+        self.boards = {}
+        self._workers = {}
+
+    def _call(self, uid, method, args, kwargs):
+        """ call a wrapper of a board, runs on the board's worker thread
+        """
+        pyb = self.boards[uid]
+        start = time.time()
+        try:
+            success, result = getattr(pyb, method)(*args, **kwargs)
+        except (Exception, pyboard.PyboardError) as er:
+            self.logger.error("{} {} {}".format(pyb.device, method, er))
+            success, result = False, str(er)
+
+        return {"success": success, "result": result, "time_s": time.time() - start, "device": pyb.device}
+
+    def submit(self, uid, method, *args, **kwargs):
+        """ call a wrapper on one board, without waiting for it
+
+        :param uid: unique id of the board
+        :param method: name of a UPYRPC wrapper, ie "adc_read"
+        :return: concurrent.futures.Future, of a result dict
+        """
+        return self._workers[uid].submit(self._call, uid, method, args, kwargs)
+
+    def map(self, method, *args, boards=None, timeout=None, **kwargs):
+        """ call a wrapper on all the boards (or some of them) at the same time, and wait for the results
+
+            results = pool.map("adc_read", pin="X19")
+
+        :param method: name of a UPYRPC wrapper, ie "adc_read"
+        :param args: args of the wrapper
+        :param boards: list of unique ids, default all the boards
+        :param timeout: seconds to wait for all the boards, default CALL_TIMEOUT_S
+        :param kwargs: args of the wrapper
+        :return: {unique id: {"success": ..., "result": ..., "time_s": ..., "device": ...}, ...}
+        """
+        if boards is None: boards = list(self.boards)
+        if timeout is None: timeout = self.CALL_TIMEOUT_S
+
+        futures = {}
+        for uid in boards:
+            if uid not in self.boards:
+                self.logger.error("{} is not in the pool".format(uid))
+                continue
+            futures[uid] = self.submit(uid, method, *args, **kwargs)
+
+        concurrent.futures.wait(futures.values(), timeout=timeout)
+
+        results = {}
+        for uid in boards:
+            if uid not in futures:
+                results[uid] = {"success": False, "result": "not in the pool", "time_s": 0, "device": None}
+            elif not futures[uid].done():
+                results[uid] = {"success": False, "result": "timeout", "time_s": timeout,
+                                "device": self.boards[uid].device}
+            else:
+                results[uid] = futures[uid].result()
+
+        return results
+
+    def success(self, results):
+        """ True if all the results of a pool call succeeded
+
+        :param results: from map()
+        """
+        return all(r["success"] for r in results.values())
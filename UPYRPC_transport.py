@@ -0,0 +1,379 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+MIT License
+
+Copyright (c) 2019 sistemicorp
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Transports, the byte stream to a board, selected by URL,
+
+    serial:///dev/ttyACM0                 serial port, serial:///dev/ttyACM0?baudrate=921600
+    /dev/ttyACM0                          same, a plain device is a serial port (or telnet for an IP address)
+    tcp://host:port                       TCP socket, to a network attached board or a bridge, see below
+    loop://sim                            in-process loopback to a device served by a function in this
+                                          process, see LOOPBACK_DEVICES, "sim" is the simulator
+
+Transports look like a pyserial Serial to ampy's Pyboard (read, write, inWaiting, timeout, fileno),
+and read as much as is available into a buffer, instead of a byte at a time.
+
+A bridge serves a board on a TCP port, so it can be used from another machine,
+
+    $ python3 UPYRPC_transport.py --port /dev/ttyACM0 --listen 0.0.0.0:7000
+    $ python3 UPYRPC_cli.py --port tcp://testserver:7000 misc --200
+
+One client is served at a time, the board stays open between clients, use attach=True to keep the
+server running between them.
+"""
+import os
+import sys
+import time
+import select
+import socket
+import logging
+import argparse
+import threading
+import urllib.parse
+
+import ampy.pyboard as pyboard
+
+VERSION = "0.2.0"
+
+SIM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sim")
+
+
+class Transport(object):
+    """ Buffered byte stream to a board, with the parts of the pyserial Serial API that ampy uses
+    - subclasses implement _recv(), _send(), close() and fileno()
+    - timeout is the read timeout in seconds like pyserial, None blocks, 0 does not wait
+    """
+    READ_SIZE = 4096
+
+    def __init__(self):
+        self.timeout = None
+        self._buf = bytearray()
+
+    def _recv(self, size, timeout):
+        """ read up to size bytes, waiting up to timeout seconds (None forever) for the first
+
+        :return: bytes, b"" on timeout, raises OSError if the transport is closed
+        """
+        raise NotImplementedError()
+
+    def _send(self, data):
+        raise NotImplementedError()
+
+    def close(self):
+        raise NotImplementedError()
+
+    def fileno(self):
+        raise NotImplementedError()
+
+    def _fill(self, timeout):
+        data = self._recv(self.READ_SIZE, timeout)
+        self._buf += data
+        return len(data)
+
+    def read(self, size=1):
+        """ read size bytes, fewer if self.timeout expires first
+        """
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        while len(self._buf) < size:
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            if not self._fill(remaining) and remaining == 0:
+                break
+        data = bytes(self._buf[:size])
+        del self._buf[:size]
+        return data
+
+    def write(self, data):
+        self._send(data)
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        if not self._buf: self._fill(0)
+        return len(self._buf)
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def read_until(self, min_num_bytes, ending, timeout=10, data_consumer=None):
+        """ Pyboard.read_until(), on the buffer
+        - reads min_num_bytes, then until the data ends with ending, or nothing is received
+          for timeout seconds (None forever)
+        - bytes after ending are left in the buffer
+        """
+        data = self.read(min_num_bytes)
+        if data_consumer: data_consumer(data)
+
+        keep = len(ending) - 1  # ending can start in data, and end in the buffer
+        deadline = None if timeout is None else time.time() + timeout
+        while not data.endswith(ending):
+            if self._buf:
+                window = data[-keep:] if keep else b""
+                idx = (window + self._buf).find(ending)
+                n = len(self._buf) if idx < 0 else idx + len(ending) - len(window)
+                new = bytes(self._buf[:n])
+                del self._buf[:n]
+                data += new
+                if data_consumer: data_consumer(new)
+                deadline = None if timeout is None else time.time() + timeout
+                continue
+
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                break
+            self._fill(remaining)
+        return data
+
+
+class SerialTransport(Transport):
+    """ Serial port, pyserial
+    """
+    def __init__(self, device, baudrate=115200, wait=0):
+        """
+        :param device: serial port
+        :param baudrate: baudrate
+        :param wait: seconds to wait for the port to appear
+        """
+        import serial
+        super().__init__()
+
+        for attempt in range(wait + 1):
+            try:
+                self._serial = serial.Serial(device, baudrate=baudrate, timeout=None)
+                break
+            except (OSError, serial.SerialException):
+                if attempt < wait: time.sleep(1)
+        else:
+            raise pyboard.PyboardError('failed to access ' + device)
+        self._timeout = None
+
+    def _recv(self, size, timeout):
+        if timeout != self._timeout:  # setting the timeout reconfigures the port
+            self._serial.timeout = self._timeout = timeout
+        return self._serial.read(min(size, max(1, self._serial.in_waiting)))
+
+    def _send(self, data):
+        self._serial.write(data)
+
+    def close(self):
+        self._serial.close()
+
+    def fileno(self):
+        return self._serial.fileno()
+
+
+class SocketTransport(Transport):
+    """ Connected stream socket
+    """
+    def __init__(self, sock):
+        super().__init__()
+        self._sock = sock
+
+    def _recv(self, size, timeout):
+        readable, _, _ = select.select([self._sock], [], [], timeout)
+        if not readable:
+            return b""
+        data = self._sock.recv(size)
+        if not data:
+            raise ConnectionResetError("connection closed")
+        return data
+
+    def _send(self, data):
+        self._sock.sendall(data)
+
+    def close(self):
+        self._sock.close()
+
+    def fileno(self):
+        return self._sock.fileno()
+
+
+class TcpTransport(SocketTransport):
+    """ TCP socket, to a network attached board or a bridge
+    """
+    CONNECT_TIMEOUT_S = 5
+
+    def __init__(self, host, port, wait=0):
+        """
+        :param host: host
+        :param port: port
+        :param wait: seconds to wait for the connection to be accepted
+        """
+        for attempt in range(wait + 1):
+            try:
+                sock = socket.create_connection((host, port), timeout=self.CONNECT_TIMEOUT_S)
+                break
+            except OSError:
+                if attempt < wait: time.sleep(1)
+        else:
+            raise pyboard.PyboardError('failed to access {}:{}'.format(host, port))
+
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().__init__(sock)
+
+
+class LoopbackTransport(SocketTransport):
+    """ In-process loopback, for tests
+    - the other end of the stream is self.peer, a socket, serve(peer) is run on a thread to
+      play the device
+    """
+    def __init__(self, serve=None):
+        """
+        :param serve: function serve(sock) that serves the device side, None to leave self.peer
+                      to the caller
+        """
+        sock, self.peer = socket.socketpair()
+        super().__init__(sock)
+        if serve is not None:
+            threading.Thread(target=serve, args=(self.peer,), name="upyrpc-loopback", daemon=True).start()
+
+    def close(self):
+        super().close()
+        self.peer.close()
+
+
+def _serve_simulator(sock):
+    """ the simulator (sim/upyrpc_sim.py) in this process, it runs the target code on the process'
+    modules so there can only be one at a time, see RawRepl
+    """
+    if SIM_DIR not in sys.path: sys.path.insert(0, SIM_DIR)
+    import upyrpc_sim
+
+    upyrpc_sim.install_stubs()
+    upyrpc_sim.serve_socket(sock)
+
+
+# name -> function serve(sock) of loop://<name>, tests can add their own
+LOOPBACK_DEVICES = {"sim": _serve_simulator}
+
+
+def open_transport(url, baudrate=115200, wait=0, user='micro', password='python'):
+    """ Open a transport by URL, see the top of this file
+
+    :param url: URL or device
+    :param baudrate: serial baudrate, unless the URL has one
+    :param wait: seconds to wait for the device
+    :param user: telnet user, for a plain IP address
+    :param password: telnet password, for a plain IP address
+    :return: transport
+    """
+    if "://" not in url:
+        if url and url[0].isdigit() and url[-1].isdigit() and url.count('.') == 3:
+            return pyboard.TelnetToSerial(url, user, password, read_timeout=10)  # as ampy does
+        return SerialTransport(url, baudrate, wait)
+
+    u = urllib.parse.urlsplit(url)
+    query = urllib.parse.parse_qs(u.query)
+    if u.scheme == "serial":
+        baudrate = int(query.get("baudrate", [baudrate])[0])
+        return SerialTransport(u.netloc + u.path, baudrate, wait)
+
+    if u.scheme == "tcp":
+        if not u.hostname or not u.port:
+            raise pyboard.PyboardError("{} needs a host and a port".format(url))
+        return TcpTransport(u.hostname, u.port, wait)
+
+    if u.scheme == "loop":
+        if u.netloc not in LOOPBACK_DEVICES:
+            raise pyboard.PyboardError("no loopback device {}, see LOOPBACK_DEVICES".format(u.netloc))
+        return LoopbackTransport(LOOPBACK_DEVICES[u.netloc])
+
+    raise pyboard.PyboardError("unknown transport {}".format(url))
+
+
+def bridge(url, host, port, logger=None):
+    """ Serve a board on a TCP port, one client at a time, does not return
+
+    :param url: transport URL of the board
+    :param host: host to listen on
+    :param port: port to listen on
+    :param logger: logger
+    """
+    if logger is None: logger = logging.getLogger(__name__)
+
+    transport = open_transport(url)
+    transport.timeout = 0  # set once, reads only take what select() found, the serial port is not reconfigured
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((host, port))
+    server.listen(1)
+    logger.info("serving {} on {}:{}".format(url, host, port))
+
+    while True:
+        client, addr = server.accept()
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        logger.info("client {}".format(addr))
+
+        try:
+            while True:
+                readable, _, _ = select.select([transport, client], [], [])
+                if transport in readable:
+                    while True:  # the whole buffer, select() does not see the bytes already in it
+                        data = transport.read(Transport.READ_SIZE)
+                        if not data: break
+                        client.sendall(data)
+                if client in readable:
+                    data = client.recv(Transport.READ_SIZE)
+                    if not data: break
+                    transport.write(data)
+        except OSError as er:
+            logger.info("client {}: {}".format(addr, er))
+
+        client.close()
+        logger.info("client {} closed".format(addr))
+
+
+def parse_args():
+    epilog = """
+    Usage examples:
+       python3 UPYRPC_transport.py --port /dev/ttyACM0 --listen 0.0.0.0:7000
+       python3 UPYRPC_transport.py --port loop://sim --listen 127.0.0.1:7000
+    """
+    parser = argparse.ArgumentParser(description='UPYRPC_transport bridge',
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog=epilog)
+
+    parser.add_argument("-p", '--port', dest='port', required=True, type=str, help='Board, serial port or transport URL')
+    parser.add_argument('--listen', dest='listen', default="127.0.0.1:7000", type=str, help='host:port to listen on')
+    parser.add_argument("-v", '--verbose', dest='verbose', default=0, action='count', help='Increase verbosity')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    if args.verbose == 0:
+        logging.basicConfig(level=logging.INFO, format='%(filename)20s %(levelname)6s %(lineno)4s %(message)s')
+    else:
+        logging.basicConfig(level=logging.DEBUG, format='%(filename)20s %(levelname)6s %(lineno)4s %(message)s')
+
+    host, _, port = args.listen.rpartition(":")
+    try:
+        bridge(args.port, host, int(port), logging)
+    except (Exception, pyboard.PyboardError) as er:  # PyboardError is not an Exception
+        logging.error(er)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,71 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+MIT License
+
+Copyright (c) 2019 sistemicorp
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Simulator stand-in for the MicroPython micropython module.
+"""
+import queue
+import threading
+
+_scheduled = queue.Queue()
+
+
+def _scheduler():
+    # on the board scheduled functions run on the main thread between bytecodes,
+    # here they run in order on their own thread
+    while True:
+        func, arg = _scheduled.get()
+        func(arg)
+
+
+threading.Thread(target=_scheduler, name="micropython.schedule", daemon=True).start()
+
+
+def schedule(func, arg):
+    _scheduled.put((func, arg))
+    return True
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+def kbd_intr(chr):
+    pass
+
+
+def const(expr):
+    return expr
+
+
+def native(func):
+    return func
+
+
+def viper(func):
+    return func
+
+
+def mem_info(verbose=False):
+    pass
@@ -0,0 +1,286 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+MIT License
+
+Copyright (c) 2019 sistemicorp
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Simulator stand-in for the MicroPython pyb module.
+- only what the target code uses is implemented
+- pin levels and ADC readings come from _levels and _adc_value(), which a simulation
+  can change to drive the target code
+"""
+import math
+import time
+import random
+import threading
+
+# pyboard v1.1 board pin name -> cpu pin name
+_CPU_PINS = {
+    "X1": "A0", "X2": "A1", "X3": "A2", "X4": "A3", "X5": "A4", "X6": "A5", "X7": "A6", "X8": "A7",
+    "X9": "B6", "X10": "B7", "X11": "C4", "X12": "C5", "X17": "B3", "X18": "C13",
+    "X19": "C0", "X20": "C1", "X21": "C2", "X22": "C3",
+    "Y1": "C6", "Y2": "C7", "Y3": "B8", "Y4": "B9", "Y5": "B12", "Y6": "B13", "Y7": "B14", "Y8": "B15",
+    "Y9": "B10", "Y10": "B11", "Y11": "B0", "Y12": "B1",
+}
+
+_levels = {}  # cpu pin name -> 0|1
+_irqs = {}    # cpu pin name -> (handler, trigger, pin)
+_start = time.time()
+
+
+def millis():
+    return int((time.time() - _start) * 1000)
+
+
+def micros():
+    return int((time.time() - _start) * 1000000)
+
+
+def elapsed_micros(start):
+    return micros() - start
+
+
+def delay(ms):
+    time.sleep(ms / 1000)
+
+
+def udelay(us):
+    time.sleep(us / 1000000)
+
+
+class LED(object):
+    _state = {}
+
+    def __init__(self, led):
+        self._led = led
+
+    def on(self): LED._state[self._led] = True
+    def off(self): LED._state[self._led] = False
+    def toggle(self): LED._state[self._led] = not LED._state.get(self._led, False)
+    def intensity(self, value=None): return 255 if LED._state.get(self._led, False) else 0
+
+
+class Pin(object):
+    IN = 0
+    OUT_PP = 1
+    OUT_OD = 17
+    AF_PP = 2
+    ANALOG = 3
+    PULL_NONE = 0
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_RISING = 0x10110000
+    IRQ_FALLING = 0x10210000
+
+    def __init__(self, name, mode=None, pull=None, af=-1, value=None):
+        if isinstance(name, Pin):
+            name = name._board
+        self._board = name
+        self._cpu = _CPU_PINS.get(name, name)
+        if mode is not None:
+            self.init(mode, pull, af, value)
+
+    def init(self, mode=IN, pull=PULL_NONE, af=-1, value=None):
+        self._mode = mode
+        if value is not None:
+            _levels[self._cpu] = 1 if value else 0
+        elif pull == Pin.PULL_UP:
+            _levels.setdefault(self._cpu, 1)
+        else:
+            _levels.setdefault(self._cpu, 0)
+
+    def names(self):
+        return [self._cpu, self._board]
+
+    def name(self):
+        return self._cpu
+
+    def port(self):
+        return ord(self._cpu[0]) - ord("A")
+
+    def pin(self):
+        return int(self._cpu[1:])
+
+    def value(self, value=None):
+        if value is None:
+            return _levels.get(self._cpu, 0)
+        _set_level(self._cpu, 1 if value else 0)
+
+    def high(self): self.value(1)
+    def low(self): self.value(0)
+    def on(self): self.value(1)
+    def off(self): self.value(0)
+
+    def irq(self, handler=None, trigger=IRQ_RISING | IRQ_FALLING, hard=False):
+        if handler is None:
+            _irqs.pop(self._cpu, None)
+        else:
+            _irqs[self._cpu] = (handler, trigger, self)
+
+
+def _set_level(cpu, level):
+    """ set a pin level, calls the pin irq handler on a matching edge """
+    old = _levels.get(cpu, 0)
+    _levels[cpu] = level
+    if cpu in _irqs and old != level:
+        handler, trigger, pin = _irqs[cpu]
+        if (level and trigger & Pin.IRQ_RISING) or (not level and trigger & Pin.IRQ_FALLING):
+            handler(pin)
+
+
+def _adc_value(cpu):
+    """ simulated 12 bit ADC reading of a pin, a slow sine wave with some noise """
+    phase = (ord(cpu[0]) + int(cpu[1:])) / 7.0
+    return max(0, min(4095, int(2048 + 1000 * math.sin(2 * math.pi * time.time() + phase) + random.randint(-4, 4))))
+
+
+class ADC(object):
+    def __init__(self, pin):
+        if not isinstance(pin, Pin):
+            pin = Pin(pin)
+        self._pin = pin
+
+    def read(self):
+        return _adc_value(self._pin.name())
+
+    def read_timed(self, buf, timer):
+        ADC.read_timed_multi((self,), (buf,), timer)
+        return True
+
+    @staticmethod
+    def read_timed_multi(adcs, bufs, timer):
+        period = 1.0 / timer.freq()
+        t = time.time()
+        for i in range(len(bufs[0])):
+            for adc, buf in zip(adcs, bufs):
+                buf[i] = adc.read()
+            t += period
+            delay_s = t - time.time()
+            if delay_s > 0: time.sleep(delay_s)
+        return True
+
+
+class ADCAll(object):
+    def __init__(self, resolution, mask=0xffffffff):
+        self._resolution = resolution
+
+    def read_channel(self, channel):
+        if channel == 16: return 940   # temp sensor
+        if channel == 17: return 1500  # vref
+        if channel == 18: return 1240  # vbat / 2
+        return _adc_value("A{}".format(channel))
+
+    def read_core_temp(self): return 25.0 + random.random()
+    def read_core_vbat(self): return 3.3 + random.random() / 100
+    def read_core_vref(self): return 1.21 + random.random() / 1000
+    def read_vref(self): return 3.3 + random.random() / 1000
+
+
+class TimerChannel(object):
+    def __init__(self, timer, channel, mode, pin):
+        self._timer = timer
+        self._channel = channel
+        self._mode = mode
+        self._pin = pin
+        self._percent = 0
+
+    def pulse_width_percent(self, value=None):
+        if value is None: return self._percent
+        self._percent = value
+
+    def callback(self, func):
+        pass
+
+
+class Timer(object):
+    PWM = 0
+    PWM_INVERTED = 1
+    OC_TIMING = 2
+    IC = 8
+    UP = 0
+
+    def __init__(self, id, **kwargs):
+        self._id = id
+        self._freq = None
+        self._callback = None
+        self._thread_run = False
+        self._counter = 0
+        self._prescaler = 0
+        self._period = 0
+        if kwargs:
+            self.init(**kwargs)
+
+    def _source_freq(self):
+        return 168000000 if self._id in (1, 8, 9, 10, 11) else 84000000
+
+    def init(self, freq=None, prescaler=None, period=None, callback=None, **kwargs):
+        if freq is not None:
+            self._freq = float(freq)
+        else:
+            self._prescaler = prescaler or 0
+            self._period = period or 0
+            self._freq = self._source_freq() / ((self._prescaler + 1) * (self._period + 1))
+        self.callback(callback)
+
+    def deinit(self):
+        self._callback = None
+        self._thread_run = False
+
+    def freq(self, value=None):
+        if value is None: return self._freq
+        self._freq = float(value)
+
+    def prescaler(self, value=None):
+        if value is None: return self._prescaler
+        self._prescaler = value
+        self._freq = self._source_freq() / ((self._prescaler + 1) * (self._period + 1))
+
+    def period(self, value=None):
+        if value is None: return self._period
+        self._period = value
+        self._freq = self._source_freq() / ((self._prescaler + 1) * (self._period + 1))
+
+    def counter(self, value=None):
+        if value is None: return self._counter
+        self._counter = value
+
+    def channel(self, channel, mode=None, pin=None, **kwargs):
+        return TimerChannel(self, channel, mode, pin)
+
+    def callback(self, func):
+        self._callback = func
+        if func is not None and not self._thread_run:
+            self._thread_run = True
+            threading.Thread(target=self._tick, daemon=True).start()
+        elif func is None:
+            self._thread_run = False
+
+    def _tick(self):
+        # call the callback at freq, catching up when the thread falls behind
+        t = time.time()
+        while self._thread_run:
+            t += 1.0 / self._freq
+            delay_s = t - time.time()
+            if delay_s > 0: time.sleep(delay_s)
+            callback = self._callback
+            if callback is None or not self._thread_run: break
+            callback(self)
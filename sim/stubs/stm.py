@@ -0,0 +1,55 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+MIT License
+
+Copyright (c) 2019 sistemicorp
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Simulator stand-in for the MicroPython stm module.
+- only the GPIO input data registers are simulated, from the pin levels in pyb
+"""
+import pyb
+
+GPIOA = 0x40020000
+GPIOB = 0x40020400
+GPIOC = 0x40020800
+GPIOD = 0x40020c00
+GPIOE = 0x40021000
+GPIOH = 0x40021c00
+GPIO_IDR = 0x10
+
+_PORT_SIZE = 0x400
+
+
+class _Mem(object):
+    def __getitem__(self, addr):
+        port, reg = divmod(addr - GPIOA, _PORT_SIZE)
+        if reg != GPIO_IDR:
+            raise ValueError("register 0x{:08x} is not simulated".format(addr))
+
+        letter = chr(ord("A") + port)
+        mask = 0
+        for cpu, level in list(pyb._levels.items()):
+            if level and cpu[0] == letter: mask |= 1 << int(cpu[1:])
+        return mask
+
+
+mem32 = _Mem()
@@ -0,0 +1,239 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+MIT License
+
+Copyright (c) 2019 sistemicorp
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+UPYRPC benchmarks, run against the simulator (upyrpc_sim.py) or a board,
+
+    $ python3 sim/upyrpc_bench.py --json bench.json
+    $ python3 sim/upyrpc_bench.py --port /dev/ttyACM0 --protocol framed
+
+For each protocol (exec, framed, push),
+    calls   - calls/sec of back to back calls of cheap methods
+    latency - latency percentiles of those calls, per method and phase, see UPYRPC.latency
+    adc     - adc_read_multi transfers, samples/sec and bytes/sec of fetching the results
+
+Without --port a new simulator is started for each protocol, so every run starts from the same
+state.  Numbers from the simulator are for comparing changes, they are not the numbers of a board.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ampy.pyboard as pyboard
+
+from UPYRPC import UPYRPC
+from stublogger import StubLogger
+
+VERSION = "0.2.0"
+
+SIM = os.path.join(os.path.dirname(os.path.abspath(__file__)), "upyrpc_sim.py")
+PROTOCOLS = ("exec", "framed", "push")
+CALL_METHODS = ("ping", "unique_id")
+ADC_PINS = ["X19", "X20", "X21", "X22"]
+
+
+class Simulator(object):
+    """ simulator in a child process, on its own pty
+    - files the target writes go to a temporary directory
+
+        with Simulator() as port:
+            pyb = UPYRPC(port)
+    """
+    START_TIMEOUT_S = 10
+
+    def __init__(self):
+        self.port = None
+        self._proc = None
+        self._tmp = None
+
+    def __enter__(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._proc = subprocess.Popen([sys.executable, SIM], cwd=self._tmp.name,
+                                      stdout=subprocess.PIPE, universal_newlines=True)
+        line = self._proc.stdout.readline()  # "simulator on <port>"
+        if not line.startswith("simulator on "):
+            self.__exit__(None, None, None)
+            raise RuntimeError("simulator did not start: {}".format(line))
+        self.port = line.split()[-1]
+        return self.port
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._proc is not None:
+            self._proc.kill()
+            self._proc.wait(self.START_TIMEOUT_S)
+            self._proc.stdout.close()
+            self._proc = None
+        if self._tmp is not None:
+            self._tmp.cleanup()
+            self._tmp = None
+
+
+def bench_calls(pyb, calls, logger):
+    """ back to back calls of CALL_METHODS
+
+    :return: {<method>: {"calls": #, "time_s": #, "calls_per_s": #}, ...}
+    """
+    results = {}
+    for method in CALL_METHODS:
+        func = getattr(pyb, method)
+        start = time.perf_counter()
+        for _ in range(calls):
+            success, result = func()
+            if not success:
+                raise RuntimeError("{} failed: {}".format(method, result))
+        elapsed = time.perf_counter() - start
+        results[method] = {"calls": calls, "time_s": elapsed, "calls_per_s": calls / elapsed}
+        logger.info("{:>10} {:8.1f} calls/s".format(method, calls / elapsed))
+    return results
+
+
+def bench_adc(pyb, rounds, samples, freq, pins, logger):
+    """ adc_read_multi, and fetching its results with get_server_method()
+    - sampling time (samples / freq) is part of each round, it is not part of the fetch
+
+    :return: {"rounds": #, "samples": #, "pins": #, "bytes": #, "round_s": #, "fetch_s": #,
+              "samples_per_s": #, "bytes_per_s": #}
+    """
+    fetch_s = 0.0
+    total_bytes = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        success, result = pyb.adc_read_multi(pins=pins, samples=samples, freq=freq)
+        if not success:
+            raise RuntimeError("adc_read_multi failed: {}".format(result))
+
+        time.sleep(samples / freq)
+        fetch = time.perf_counter()
+        success, result = pyb.get_server_method("adc_read_multi_results")
+        fetch_s += time.perf_counter() - fetch
+        if not success:
+            raise RuntimeError("adc_read_multi_results failed: {}".format(result))
+
+        value = result[-1]["value"]
+        total_bytes += sum(len(value[pin]) * 2 for pin in pins)
+    elapsed = time.perf_counter() - start
+
+    total_samples = rounds * samples * len(pins)
+    results = {"rounds": rounds, "samples": samples, "pins": len(pins), "bytes": total_bytes,
+               "round_s": elapsed / rounds, "fetch_s": fetch_s / rounds,
+               "samples_per_s": total_samples / fetch_s, "bytes_per_s": total_bytes / fetch_s}
+    logger.info("{:>10} {:8.1f} kB/s, {:.0f} samples/s, fetch {:.1f} ms, round {:.1f} ms".format(
+        "adc", results["bytes_per_s"] / 1000, results["samples_per_s"],
+        results["fetch_s"] * 1000, results["round_s"] * 1000))
+    return results
+
+
+def run(port, protocol, calls, rounds, samples, freq, pins, logger=None):
+    """ run the benchmarks of one protocol
+
+    :param port: serial port of the board or simulator
+    :param protocol: one of PROTOCOLS
+    :return: {"calls": ..., "adc": ..., "latency": <UPYRPC.latency.snapshot()>, "startup": ...}
+    """
+    if logger is None: logger = StubLogger()
+
+    pyb = UPYRPC(port, framed=protocol == "framed", push=protocol == "push", loggerIn=StubLogger())
+    try:
+        success, result = pyb.start_server()
+        if not success:
+            raise RuntimeError("start_server failed: {}".format(result))
+
+        results = {"startup": pyb.startup}
+        results["calls"] = bench_calls(pyb, calls, logger)
+        results["latency"] = pyb.latency.snapshot()  # only the calls, adc_read_multi results are large
+        results["adc"] = bench_adc(pyb, rounds, samples, freq, pins, logger)
+        return results
+    finally:
+        pyb.close()
+
+
+def parse_args():
+    epilog = """
+    Usage examples:
+       python3 sim/upyrpc_bench.py
+       python3 sim/upyrpc_bench.py --protocol push --calls 1000 --json bench.json
+       python3 sim/upyrpc_bench.py --port /dev/ttyACM0
+    """
+    parser = argparse.ArgumentParser(description='UPYRPC_bench',
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog=epilog)
+
+    parser.add_argument("-p", '--port', dest='port', default=None, type=str,
+                        help='Serial port of a board, default is to start the simulator')
+    parser.add_argument('--protocol', dest='protocols', default=[], choices=PROTOCOLS, action='append',
+                        help='Protocol to benchmark, repeat for many, default is all')
+    parser.add_argument('--calls', dest='calls', default=200, type=int, help='Calls per method')
+    parser.add_argument('--rounds', dest='rounds', default=10, type=int, help='adc_read_multi rounds')
+    parser.add_argument('--samples', dest='samples', default=1000, type=int, help='adc_read_multi samples per pin')
+    parser.add_argument('--freq', dest='freq', default=10000, type=int, help='adc_read_multi sample rate')
+    parser.add_argument('--json', dest='json', default=None, type=str, help='Write the results to a JSON file')
+    parser.add_argument("-v", '--verbose', dest='verbose', default=0, action='count', help='Increase verbosity')
+
+    args = parser.parse_args()
+    if not args.protocols: args.protocols = list(PROTOCOLS)
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    if args.verbose == 0:
+        logging.basicConfig(level=logging.INFO, format='%(filename)20s %(levelname)6s %(lineno)4s %(message)s')
+    else:
+        logging.basicConfig(level=logging.DEBUG, format='%(filename)20s %(levelname)6s %(lineno)4s %(message)s')
+
+    report = {"version": VERSION, "target": args.port or "simulator",
+              "config": {"calls": args.calls, "rounds": args.rounds, "samples": args.samples,
+                         "freq": args.freq, "pins": ADC_PINS},
+              "protocols": {}}
+    for protocol in args.protocols:
+        logging.info("{} protocol".format(protocol))
+        try:
+            if args.port:
+                report["protocols"][protocol] = run(args.port, protocol, args.calls, args.rounds,
+                                                    args.samples, args.freq, ADC_PINS, logging)
+            else:
+                with Simulator() as port:
+                    report["protocols"][protocol] = run(port, protocol, args.calls, args.rounds,
+                                                        args.samples, args.freq, ADC_PINS, logging)
+        except (Exception, pyboard.PyboardError) as er:  # PyboardError is not an Exception
+            logging.error("{} failed: {}".format(protocol, er))
+            sys.exit(1)
+
+        for method in CALL_METHODS:
+            total = report["protocols"][protocol]["latency"][method]["total"]
+            logging.info("{:>10} p50 {:.2f} ms, p95 {:.2f} ms, p99 {:.2f} ms".format(
+                method, total["p50"] * 1000, total["p95"] * 1000, total["p99"] * 1000))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        logging.info("results written to {}".format(args.json))
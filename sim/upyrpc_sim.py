@@ -0,0 +1,298 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+MIT License
+
+Copyright (c) 2019 sistemicorp
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+PyBoard simulator
+- runs the unmodified target code (../target) under CPython, with the modules in ./stubs
+  standing in for pyb, machine and micropython
+- speaks the raw REPL protocol on a pty, so UPYRPC connects to it like a real board,
+
+    $ python3 sim/upyrpc_sim.py
+    simulator on /dev/pts/5
+    $ python3 UPYRPC_cli.py --port /dev/pts/5 misc --200
+
+- it is only as accurate as the stubs, use it to test the protocol and the host code, and to
+  compare the performance of changes, not to test hardware behaviour
+- it can also run in the host process, behind the loop://sim transport, see UPYRPC_transport.py
+"""
+import os
+import sys
+import time
+import tokenize
+import threading
+import traceback
+import importlib.abc
+import importlib.util
+
+SIM_DIR = os.path.dirname(os.path.abspath(__file__))
+TARGET_DIR = os.path.join(os.path.dirname(SIM_DIR), "target")
+TARGET_MODULES = ("upyrpc_const", "upyrpc_frame", "upyrpc_queue", "upyrpc_server", "upyrpc_main")
+
+RAW_REPL_BANNER = b"raw REPL; CTRL-B to exit\r\n"
+FRIENDLY_BANNER = b"MicroPython simulator; upyrpc\r\nType \"help()\" for more information.\r\n>>> "
+
+
+class _Uname(object):
+    """ os.uname() as MicroPython prints it """
+    sysname = "pyboard"
+    nodename = "pyboard"
+    release = "1.11.0"
+    version = "upyrpc simulator"
+    machine = "PYBv1.1 simulator"
+
+    def __str__(self):
+        return "(sysname='{}', nodename='{}', release='{}', version='{}', machine='{}')".format(
+            self.sysname, self.nodename, self.release, self.version, self.machine)
+
+
+class _TargetFinder(importlib.abc.MetaPathFinder, importlib.abc.SourceLoader):
+    """ imports the target modules without CPython's private name mangling
+    - MicroPython does not mangle names like __DEBUG_FILE in class bodies, CPython does,
+      so private names are renamed consistently in every target module as it is loaded
+    """
+    def find_spec(self, fullname, path, target=None):
+        if fullname not in TARGET_MODULES:
+            return None
+        return importlib.util.spec_from_loader(fullname, self, origin=self.get_filename(fullname))
+
+    def get_filename(self, fullname):
+        return os.path.join(TARGET_DIR, fullname + ".py")
+
+    def get_data(self, path):
+        with open(path, "rb") as f:
+            tokens = list(tokenize.tokenize(f.readline))
+        for idx, tok in enumerate(tokens):
+            if tok.type == tokenize.NAME and tok.string.startswith("__") and not tok.string.endswith("__"):
+                tokens[idx] = tok._replace(string="_mpy" + tok.string)
+        return tokenize.untokenize(tokens)
+
+
+def install_stubs():
+    """ make the CPython runtime look enough like MicroPython for the target code
+    - this changes the process, the simulator should run in its own process
+    """
+    import gc
+
+    if any(isinstance(finder, _TargetFinder) for finder in sys.meta_path):
+        return  # already installed
+
+    if SIM_DIR + "/stubs" not in sys.path:
+        sys.path.insert(0, os.path.join(SIM_DIR, "stubs"))
+    sys.meta_path.insert(0, _TargetFinder())
+
+    start = time.perf_counter()
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+    time.sleep_us = lambda us: time.sleep(us / 1000000)
+    time.ticks_ms = lambda: int((time.perf_counter() - start) * 1000) & 0x3fffffff
+    time.ticks_us = lambda: int((time.perf_counter() - start) * 1000000) & 0x3fffffff
+    time.ticks_add = lambda ticks, delta: (ticks + delta) & 0x3fffffff
+    time.ticks_diff = lambda end, begin: ((end - begin + 0x20000000) & 0x3fffffff) - 0x20000000
+
+    os.uname = _Uname
+    gc.mem_free = lambda: 100000
+    gc.mem_alloc = lambda: 20000
+
+
+class _Stdout(object):
+    """ sys.stdout of the exec'd code, newlines are sent as \\r\\n like the board does """
+    def __init__(self, write):
+        self.buffer = self
+        self._write = write
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.replace("\n", "\r\n").encode("utf-8")
+        self._write(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class _Stdin(object):
+    """ sys.stdin of the exec'd code """
+    def __init__(self, read):
+        self.buffer = self
+        self.read = read
+
+
+class _ThreadStream(object):
+    """ sys.stdout or sys.stdin, that is the board's stream on the REPL thread, and the process'
+    stream on other threads, so the simulator can run in the host process
+    - the target only uses stdin/stdout on the REPL thread, serve_frames() keeps the board's
+      stream it got there
+    """
+    def __init__(self, default):
+        self._default = default
+        self._local = threading.local()
+
+    def set(self, stream):
+        self._local.stream = stream
+
+    def __getattr__(self, name):
+        return getattr(getattr(self._local, "stream", None) or self._default, name)
+
+
+def _redirect(name, stream):
+    """ make stream sys.<name> of this thread """
+    proxy = getattr(sys, name)
+    if not isinstance(proxy, _ThreadStream):
+        proxy = _ThreadStream(proxy)
+        setattr(sys, name, proxy)
+    proxy.set(stream)
+
+
+class RawRepl(object):
+    """ REPL of the simulated board
+    - the target modules are shared by the process, there can only be one RawRepl running
+
+    :param read: function read() -> bytes, blocks until some bytes are available, b"" on EOF
+    :param write: function write(bytes)
+    """
+    def __init__(self, read, write):
+        self._read_raw = read
+        self._write_raw = write
+        self._lock = threading.Lock()
+        self._buf = b""
+        self._raw = False
+        self._globals = {}
+        self.eof = False
+
+    def write(self, data):
+        with self._lock:
+            self._write_raw(data)
+
+    def read(self, n):
+        """ read exactly n bytes, used by the REPL and by sys.stdin of exec'd code """
+        while len(self._buf) < n:
+            data = self._read_raw()
+            if not data:
+                self.eof = True
+                raise EOFError()
+            self._buf += data
+        data, self._buf = self._buf[:n], self._buf[n:]
+        return data
+
+    def soft_reset(self):
+        for name in TARGET_MODULES:
+            sys.modules.pop(name, None)
+        self._globals = {"__name__": "__main__"}
+
+    def run(self):
+        _redirect("stdout", _Stdout(self.write))
+        _redirect("stdin", _Stdin(self.read))
+        self.soft_reset()
+        self.write(FRIENDLY_BANNER)
+        line = b""
+        try:
+            while True:
+                c = self.read(1)
+                if c == b"\x01":
+                    self._raw = True
+                    line = b""
+                    self.write(b"\r\n" + RAW_REPL_BANNER + b">")
+                elif c == b"\x02":
+                    self._raw = False
+                    line = b""
+                    self.write(b"\r\n" + FRIENDLY_BANNER)
+                elif c == b"\x03":
+                    line = b""
+                elif not self._raw:
+                    continue  # the friendly REPL is not simulated
+                elif c == b"\x04":
+                    if not line:
+                        self.soft_reset()
+                        self.write(b"soft reboot\r\n" + RAW_REPL_BANNER + b">")
+                        continue
+                    self.write(b"OK")
+                    self._exec(line)
+                    line = b""
+                else:
+                    line += c
+        except EOFError:
+            pass
+
+    def _exec(self, code):
+        err = b""
+        try:
+            exec(compile(code.decode("utf-8"), "<stdin>", "exec"), self._globals)
+        except EOFError:
+            raise
+        except BaseException:
+            err = traceback.format_exc().replace("\n", "\r\n").encode("utf-8")
+        self.write(b"\x04" + err + b"\x04>")
+
+
+def open_pty():
+    """ open a pty for the simulator
+
+    :return: (master fd, slave device path)
+    """
+    import pty
+    import tty
+
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    tty.setraw(master)
+    return master, os.ttyname(slave)
+
+
+def serve_pty(master):
+    """ run the simulator REPL on the master side of a pty, does not return """
+    def read():
+        try:
+            return os.read(master, 4096)
+        except OSError:
+            return b""
+
+    def write(data):
+        while data:
+            n = os.write(master, data)
+            data = data[n:]
+
+    RawRepl(read, write).run()
+
+
+def serve_socket(sock):
+    """ run the simulator REPL on a connected socket, until it is closed """
+    def read():
+        try:
+            return sock.recv(4096)
+        except OSError:
+            return b""
+
+    def write(data):
+        try:
+            sock.sendall(data)
+        except OSError:
+            pass  # closed, read() ends the REPL
+
+    RawRepl(read, write).run()
+
+
+if __name__ == '__main__':
+    install_stubs()
+    master, path = open_pty()
+    print("simulator on {}".format(path), file=sys.__stdout__, flush=True)
+    serve_pty(master)
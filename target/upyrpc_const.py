@@ -34,3 +34,13 @@ PYB_PIN_OUT_OD = 2
 PYB_PIN_PULLNONE = 3
 PYB_PIN_PULLDN = 4
 PYB_PIN_PULLUP = 5
+
+# framed binary protocol, see upyrpc_frame.py
+FRAME_CMD = 0x01
+FRAME_RET = 0x02
+FRAME_PEEK = 0x03
+FRAME_EXIT = 0x04
+FRAME_CONFIG = 0x05
+FRAME_REPLY = 0x80
+FRAME_ERROR = 0x81
+FRAME_PUSH = 0x82  # unsolicited result, sent by the server in push mode
@@ -0,0 +1,121 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+MIT License
+
+Copyright (c) 2019 sistemicorp
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import json
+import struct
+
+# Frame layout, all little endian,
+#
+#   | 0xA5 | type (1) | length (2) | payload (length) | crc16 (2) |
+#
+# - payload is a compact JSON document
+# - crc16 (CCITT) covers type, length and payload
+# - this module is shared by the target and the PC, keep it MicroPython friendly
+FRAME_MAGIC = 0xA5
+FRAME_MAX_PAYLOAD = 0xFFFF
+
+
+def _make_crc_table():
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            if crc & 0x8000: crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else: crc = (crc << 1) & 0xFFFF
+        table.append(crc)
+    return table
+
+
+_CRC_TABLE = _make_crc_table()
+
+
+def crc16(data, crc=0xFFFF):
+    """ CRC-16/CCITT of data
+
+    :param data: bytes
+    :param crc: initial value, allows chaining calls
+    :return: crc
+    """
+    table = _CRC_TABLE
+    for b in data:
+        crc = ((crc << 8) & 0xFFFF) ^ table[((crc >> 8) ^ b) & 0xFF]
+    return crc
+
+
+def dumps(obj):
+    """ compact JSON, MicroPython json.dumps has no separators argument """
+    try:
+        return json.dumps(obj, separators=(",", ":"))
+    except TypeError:
+        return json.dumps(obj)
+
+
+def encode_frame(ftype, payload):
+    """ Build a frame
+
+    :param ftype: one of FRAME_*
+    :param payload: bytes
+    :return: bytes
+    """
+    if len(payload) > FRAME_MAX_PAYLOAD:
+        raise ValueError("payload too large")
+    header = struct.pack("<BH", ftype, len(payload))
+    crc = crc16(payload, crc16(header))
+    return bytes([FRAME_MAGIC]) + header + payload + struct.pack("<H", crc)
+
+
+def encode_obj(ftype, obj):
+    """ Build a frame with a JSON payload
+
+    :param ftype: one of FRAME_*
+    :param obj: JSON serializable object
+    :return: bytes
+    """
+    return encode_frame(ftype, dumps(obj).encode())
+
+
+def read_frame(read, brk=None):
+    """ Read one frame from a stream
+    - bytes before the magic byte are skipped, which resyncs the stream
+
+    :param read: function read(n), returns n bytes
+    :param brk: byte that breaks off the stream when it is seen before the magic byte, like
+                ctrl-C (0x03) from a client that is no longer framing
+    :return: (ftype, payload), or None if the frame failed the crc check, or (brk, None) on brk
+    """
+    while True:
+        b = read(1)
+        if b and b[0] == FRAME_MAGIC:
+            break
+        if b and b[0] == brk:
+            return brk, None
+
+    header = read(3)
+    ftype, length = struct.unpack("<BH", header)
+    payload = read(length) if length else b""
+    crc = struct.unpack("<H", read(2))[0]
+    if crc16(payload, crc16(header)) != crc:
+        return None
+    return ftype, payload
@@ -28,8 +28,11 @@ import time
 import pyb
 import micropython
 import array
+import binascii
+import math
 import machine
 import os
+import stm
 
 from upyrpc_const import *
 from upyrpc_server import MicroPyServer
@@ -50,10 +53,23 @@ class uPyRPC(MicroPyServer):
 
             self._ret.put({"method": "pwm", "value": {'value': 'scheduled'}, "success": True})
 
+        2. Results put from another thread or a scheduled function must carry the request id,
+           which is self._ret.rid at the time the RPC method was called, like so,
+
+            self._ret.put({"method": "pwm", "value": {}, "success": True, "id": rid})
+
 
     """
     VERSION = "0.2"
-    SERVER_CMD_SLEEP_MS = 100  # polling time for processing new commands
+    RET_QUEUE_LANES = {"_debug": 4, "adc_read_multi_results": 2, "adc_stream_chunk": 4,
+                       "adc_monitor_window": 4, "adc_monitor_alarm": 8}
+    METHOD_PRIORITY = dict(MicroPyServer.METHOD_PRIORITY)
+    METHOD_PRIORITY.update({
+        "get_gpio": MicroPyServer.PRIORITY_CONTROL, "set_gpio": MicroPyServer.PRIORITY_CONTROL,
+        "get_gpios": MicroPyServer.PRIORITY_CONTROL, "set_gpios": MicroPyServer.PRIORITY_CONTROL,
+        "get_gpio_ports": MicroPyServer.PRIORITY_CONTROL, "led": MicroPyServer.PRIORITY_CONTROL,
+        "adc_read": MicroPyServer.PRIORITY_BULK, "adc_read_multi": MicroPyServer.PRIORITY_BULK,
+    })
 
     LED_RED    = 1
     LED_GREEN  = 2
@@ -69,9 +85,23 @@ class uPyRPC(MicroPyServer):
     ADC_READ_MULTI_TIMER = 8
     ADC_MAX_FREQ = 10000
     ADC_MAX_SAMPLES = 1000
+    ADC_READ_STATS = ["mean", "min", "max", "rms", "var", "std"]
+    ADC_READ_CHUNK = 100  # samples taken between yields, when there is no sample_ms wait
+    ADC_MAX_BINS = 64
+    ADC_STREAM_TIMER = 7
+    ADC_STREAM_MAX_CHUNK = 500  # samples per pin per chunk, there are two chunk buffers per pin
+    ADC_CAPTURE_TIMER = 11
+    ADC_CAPTURE_MAX_SAMPLES = 1000  # pre + post samples per pin
+    ADC_CAPTURE_EDGES = {"rising": (0, 1), "falling": (1, 0), "both": None}  # (level before, level after)
+    ADC_MONITOR_MAX_FREQ = 1000  # sampled on a thread, not a timer, so the internal channels can be monitored
 
     PWM_MAX_FREQ = 10000
 
+    GPIO_PORTS = "ABCDEFGHI"  # pyb.Pin.port() is the index in this
+    GPIO_SEQ_TIMER = 6
+    GPIO_SEQ_MIN_TICK_US = 50
+    GPIO_SEQ_MAX_STEPS = 256
+
     JIG_CLOSED_TIMER = 4
     JIG_CLOSED_TIMER_FREQ = 1  # Hz
     JIG_CLOSED_PIN = "X1"
@@ -89,8 +119,21 @@ class uPyRPC(MicroPyServer):
             "timers": {},          # timers running are listed here
             "pwm": {},             # pwms
             "adc_read_multi": {},  # cache args
+            "adc_stream": {},      # streaming capture state, see adc_stream()
+            "gpio_seq": {},        # gpio sequence state, see gpio_seq()
+            "adc_capture": {},     # triggered capture state, see adc_capture()
+            "adc_monitor": {},     # background monitor state, see adc_monitor()
+            "periph": {},          # peripheral objects and sample buffers, reused until reset()
         }
 
+        # bound methods allocate when they are looked up, so the ISR uses these
+        self._adc_stream_isr_ref = self._adc_stream_isr
+        self._adc_stream_chunk_ref = self._adc_stream_chunk
+        self._gpio_seq_isr_ref = self._gpio_seq_isr
+        self._gpio_seq_done_ref = self._gpio_seq_done
+        self._adc_capture_isr_ref = self._adc_capture_isr
+        self._adc_capture_done_ref = self._adc_capture_done
+
         self._debug_flag = debug
         self.reset({})
 
@@ -99,6 +142,49 @@ class uPyRPC(MicroPyServer):
 
     def _init_gpio(self, name, pin, mode, pull=pyb.Pin.PULL_NONE):
         self.ctx["gpio"][name] = pyb.Pin(pin, mode, pull)
+        self.ctx["periph"].pop(("adc", pin), None)  # the pin is no longer in analog mode
+
+    def _led(self, led):
+        """ cached pyb.LED
+        """
+        key = ("led", led)
+        obj = self.ctx["periph"].get(key, None)
+        if obj is None:
+            obj = self.ctx["periph"][key] = pyb.LED(led)
+        return obj
+
+    def _adc(self, pin):
+        """ cached pyb.ADC of a pin
+        """
+        key = ("adc", pin)
+        obj = self.ctx["periph"].get(key, None)
+        if obj is None:
+            obj = self.ctx["periph"][key] = pyb.ADC(pyb.Pin('{}'.format(pin)))
+        return obj
+
+    def _adc_all(self):
+        """ cached pyb.ADCAll, for the internal channels
+        """
+        key = ("adcall", 12, 0x70000)
+        obj = self.ctx["periph"].get(key, None)
+        if obj is None:
+            obj = self.ctx["periph"][key] = pyb.ADCAll(12, 0x70000)
+        return obj
+
+    def _adc_buf(self, name, samples):
+        """ cached sample buffer, one per name, it is reallocated if the number of samples changes
+        - the buffer is reused by the next call with the same name, so copy the samples out of it
+
+        :param name: buffer name
+        :param samples: number of samples
+        :return: array('H')
+        """
+        key = ("buf", name)
+        buf = self.ctx["periph"].get(key, None)
+        if buf is None or len(buf) != samples:
+            self.ctx["periph"][key] = None  # let the old buffer go before making the new one
+            buf = self.ctx["periph"][key] = array.array('H', (0 for i in range(samples)))
+        return buf
 
     # ===================================================================================
     # Methods
@@ -112,10 +198,10 @@ class uPyRPC(MicroPyServer):
 
         :return:
         """
-        pyb.LED(LED_RED).on()
-        pyb.LED(LED_GREEN).on()
-        pyb.LED(LED_YELLOW).on()
-        pyb.LED(LED_BLUE).on()
+        self._led(LED_RED).on()
+        self._led(LED_GREEN).on()
+        self._led(LED_YELLOW).on()
+        self._led(LED_BLUE).on()
 
         # turn off threads, all threads should be in a while loop, looking at the state
         # of self.ctx["threads"][<name>], and exit if this is False.  Set all names to False...
@@ -129,14 +215,22 @@ class uPyRPC(MicroPyServer):
             temp = pyb.Pin(name, pyb.Pin.IN, pyb.Pin.PULL_NONE)
             self.ctx["gpio"].pop(p)
 
+        self._adc_stream_stop()
+        self._gpio_seq_stop()
+        self._adc_capture_stop()
+        self._adc_monitor_stop()
+
         # turn off timers
         for t in self.ctx["timers"]:
             pass  # TODO: cancel
 
-        pyb.LED(LED_RED).off()
-        pyb.LED(LED_GREEN).off()
-        pyb.LED(LED_YELLOW).off()
-        pyb.LED(LED_BLUE).off()
+        self._led(LED_RED).off()
+        self._led(LED_GREEN).off()
+        self._led(LED_YELLOW).off()
+        self._led(LED_BLUE).off()
+
+        # peripherals are created again on first use
+        self.ctx["periph"] = {}
         self._ret.put({"method": "reset", "value": {}, "success": True})
 
     def unique_id(self, args):
@@ -190,16 +284,17 @@ class uPyRPC(MicroPyServer):
         :return:
         """
         thread_name = "led{}".format(led)
+        _led = self._led(led)
         while self.ctx["threads"][thread_name]:
-            pyb.LED(led).on()
+            _led.on()
             time.sleep_ms(on_ms)
             if off_ms:
-                pyb.LED(led).off()
+                _led.off()
                 time.sleep_ms(off_ms)
             if once: break
 
         self.ctx["threads"][thread_name] = False
-        pyb.LED(led).off()
+        _led.off()
 
     def led_toggle(self, args):
         """ Toggle LED on
@@ -246,8 +341,8 @@ class uPyRPC(MicroPyServer):
                 value = {'err': "unknown led {}".format(led)}
                 self._ret.put({"method": "led", "value": value, "success": False})
 
-            if enable: pyb.LED(led).on()
-            else: pyb.LED(led).off()
+            if enable: self._led(led).on()
+            else: self._led(led).off()
 
         self._ret.put({"method": "led", "value": {}, "success": True})
 
@@ -312,14 +407,262 @@ class uPyRPC(MicroPyServer):
         else: self.ctx["gpio"][name].low()
         self._ret.put({"method": "set_gpio", "value": {}, "success": True})
 
+    def _gpio_missing(self, names):
+        """ names of gpios that have not been initialized, as an error value, or None
+        """
+        missing = [n for n in names if n not in self.ctx["gpio"]]
+        if not missing: return None
+        return {'err': "{} has not been initialized".format(", ".join(missing))}
+
+    def set_gpios(self, args):
+        """ set many gpios
+        - nothing is set if any of the gpios has not been initialized
+
+        args:
+        :param values: {<name>: True|False, ...}
+        :return: None
+        """
+        values = args.get("values", {})
+
+        err = self._gpio_missing(values)
+        if err:
+            self._ret.put({"method": "set_gpios", "value": err, "success": False})
+            return
+
+        for name, value in values.items():
+            if value: self.ctx["gpio"][name].high()
+            else: self.ctx["gpio"][name].low()
+        self._ret.put({"method": "set_gpios", "value": {}, "success": True})
+
+    def get_gpios(self, args):
+        """ get many gpios
+
+        args:
+        :param names: [<name>, ...]
+        :return: {'values': {<name>: 0|1, ...}}
+        """
+        names = args.get("names", [])
+
+        err = self._gpio_missing(names)
+        if err:
+            self._ret.put({"method": "get_gpios", "value": err, "success": False})
+            return
+
+        values = {}
+        for name in names:
+            values[name] = self.ctx["gpio"][name].value()
+        self._ret.put({"method": "get_gpios", "value": {'values': values}, "success": True})
+
+    def get_gpio_ports(self, args):
+        """ snapshot of whole GPIO ports, the input data register (IDR) of each port is read,
+        so all the pins of a port are read at the same instant
+
+        args:
+        :param ports: list of port letters, ["A", "C"], default is the ports of the initialized gpios
+        :return: {'ports': {<port>: <bitmask, bit n is pin n>, ...},
+                  'pins': {<name>: [<port>, <bit>], ...}}, the initialized gpios on the ports read
+        """
+        pins = {}
+        for name, pin in self.ctx["gpio"].items():
+            pins[name] = [self.GPIO_PORTS[pin.port()], pin.pin()]
+
+        ports = args.get("ports", None)
+        if ports is None:
+            ports = sorted(set(p[0] for p in pins.values()))
+        if not isinstance(ports, list):
+            value = {'err': "ports must be a list"}
+            self._ret.put({"method": "get_gpio_ports", "value": value, "success": False})
+            return
+
+        for port in ports:
+            if not isinstance(port, str) or not hasattr(stm, "GPIO" + port):
+                value = {'err': "{} is not a GPIO port".format(port)}
+                self._ret.put({"method": "get_gpio_ports", "value": value, "success": False})
+                return
+
+        masks = {}
+        for port in ports:
+            masks[port] = stm.mem32[getattr(stm, "GPIO" + port) + stm.GPIO_IDR] & 0xffff
+
+        for name in list(pins):
+            if pins[name][0] not in masks: del pins[name]
+        self._ret.put({"method": "get_gpio_ports", "value": {'ports': masks, 'pins': pins}, "success": True})
+
+    def _gpio_seq_isr(self, tim):
+        """ timer ISR for gpio_seq, runs the steps that are due on this tick
+        - !! no allocation allowed, see http://docs.micropython.org/en/latest/reference/isr_rules.html
+
+        :param tim: the timer
+        """
+        st = self.ctx["gpio_seq"]
+        if not st or st["done"]: return
+
+        i = st["i"]
+        n = st["n"]
+        if i < n:
+            wait = st["wait"] - 1
+            if wait > 0:
+                st["wait"] = wait
+                return
+
+            pins = st["pins"]
+            levels = st["levels"]
+            ticks = st["ticks"]
+            stamps = st["stamps"]
+            start = st["start"]
+            while i < n:
+                pins[i].value(levels[i])
+                stamps[i] = time.ticks_diff(time.ticks_us(), start)
+                wait = ticks[i]
+                i += 1
+                if wait: break  # steps with no delay run on the same tick
+            st["i"] = i
+            st["wait"] = wait
+            if i < n: return
+
+        try:
+            micropython.schedule(self._gpio_seq_done_ref, 0)
+            st["done"] = True
+        except RuntimeError:
+            pass  # schedule queue is full, try again on the next tick
+
+    def _gpio_seq_done(self, _):
+        """ scheduled by the ISR when the last step has run, posts the results
+        """
+        st = self._gpio_seq_stop()
+        if st: self._ret.put_deferred(self._gpio_seq_results(st, False))
+
+    def _gpio_seq_stop(self):
+        """ stop a gpio sequence, if there is one
+
+        :return: state of the sequence that was stopped, or None
+        """
+        st = self.ctx["gpio_seq"]
+        if not st: return None
+
+        st["tim"].callback(None)
+        st["tim"].deinit()
+        self.ctx["gpio_seq"] = {}
+        return st
+
+    def _gpio_seq_results(self, st, stopped):
+        """ the "gpio_seq_results" item of a sequence, for the caller to put
+        - edge times are relative to the first step, expected times are from the delays rounded to ticks
+        """
+        run = st["i"]
+        edges = []
+        expected = []
+        t = 0
+        for i in range(run):
+            edges.append(st["stamps"][i] - st["stamps"][0])
+            expected.append(t)
+            t += st["ticks"][i] * st["tick_us"]
+
+        error = 0
+        for i in range(run):
+            error = max(error, abs(edges[i] - expected[i]))
+
+        value = {"steps": run, "tick_us": st["tick_us"], "edges_us": edges, "expected_us": expected,
+                 "max_error_us": error, "stopped": stopped}
+        return {"method": "gpio_seq_results", "value": value, "success": True, "id": st["id"]}
+
+    def gpio_seq(self, args):
+        """ Run a sequence of gpio steps on the target, timed by a timer interrupt
+        - this is non-blocking, "gpio_seq_results" is posted when the sequence is done, with the
+          time of every edge, relative to the first step
+        - delays are rounded to the timer tick, steps with no delay run on the same tick
+
+        args:
+        :param steps: [[<name>, <level>, <delay_us>], ...], set gpio <name> to <level>, then wait <delay_us>
+                      before the next step, the gpios must be initialized
+        :param tick_us: timer tick (GPIO_SEQ_MIN_TICK_US - 1000000), default 100 us
+        :param enable: set False to stop a sequence, its results are posted with "stopped": True
+        :return:
+        """
+        if not args.get("enable", True):
+            st = self._gpio_seq_stop()
+            if st: self._ret.put(self._gpio_seq_results(st, True))
+            value = {'value': 'stopped' if st else 'not running'}
+            self._ret.put({"method": "gpio_seq", "value": value, "success": True})
+            return
+
+        if self.ctx["gpio_seq"]:
+            value = {'err': "sequence already running"}
+            self._ret.put({"method": "gpio_seq", "value": value, "success": False})
+            return
+
+        tick_us = args.get("tick_us", 100)
+        if not (self.GPIO_SEQ_MIN_TICK_US <= tick_us <= 1000000):
+            value = {'err': "tick_us not within range supported, {} <= t <= 1000000".format(self.GPIO_SEQ_MIN_TICK_US)}
+            self._ret.put({"method": "gpio_seq", "value": value, "success": False})
+            return
+
+        steps = args.get("steps", None)
+        if not isinstance(steps, list) or not (0 < len(steps) <= self.GPIO_SEQ_MAX_STEPS):
+            value = {'err': "steps must be a list of 1 - {} steps".format(self.GPIO_SEQ_MAX_STEPS)}
+            self._ret.put({"method": "gpio_seq", "value": value, "success": False})
+            return
+        for step in steps:
+            if not isinstance(step, list) or len(step) != 3 or not isinstance(step[0], str) or \
+                    not isinstance(step[2], int) or step[2] < 0:
+                value = {'err': "{} is not a step, [<name>, <level>, <delay_us>]".format(step)}
+                self._ret.put({"method": "gpio_seq", "value": value, "success": False})
+                return
+
+        err = self._gpio_missing(set(step[0] for step in steps))
+        if err:
+            self._ret.put({"method": "gpio_seq", "value": err, "success": False})
+            return
+
+        # all the state is made here, the ISR does not allocate
+        n = len(steps)
+        self.ctx["gpio_seq"] = {
+            "id": self._ret.rid,
+            "tick_us": tick_us,
+            "pins": [self.ctx["gpio"][step[0]] for step in steps],
+            "levels": bytearray(1 if step[1] else 0 for step in steps),
+            "ticks": array.array('L', ((step[2] + tick_us // 2) // tick_us for step in steps)),
+            "stamps": array.array('l', (0 for i in range(n))),
+            "n": n,
+            "i": 0,
+            "wait": 1,  # the first step runs on the first tick
+            "done": False,
+            "start": time.ticks_us(),
+        }
+        tim = pyb.Timer(self.GPIO_SEQ_TIMER, freq=1000000 // tick_us)
+        self.ctx["gpio_seq"]["tim"] = tim
+        tim.callback(self._gpio_seq_isr_ref)
+        self._ret.put({"method": "gpio_seq", "value": {'value': 'started', 'steps': n}, "success": True})
+
+    def _adc_reader(self, pin):
+        """ function that reads a sample of a pin, or of an internal channel
+
+        :param pin: one of ADC_VALID_PINS or ADC_VALID_INTERNALS
+        :return: function, or None
+        """
+        if pin in self.ADC_VALID_PINS:
+            return self._adc(pin).read
+
+        adc = self._adc_all()
+        if pin == "TEMP": return adc.read_core_temp
+        if pin == "VBAT": return adc.read_core_vbat
+        if pin == "VREF": return adc.read_core_vref
+        if pin == "VDD": return adc.read_vref
+        return None
+
     def adc_read(self, args):
         """ (simple) read ADC on a pin
-        - this is a blocking call
+        - this is a coroutine, other commands run while it waits between samples, and between
+          chunks of ADC_READ_CHUNK samples when sample_ms is 0
 
         args:
         :param pin: pin name of gpio, X1, X2, ... or VBAT, TEMP, VREF, VDD
         :param samples: number of samples to take and then calculate average, default 1
         :param sample_ms: number of milliseconds between samples, default 1
+        :param stats: list of statistics to return as well, any of ADC_READ_STATS, default none
+        :param bins: number of histogram bins (0 - ADC_MAX_BINS), default 0 is no histogram
+        :param range: [lo, hi] of the histogram, default [0, 4096], samples outside are counted
+                      in the first or last bin
         :return:
         """
         pin = args.get("pin", None)
@@ -329,46 +672,124 @@ class uPyRPC(MicroPyServer):
             return
 
         samples = args.get("samples", 1)
+        if not samples > 0:
+            value = {'err': "samples must be > 0"}
+            self._ret.put({"method": "adc_read", "value": value, "success": False})
+            return
+
         sample_ms = args.get("sample_ms", 1)
 
-        # print("DEBUG: test")
+        stats = args.get("stats", [])
+        for stat in stats:
+            if stat not in self.ADC_READ_STATS:
+                value = {'err': "{} is not one of {}".format(stat, self.ADC_READ_STATS)}
+                self._ret.put({"method": "adc_read", "value": value, "success": False})
+                return
 
-        adc = None
-        adc_read = None
-        if pin in self.ADC_VALID_PINS:
-            adc = pyb.ADC(pyb.Pin('{}'.format(pin)))
-            adc_read = adc.read
+        bins = args.get("bins", 0)
+        lo, hi = args.get("range", [0, 4096])
+        if not (0 <= bins <= self.ADC_MAX_BINS) or not lo < hi:
+            value = {'err': "bins not within 0 <= b <= {}, or range is empty".format(self.ADC_MAX_BINS)}
+            self._ret.put({"method": "adc_read", "value": value, "success": False})
+            return
 
-        else:
-            adc = pyb.ADCAll(12, 0x70000)
-
-            if pin == "TEMP":
-                adc_read = adc.read_core_temp
-            elif pin == "VBAT":
-                adc_read = adc.read_core_vbat
-            elif pin == "VREF":
-                adc_read = adc.read_core_vref
-            elif pin == "VDD":
-                adc_read = adc.read_vref
-
-        if adc is None or adc_read is None:
+        # print("DEBUG: test")
+
+        adc_read = self._adc_reader(pin)
+        if adc_read is None:
             value = {'err': "{} pin is not valid (internal error)".format(pin)}
             self._ret.put({"method": "adc_read", "value": value, "success": False})
             return
 
-        results = []
-        for i in range(samples):
-            results.append(float(adc_read()))
-            if sample_ms:
-                time.sleep_ms(sample_ms)
-
-        sum = 0
-        for r in results: sum += r
-        result = float(sum / len(results))
+        hist = array.array('I', (0 for i in range(bins)))
+        acc = [0, 0, 0, None, None]
+        taken = 0
+        while taken < samples:
+            n = 1 if sample_ms else min(self.ADC_READ_CHUNK, samples - taken)
+            self._adc_read_reduce(adc_read, n, acc, hist, lo, hi)
+            taken += n
+            yield sample_ms
+        sum, sq_hi, sq_lo, _min, _max = acc
+
+        mean = float(sum / samples)
+        value = {'value': mean, "samples": samples}
+        if stats:
+            # the sums of pin samples are exact ints, so the variance does not lose precision
+            sum_sq = sq_hi * 0x1000000 + sq_lo
+            var = max(0.0, float(samples * sum_sq - sum * sum) / (samples * samples))
+            values = {"mean": mean, "min": _min, "max": _max, "rms": math.sqrt(sum_sq / samples),
+                      "var": var, "std": math.sqrt(var)}
+            for stat in stats: value[stat] = values[stat]
+        if bins:
+            value["hist"] = [h for h in hist]
+            value["range"] = [lo, hi]
 
-        value = {'value': result, "samples": samples}
         self._ret.put({"method": "adc_read", "value": value, "success": True})
 
+    @micropython.native
+    def _adc_read_reduce(self, adc_read, samples, acc, hist, lo, hi):
+        """ take samples and reduce them as they are taken, in one pass, without storing them
+        - the raw 12 bit samples of a pin keep every running value a small int, so nothing is
+          allocated, the sum of squares is split in two so it never needs a long int
+        - internal channels are floats, these are allocated, but not kept
+
+        :param adc_read: function that returns a sample
+        :param samples: number of samples
+        :param acc: [sum, sum of squares high (x 0x1000000), sum of squares low, min, max], reduced into,
+                    so samples can be taken in chunks
+        :param hist: array of histogram bins, counted into
+        :param lo: lowest value of the first bin
+        :param hi: highest value of the last bin
+        """
+        bins = len(hist)
+        span = hi - lo
+        sum = acc[0]
+        sq_hi = acc[1]
+        sq_lo = acc[2]
+        _min = acc[3]
+        _max = acc[4]
+        for i in range(samples):
+            v = adc_read()
+            sum += v
+            sq_lo += v * v
+            while sq_lo >= 0x1000000:
+                sq_lo -= 0x1000000
+                sq_hi += 1
+            if _min is None or v < _min: _min = v
+            if _max is None or v > _max: _max = v
+            if bins:
+                b = int((v - lo) * bins // span)
+                if b < 0: b = 0
+                elif b >= bins: b = bins - 1
+                hist[b] += 1
+
+        acc[0] = sum
+        acc[1] = sq_hi
+        acc[2] = sq_lo
+        acc[3] = _min
+        acc[4] = _max
+
+    def _adc_samples(self, value, pins, bufs, encoding):
+        """ add sample buffers to a result value, one per pin
+
+        :param value: result value dict
+        :param pins: list of pin names
+        :param bufs: list of array('H'), one per pin
+        :param encoding: None for a list of ints per pin,
+                         "b64" for the raw little endian bytes of each buffer, base64 encoded,
+                         which is a third of the size and much faster to decode
+        """
+        if encoding == "b64":
+            value["encoding"] = "b64"
+            value["pins"] = pins
+            for idx, pin in enumerate(pins):
+                value[pin] = binascii.b2a_base64(bufs[idx])[:-1].decode()
+            return
+
+        # reformat results to be a simple list
+        for idx, pin in enumerate(pins):
+            value[pin] = [r for r in bufs[idx]]
+
     def _adc_read_multi(self, _):
         """ async callback for adc_read_multi
         - args for this function are cached in self.ctx["adc_read_multi"]
@@ -377,6 +798,7 @@ class uPyRPC(MicroPyServer):
         :return:
         """
         args = self.ctx["adc_read_multi"]
+        rid = args.get("id", None)
         freq = args.get("freq", 100)
         samples = args.get("samples", 100)
         pins = args.get("pins", None)
@@ -384,19 +806,17 @@ class uPyRPC(MicroPyServer):
         adcs = []
         results = []
         for pin in pins:
-            adcs.append(pyb.ADC(pyb.Pin('{}'.format(pin))))
-            results.append(array.array('H', (0 for i in range(samples))))
+            adcs.append(self._adc(pin))
+            results.append(self._adc_buf(pin, samples))
 
         tim = pyb.Timer(self.ADC_READ_MULTI_TIMER, freq=freq)  # Create timer
         pyb.ADC.read_timed_multi(adcs, results, tim)
         tim.deinit()
 
-        # reformat results to be a simple list
         value = {"samples": samples, "freq": freq}
-        for idx, result in enumerate(results):
-            value[pins[idx]] = [r for r in result]
+        self._adc_samples(value, pins, results, args.get("encoding", None))
 
-        self._ret.put({"method": "adc_read_multi_results", "value": value, "success": True})
+        self._ret.put_deferred({"method": "adc_read_multi_results", "value": value, "success": True, "id": rid})
 
     def adc_read_multi(self, args):
         """ ADC read multiple pins, multiple times, at a given frequency
@@ -406,6 +826,7 @@ class uPyRPC(MicroPyServer):
         :param pins: list of pins name of gpio, X1, X2, ... or vbat, temp, vref, core_vref
         :param freq: frequency of taking samples (1 - 10kHz), default 100 Hz
         :param samples: total samples to take (1 - 1000), default 100
+        :param encoding: None (default) for lists of samples, "b64" for base64 raw samples, see _adc_samples()
         :return:
         """
         freq = args.get("freq", 100)
@@ -433,11 +854,503 @@ class uPyRPC(MicroPyServer):
 
         # everything is good, store the params
         self.ctx["adc_read_multi"] = args
+        args["id"] = self._ret.rid
 
         # schedule adc multi to run later
         micropython.schedule(self._adc_read_multi, 0)
         self._ret.put({"method": "adc_read_multi", "value": {'value': 'scheduled'}, "success": True})
 
+    def _adc_stream_isr(self, tim):
+        """ timer ISR for adc_stream, takes one sample of every pin
+        - !! no allocation allowed, see http://docs.micropython.org/en/latest/reference/isr_rules.html
+
+        :param tim: the timer
+        """
+        st = self.ctx["adc_stream"]
+        if not st: return  # stopped
+        n = st["n"]
+        active = st["active"]
+        bufs = st["bufs"][active]
+        adcs = st["adcs"]
+        for i in range(len(adcs)):
+            bufs[i][n] = adcs[i].read()
+
+        n += 1
+        if n < st["chunk"]:
+            st["n"] = n
+            return
+
+        st["n"] = 0
+        pending = st["pending"]
+        if pending[1 - active]:
+            # host side (or the scheduler) is not keeping up, this chunk is overwritten
+            st["overruns"] += 1
+            return
+
+        pending[active] = True
+        st["active"] = 1 - active
+        try:
+            micropython.schedule(self._adc_stream_chunk_ref, active)
+        except RuntimeError:
+            # schedule queue is full
+            pending[active] = False
+            st["overruns"] += 1
+
+    def _adc_stream_chunk(self, idx):
+        """ scheduled by the ISR when a chunk buffer is full, posts the chunk
+
+        :param idx: index of the full chunk buffer
+        :return:
+        """
+        st = self.ctx["adc_stream"]
+        if not st: return
+
+        # chunks the result queue dropped, because the host did not fetch them, are overruns too
+        dropped = self._ret.dropped("adc_stream_chunk") - st["dropped"]
+        value = {"seq": st["seq"], "samples": st["chunk"], "freq": st["freq"], "overruns": st["overruns"] + dropped}
+        self._adc_samples(value, st["pins"], st["bufs"][idx], st["encoding"])
+        st["pending"][idx] = False
+        st["seq"] += 1
+
+        last = st["chunks"] and st["seq"] >= st["chunks"]
+        if last:
+            self._adc_stream_stop()
+        value["last"] = bool(last)
+        self._ret.put_deferred({"method": "adc_stream_chunk", "value": value, "success": True, "id": st["id"]})
+
+    def _adc_stream_stop(self):
+        """ stop a streaming capture, if there is one
+
+        :return: True if a capture was stopped
+        """
+        st = self.ctx["adc_stream"]
+        if not st: return False
+
+        st["tim"].callback(None)
+        st["tim"].deinit()
+        self.ctx["adc_stream"] = {}
+        return True
+
+    def adc_stream(self, args):
+        """ ADC streaming capture of multiple pins, at a given frequency, for any length of time
+        - this is non-blocking, samples are taken on a timer interrupt into one of two chunk
+          buffers, while the other is posted as a "adc_stream_chunk" result
+        - the host must fetch the chunks as fast as they are made, else chunks are dropped
+          and counted in "overruns", both the chunks overwritten before they were posted and the
+          posted chunks the "adc_stream_chunk" lane of the result queue dropped
+
+        args:
+        :param pins: list of pins name of gpio, X1, X2, ...
+        :param freq: frequency of taking samples (1 - 10kHz), default 1000 Hz
+        :param chunk: samples per chunk (1 - ADC_STREAM_MAX_CHUNK), default 100
+        :param chunks: number of chunks to take, 0 (default) streams until stopped
+        :param encoding: None (default) for lists of samples, "b64" for base64 raw samples, see _adc_samples()
+        :param enable: set False to stop streaming
+        :return:
+        """
+        if not args.get("enable", True):
+            value = {'value': 'stopped' if self._adc_stream_stop() else 'not running'}
+            self._ret.put({"method": "adc_stream", "value": value, "success": True})
+            return
+
+        if self.ctx["adc_stream"]:
+            value = {'err': "stream already running"}
+            self._ret.put({"method": "adc_stream", "value": value, "success": False})
+            return
+
+        freq = args.get("freq", 1000)
+        if not (0 < freq <= self.ADC_MAX_FREQ):
+            value = {'err': "freq not within range supported, 0 < f <= {}".format(self.ADC_MAX_FREQ)}
+            self._ret.put({"method": "adc_stream", "value": value, "success": False})
+            return
+
+        chunk = args.get("chunk", 100)
+        if not (0 < chunk <= self.ADC_STREAM_MAX_CHUNK):
+            value = {'err': "chunk not within range supported, 0 < c <= {}".format(self.ADC_STREAM_MAX_CHUNK)}
+            self._ret.put({"method": "adc_stream", "value": value, "success": False})
+            return
+
+        pins = args.get("pins", None)
+        if not isinstance(pins, list) or not pins:
+            value = {'err': "pins must be a list"}
+            self._ret.put({"method": "adc_stream", "value": value, "success": False})
+            return
+        for pin in pins:
+            if pin not in self.ADC_VALID_PINS:
+                value = {'err': "{} pin is not valid".format(pin)}
+                self._ret.put({"method": "adc_stream", "value": value, "success": False})
+                return
+
+        # all the buffers are allocated here, the ISR does not allocate
+        self.ctx["adc_stream"] = {
+            "id": self._ret.rid,
+            "pins": pins,
+            "freq": freq,
+            "chunk": chunk,
+            "chunks": args.get("chunks", 0),
+            "encoding": args.get("encoding", None),
+            "adcs": [self._adc(pin) for pin in pins],
+            "bufs": [[self._adc_buf("{}.stream{}".format(pin, i), chunk) for pin in pins] for i in range(2)],
+            "pending": [False, False],
+            "active": 0,
+            "n": 0,
+            "seq": 0,
+            "overruns": 0,
+            "dropped": self._ret.dropped("adc_stream_chunk"),  # lane drops before this stream
+        }
+        tim = pyb.Timer(self.ADC_STREAM_TIMER, freq=freq)
+        self.ctx["adc_stream"]["tim"] = tim
+        tim.callback(self._adc_stream_isr_ref)
+        self._ret.put({"method": "adc_stream", "value": {'value': 'started'}, "success": True})
+
+    def _adc_capture_isr(self, tim):
+        """ timer ISR for adc_capture, takes one sample of every pin into the ring buffers, and
+        checks the trigger while armed
+        - !! no allocation allowed, see http://docs.micropython.org/en/latest/reference/isr_rules.html
+
+        :param tim: the timer
+        """
+        st = self.ctx["adc_capture"]
+        if not st or st["done"]: return
+
+        left = st["left"]
+        if left != 0:
+            idx = st["idx"]
+            bufs = st["bufs"]
+            adcs = st["adcs"]
+            for i in range(len(adcs)):
+                bufs[i][idx] = adcs[i].read()
+            nxt = idx + 1
+            if nxt == st["size"]: nxt = 0
+            st["idx"] = nxt
+
+            if left > 0:
+                left -= 1
+                st["left"] = left
+            else:
+                # armed, the trigger is checked on every sample, once there are pre samples before it
+                count = st["count"]
+                if count < st["pre"]: st["count"] = count + 1
+
+                pin = st["pin"]
+                if pin is not None: level = pin.value()
+                else: level = 1 if bufs[st["adc"]][idx] >= st["level"] else 0
+
+                prev = st["prev"]
+                st["prev"] = level
+                if prev < 0 or level == prev or count < st["pre"]: return
+                edge = st["edge"]
+                if edge is not None and (prev != edge[0] or level != edge[1]): return
+
+                st["ticks"] = time.ticks_us()
+                left = st["post"] - 1  # the trigger sample is the first post-trigger sample
+                st["left"] = left
+
+            if left != 0: return
+
+        try:
+            micropython.schedule(self._adc_capture_done_ref, 0)
+            st["done"] = True
+        except RuntimeError:
+            pass  # schedule queue is full, try again on the next tick
+
+    def _adc_capture_done(self, _):
+        """ scheduled by the ISR when the post-trigger samples are taken, posts the capture
+        """
+        st = self._adc_capture_stop()
+        if not st: return
+
+        # the ring buffers are full, the oldest sample is at idx
+        idx = st["idx"]
+        bufs = [buf[idx:] + buf[:idx] for buf in st["bufs"]]
+        value = {"freq": st["freq"], "pre": st["pre"], "post": st["post"], "trigger": st["trigger"],
+                 "trigger_us": time.ticks_diff(st["ticks"], st["armed"]), "ticks_us": st["ticks"]}
+        self._adc_samples(value, st["pins"], bufs, st["encoding"])
+        self._ret.put_deferred({"method": "adc_capture_results", "value": value, "success": True, "id": st["id"]})
+
+    def _adc_capture_stop(self):
+        """ stop a triggered capture, if there is one
+
+        :return: state of the capture that was stopped, or None
+        """
+        st = self.ctx["adc_capture"]
+        if not st: return None
+
+        st["tim"].callback(None)
+        st["tim"].deinit()
+        self.ctx["adc_capture"] = {}
+        return st
+
+    def adc_capture(self, args):
+        """ Triggered ADC capture of multiple pins, with samples from before the trigger
+        - this is non-blocking, sampling starts right away into ring buffers, and "adc_capture_results"
+          is posted after the trigger, with the pre samples before the trigger and the post samples from it
+        - the trigger is checked on every sample, so it is in the capture at sample "pre", and is only
+          taken once there are pre samples
+        - a gpio trigger is an edge of an initialized gpio, an adc trigger is one of the pins crossing a level
+
+        args:
+        :param pins: list of pins name of gpio, X1, X2, ...
+        :param freq: frequency of taking samples (1 - 10kHz), default 1000 Hz
+        :param pre: samples before the trigger, default 100
+        :param post: samples from the trigger, at least 1, default 400, pre + post <= ADC_CAPTURE_MAX_SAMPLES
+        :param trigger: {"gpio": <name>, "edge": "rising"|"falling"|"both"} or
+                        {"adc": <pin of pins>, "level": <0 - 4095>, "edge": "rising"|"falling"|"both"}
+        :param encoding: None (default) for lists of samples, "b64" for base64 raw samples, see _adc_samples()
+        :param enable: set False to disarm
+        :return: "adc_capture_results": {"freq": #, "pre": #, "post": #, "trigger": <trigger>,
+                 "trigger_us": <us from arming to the trigger>, "ticks_us": <time.ticks_us() of the trigger>,
+                 <pin>: <samples>, ...}
+        """
+        if not args.get("enable", True):
+            value = {'value': 'disarmed' if self._adc_capture_stop() else 'not armed'}
+            self._ret.put({"method": "adc_capture", "value": value, "success": True})
+            return
+
+        if self.ctx["adc_capture"]:
+            value = {'err': "capture already armed"}
+            self._ret.put({"method": "adc_capture", "value": value, "success": False})
+            return
+
+        freq = args.get("freq", 1000)
+        if not (0 < freq <= self.ADC_MAX_FREQ):
+            value = {'err': "freq not within range supported, 0 < f <= {}".format(self.ADC_MAX_FREQ)}
+            self._ret.put({"method": "adc_capture", "value": value, "success": False})
+            return
+
+        pre = args.get("pre", 100)
+        post = args.get("post", 400)
+        if pre < 0 or post < 1 or pre + post > self.ADC_CAPTURE_MAX_SAMPLES:
+            value = {'err': "pre >= 0, post >= 1, pre + post <= {}".format(self.ADC_CAPTURE_MAX_SAMPLES)}
+            self._ret.put({"method": "adc_capture", "value": value, "success": False})
+            return
+
+        pins = args.get("pins", None)
+        if not isinstance(pins, list) or not pins:
+            value = {'err': "pins must be a list"}
+            self._ret.put({"method": "adc_capture", "value": value, "success": False})
+            return
+        for pin in pins:
+            if pin not in self.ADC_VALID_PINS:
+                value = {'err': "{} pin is not valid".format(pin)}
+                self._ret.put({"method": "adc_capture", "value": value, "success": False})
+                return
+
+        trigger = args.get("trigger", {})
+        edge = trigger.get("edge", "rising")
+        gpio = trigger.get("gpio", None)
+        adc = trigger.get("adc", None)
+        err = None
+        if edge not in self.ADC_CAPTURE_EDGES:
+            err = {'err': "edge must be one of {}".format(", ".join(self.ADC_CAPTURE_EDGES))}
+        elif gpio is not None:
+            err = self._gpio_missing([gpio])
+        elif adc not in pins:
+            err = {'err': "trigger must have a gpio, or an adc pin of pins"}
+        elif not (0 <= trigger.get("level", -1) <= 4095):
+            err = {'err': "trigger level not within range supported, 0 <= l <= 4095"}
+        if err:
+            self._ret.put({"method": "adc_capture", "value": err, "success": False})
+            return
+
+        # all the buffers are allocated here, the ISR does not allocate
+        size = pre + post
+        self.ctx["adc_capture"] = {
+            "id": self._ret.rid,
+            "pins": pins,
+            "freq": freq,
+            "pre": pre,
+            "post": post,
+            "size": size,
+            "trigger": trigger,
+            "encoding": args.get("encoding", None),
+            "adcs": [self._adc(pin) for pin in pins],
+            "bufs": [self._adc_buf("{}.capture".format(pin), size) for pin in pins],
+            "pin": self.ctx["gpio"][gpio] if gpio is not None else None,
+            "adc": pins.index(adc) if gpio is None else 0,
+            "level": trigger.get("level", 0),
+            "edge": self.ADC_CAPTURE_EDGES[edge],
+            "prev": -1,
+            "idx": 0,
+            "count": 0,
+            "left": -1,  # samples left to take after the trigger, -1 until triggered
+            "done": False,
+            "ticks": 0,
+            "armed": time.ticks_us(),
+        }
+        tim = pyb.Timer(self.ADC_CAPTURE_TIMER, freq=freq)
+        self.ctx["adc_capture"]["tim"] = tim
+        tim.callback(self._adc_capture_isr_ref)
+        self._ret.put({"method": "adc_capture", "value": {'value': 'armed'}, "success": True})
+
+    def _adc_monitor_window(self, st):
+        """ stats of the window so far, and the alarm state of every pin
+
+        :param st: monitor state
+        :return: {"seq": #, "samples": #, "late": #, <pin>: {"min": #, "max": #, "mean": #, "alarm": <state>}, ...}
+        """
+        n = st["n"]
+        value = {"seq": st["seq"], "samples": n, "late": st["late"]}
+        for i, pin in enumerate(st["pins"]):
+            value[pin] = {"min": st["min"][i], "max": st["max"][i], "mean": st["sum"][i] / n if n else None,
+                          "alarm": st["alarm"][i]}
+        return value
+
+    def _adc_monitor(self, st):
+        """ monitor thread, samples the pins at freq, posts a window result as each window closes, and
+        an alarm result when a pin leaves or comes back into its limits
+        - the thread exits when ctx["adc_monitor"] is no longer its state
+
+        :param st: monitor state
+        """
+        reads = st["reads"]
+        limits = st["limits"]
+        hyst = st["hysteresis"]
+        period_us = 1000000 // st["freq"]
+        window_us = st["window_ms"] * 1000
+        _sum, _min, _max, alarm = st["sum"], st["min"], st["max"], st["alarm"]
+        due = start = time.ticks_us()
+        while self.ctx["adc_monitor"] is st:
+            for i in range(len(reads)):
+                v = reads[i]()
+                _sum[i] += v
+                if _min[i] is None or v < _min[i]: _min[i] = v
+                if _max[i] is None or v > _max[i]: _max[i] = v
+
+                lo, hi = limits[i]
+                state = alarm[i]
+                if lo is not None and v < lo: state = "low"
+                elif hi is not None and v > hi: state = "high"
+                elif state == "ok": pass
+                elif (lo is None or v >= lo + hyst) and (hi is None or v <= hi - hyst): state = "ok"
+                if state != alarm[i]:
+                    alarm[i] = state
+                    self._ret.put({"method": "adc_monitor_alarm", "success": True, "id": st["id"],
+                                   "value": {"pin": st["pins"][i], "alarm": state, "value": v,
+                                             "limits": [lo, hi], "ticks_us": time.ticks_us()}})
+            st["n"] += 1
+
+            now = time.ticks_us()
+            if window_us and time.ticks_diff(now, start) >= window_us:
+                value = self._adc_monitor_window(st)
+                value["ticks_us"] = now
+                self._ret.put({"method": "adc_monitor_window", "value": value, "success": True, "id": st["id"]})
+                start = now
+                st["seq"] += 1
+                st["n"] = 0
+                st["late"] = 0
+                for i in range(len(reads)):
+                    _sum[i] = 0
+                    _min[i] = None
+                    _max[i] = None
+
+            due = time.ticks_add(due, period_us)
+            wait = time.ticks_diff(due, time.ticks_us())
+            if wait > 0:
+                time.sleep_us(wait)
+            elif wait < -period_us:
+                st["late"] += 1  # fell behind by more than a sample, skip ahead rather than catch up
+                due = time.ticks_us()
+
+    def _adc_monitor_stop(self):
+        """ stop the monitor, if there is one, its thread exits after the sample it is taking
+
+        :return: state of the monitor that was stopped, or None
+        """
+        st = self.ctx["adc_monitor"]
+        if not st: return None
+
+        self.ctx["adc_monitor"] = {}
+        return st
+
+    def adc_monitor(self, args):
+        """ Background monitor of ADC pins and internal channels, with windowed stats and alarms
+        - this is non-blocking, the pins are sampled on a thread until disabled or reset, and nothing is
+          returned until a window closes or a pin crosses a limit
+        - "adc_monitor_window" is posted as each window closes, with the min, max and mean of every pin
+        - "adc_monitor_alarm" is posted when a pin goes below or above its limits, and when it comes
+          back within them by hysteresis
+        - pins are raw 0 - 4095, internal channels are in their units, see pyb.ADCAll, limits are the same
+
+        args:
+        :param pins: list of pins, of ADC_VALID_PINS and ADC_VALID_INTERNALS
+        :param freq: frequency of taking samples (1 - ADC_MONITOR_MAX_FREQ), default 100 Hz
+        :param window_ms: window of the stats, default 1000 ms, 0 for no window results
+        :param limits: {<pin>: [<lo>, <hi>], ...}, lo or hi can be None, default no limits
+        :param hysteresis: how far within the limits a pin has to come back to clear its alarm, default 0
+        :param query: set True to get the stats of the window so far, the monitor keeps running
+        :param enable: set False to stop, returns the stats of the window so far
+        :return: "adc_monitor_window": {"seq": #, "samples": #, "late": <# times sampling fell behind>,
+                 "ticks_us": #, <pin>: {"min": #, "max": #, "mean": #, "alarm": "ok"|"low"|"high"}, ...}
+                 "adc_monitor_alarm": {"pin": <pin>, "alarm": "ok"|"low"|"high", "value": #,
+                 "limits": [lo, hi], "ticks_us": #}
+        """
+        if not args.get("enable", True) or args.get("query", False):
+            st = self.ctx["adc_monitor"]
+            if not st:
+                value = {'err': "monitor not running"}
+                self._ret.put({"method": "adc_monitor", "value": value, "success": False})
+                return
+            if not args.get("enable", True): self._adc_monitor_stop()
+            self._ret.put({"method": "adc_monitor", "value": self._adc_monitor_window(st), "success": True})
+            return
+
+        if self.ctx["adc_monitor"]:
+            value = {'err': "monitor already running"}
+            self._ret.put({"method": "adc_monitor", "value": value, "success": False})
+            return
+
+        freq = args.get("freq", 100)
+        if not (0 < freq <= self.ADC_MONITOR_MAX_FREQ):
+            value = {'err': "freq not within range supported, 0 < f <= {}".format(self.ADC_MONITOR_MAX_FREQ)}
+            self._ret.put({"method": "adc_monitor", "value": value, "success": False})
+            return
+
+        window_ms = args.get("window_ms", 1000)
+        if window_ms < 0:
+            value = {'err': "window_ms must be >= 0"}
+            self._ret.put({"method": "adc_monitor", "value": value, "success": False})
+            return
+
+        pins = args.get("pins", None)
+        if not isinstance(pins, list) or not pins:
+            value = {'err': "pins must be a list"}
+            self._ret.put({"method": "adc_monitor", "value": value, "success": False})
+            return
+        for pin in pins:
+            if pin not in self.ADC_VALID_PINS and pin not in self.ADC_VALID_INTERNALS:
+                value = {'err': "{} pin is not valid".format(pin)}
+                self._ret.put({"method": "adc_monitor", "value": value, "success": False})
+                return
+
+        limits = args.get("limits", {})
+        for pin in limits:
+            if pin not in pins or len(limits[pin]) != 2:
+                value = {'err': "limits must be [lo, hi] of pins, {}".format(pin)}
+                self._ret.put({"method": "adc_monitor", "value": value, "success": False})
+                return
+
+        count = len(pins)
+        st = {
+            "id": self._ret.rid,
+            "pins": pins,
+            "freq": freq,
+            "window_ms": window_ms,
+            "reads": [self._adc_reader(pin) for pin in pins],
+            "limits": [limits.get(pin, [None, None]) for pin in pins],
+            "hysteresis": args.get("hysteresis", 0),
+            "sum": [0] * count,
+            "min": [None] * count,
+            "max": [None] * count,
+            "alarm": ["ok"] * count,
+            "seq": 0,
+            "n": 0,
+            "late": 0,
+        }
+        self.ctx["adc_monitor"] = st
+        _thread.start_new_thread(self._adc_monitor, (st,))
+        self._ret.put({"method": "adc_monitor", "value": {'value': 'started'}, "success": True})
+
     def pwm(self, args):
         """ PWM
         - a pin must be set up first
@@ -478,21 +1391,22 @@ class uPyRPC(MicroPyServer):
         self.ctx["pwm"][name].pulse_width_percent(duty_cycle)
         self._ret.put({"method": "pwm", "value": {'value': 'scheduled'}, "success": True})
 
-    def _long_running_example(self, delay):
+    def _long_running_example(self, delay, rid):
         """ own thread started by long_running_task_example
         - blick LED to indicate things are happening...
         :param delay: seconds
+        :param rid: request id
         :return:
         """
         count = 0
         while count < delay:
             time.sleep(1)
             count += 1
-            pyb.LED(LED_GREEN).on()
+            self._led(LED_GREEN).on()
             time.sleep_ms(100)
-            pyb.LED(LED_GREEN).off()
+            self._led(LED_GREEN).off()
 
-        self._ret.put({"method": "long_running_example", "value": {'value': 'completed'}, "success": True})
+        self._ret.put({"method": "long_running_example", "value": {'value': 'completed'}, "success": True, "id": rid})
 
     def long_running_example(self, args):
         """ Example of how to implement a long running task
@@ -502,7 +1416,7 @@ class uPyRPC(MicroPyServer):
         """
         delay_s = args.get("delay_s", 0)
         if delay_s > 0:
-            _thread.start_new_thread(self._long_running_example, (delay_s,))
+            _thread.start_new_thread(self._long_running_example, (delay_s, self._ret.rid))
             self._ret.put({"method": "long_running_example", "value": {'value': 'scheduled'}, "success": True})
             return
 
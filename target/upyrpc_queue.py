@@ -23,90 +23,387 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
+import time
+import _thread
 
 
 class MicroPyQueue(object):
     """ Special Queue for sending commands and getting return items from a MicroPython Process
 
+    The queue has a fixed capacity, all its storage is allocated when it is created.
+    - items are held in one preallocated list of slots, split into "lanes", each lane is a ring
+      buffer of its own, oldest item first
+    - lane 0 is shared, methods can be given a lane of their own, so that a burst of one
+      method can not push out the items of others
+    - put is constant time, get, peek and update scan the rings, so they take at most the time
+      of the capacity of the lanes, taking items out of the middle of a ring moves the items after
+      them up, nothing is allocated but the lists of items that are returned
+    - what happens when a lane is full is set by the policy, dropped items are counted, see stats()
+
+    Functions run by micropython.schedule() must use put_deferred(), a scheduled function can run
+    on a thread that is inside the queue, so it can neither wait for the lock nor take it over.
     """
     MAX_ITEMS = 10
+    DEFERRED_ITEMS = 8  # items put_deferred() can hold until the queue is free
+
+    DROP_OLDEST = 0  # the oldest item in the lane is dropped
+    REJECT = 1       # the new item is dropped
+    BLOCK = 2        # put() waits up to block_ms for room, then drops the new item, see put()
+    BLOCK_MS = 1000
+    BLOCK_POLL_MS = 1  # put() checks for room this often while it waits
+
+    def __init__(self, max_items=MAX_ITEMS, lanes=None, policy=DROP_OLDEST, block_ms=BLOCK_MS):
+        """
+        :param max_items: capacity of the shared lane
+        :param lanes: {<method>: <capacity>, ...} methods with a lane of their own
+        :param policy: one of DROP_OLDEST, REJECT, BLOCK
+        :param block_ms: longest time put() blocks with the BLOCK policy
+        """
+        if not (isinstance(max_items, int) and max_items > 0):
+            raise ValueError("max_items must be > 0")
+        for method in (lanes or {}):
+            if not (isinstance(lanes[method], int) and lanes[method] > 0):
+                raise ValueError("lane {} size must be > 0".format(method))
 
-    def __init__(self, max_items=MAX_ITEMS):
-        self.items = []
         self.max_items = max_items
+        self.policy = policy
+        self.block_ms = block_ms
+        self.rid = None      # request id stamped on items put while a request is being processed
+        self.on_put = None   # function called after an item is put
 
-    def put(self, item):
-        """ Put an item into the queue
+        self._lane_of = {}          # method -> lane
+        self._lane_names = [None]
+        self._start = [0]           # first slot of each lane
+        self._cap = [max_items]
+        size = max_items
+        if lanes:
+            for method in lanes:
+                self._lane_of[method] = len(self._cap)
+                self._lane_names.append(method)
+                self._start.append(size)
+                self._cap.append(lanes[method])
+                size += lanes[method]
+
+        count = len(self._cap)
+        self._head = [0] * count        # ring index of the oldest item of each lane
+        self._live = [0] * count        # items in each lane
+        self._dropped = [0] * count
+        self._dropped_total = [0] * count  # dropped, never reset, see dropped()
+        self._high = [0] * count        # most items each lane has held
+        self._high_all = 0              # most items the queue has held
+        self._count = 0
+        self._cur = [0] * count         # scan position of each lane, see _collect()
+        self._taken = [0] * count       # items _collect() matched in each lane
+
+        self._slots = [None] * size
+        self._seqs = [0] * size         # order items were put, across lanes
+        self._seq = 0
+
+        self._lock = _thread.allocate_lock()
+        self._owner = None
+        self._consumer = None  # thread that last got items, put() does not block it, see BLOCK
+
+        # ring of deferred items, only put_deferred() writes _def_in, only the lock holder _def_out
+        self._deferred = [None] * (self.DEFERRED_ITEMS + 1)
+        self._def_in = 0
+        self._def_out = 0
+        self._def_dropped = [0] * count  # items put_deferred() dropped, written only by put_deferred()
+        self._def_counted = [0] * count  # of those, added to the dropped counts, written only by _drain()
+
+    def __len__(self):
+        return self._count
+
+    # ===================================================================================
+    # locking
+    # The lock is not re-entered, a scheduled function that interrupts a thread inside the queue
+    # would change it under that thread, scheduled functions use put_deferred() instead
+
+    def _acquire(self):
+        me = _thread.get_ident()
+        if self._owner == me:
+            raise RuntimeError("MicroPyQueue re-entered, scheduled functions must use put_deferred()")
+        self._lock.acquire()
+        self._owner = me
+        self._drain()
+
+    def _release(self):
+        self._drain()
+        self._owner = None
+        self._lock.release()
+
+    def _drain(self):
+        """ move deferred items into the queue, the lock must be held """
+        for lane in range(len(self._cap)):
+            dropped = self._def_dropped[lane] - self._def_counted[lane]
+            if dropped:
+                self._def_counted[lane] += dropped
+                self._dropped[lane] += dropped
+                self._dropped_total[lane] += dropped
+
+        out = self._def_out
+        while out != self._def_in:
+            item = self._deferred[out]
+            self._deferred[out] = None
+            out = (out + 1) % len(self._deferred)
+            self._def_out = out
+            self._put(item)
 
-        :param item: dict of format, {"method": <class_method>, "args": <args>}
-        :return: True on queue, False on error or too many items
+    # ===================================================================================
+    # storage, the lock must be held
+
+    def _lane(self, method):
+        return self._lane_of.get(method, 0)
+
+    def _slot(self, lane, k):
+        """ slot of the k-th oldest item of lane """
+        return self._start[lane] + (self._head[lane] + k) % self._cap[lane]
+
+    def _put(self, item):
+        """ put an item
+
+        :return: True on queue, False if an item was dropped
         """
-        ret = True
-        if len(self.items) >= self.max_items:
-            self.items.pop()
+        lane = self._lane(item["method"])
+        live = self._live[lane]
+        if live < self._cap[lane]:
+            slot = self._slot(lane, live)
+            self._live[lane] = live + 1
+            self._count += 1
+            if live + 1 > self._high[lane]: self._high[lane] = live + 1
+            if self._count > self._high_all: self._high_all = self._count
+            ret = True
+        else:
+            self._dropped[lane] += 1
+            self._dropped_total[lane] += 1
+            if self.policy != self.DROP_OLDEST:
+                return False
+            # the oldest item is overwritten, the new item is the newest of the ring
+            slot = self._slot(lane, 0)
+            self._head[lane] = (self._head[lane] + 1) % self._cap[lane]
             ret = False
-        self.items.append(item)
+
+        self._slots[slot] = item
+        self._seqs[slot] = self._seq
+        self._seq += 1
         return ret
 
-    def get(self, method=None, all=False):
-        """ Get an item from the queue
+    @staticmethod
+    def _match(item, method, id, debug):
+        """ item is one of the items asked for, see _collect() """
+        if id is not None:
+            return item.get("id", None) == id
+        if method is None:
+            return True
+        return item["method"] == method or (debug and item["method"] == "_debug")
 
-        :param method: set to class_method to return a specific result
-        :param all: when set return all
+    def _take(self, lane, method, id, debug, n):
+        """ take the n oldest matching items out of lane, the items after them move up the ring """
+        w = 0
+        for k in range(self._live[lane]):
+            slot = self._slot(lane, k)
+            item = self._slots[slot]
+            if n and self._match(item, method, id, debug):
+                n -= 1
+                continue
+            if w != k:
+                to = self._slot(lane, w)
+                self._slots[to] = item
+                self._seqs[to] = self._seqs[slot]
+            w += 1
+
+        for k in range(w, self._live[lane]):
+            self._slots[self._slot(lane, k)] = None
+        self._count -= self._live[lane] - w
+        self._live[lane] = w
+
+    def _collect(self, method, id, debug, all, remove):
+        """ matching items, oldest first
+        - the rings of the lanes are scanned side by side, and merged by the order items were put
+
+        :param method: match items of this method
+        :param id: match items of this request id, takes priority over method
+        :param debug: include "_debug" items
+        :param all: all matching items, else only the oldest
+        :param remove: take the items out of the queue
         :return: [item, ...]
         """
-        if method is None:
-            if all:
-                ret = self.items
-                self.items = []
-                return ret
+        # items of a method are all in the lane of that method
+        only = -1
+        debug_lane = -1
+        if id is None and method is not None:
+            only = self._lane(method)
+            if debug: debug_lane = self._lane("_debug")
 
-            if self.items: return [self.items.pop(0)]
-            else: return []
+        lanes = len(self._cap)
+        for lane in range(lanes):
+            self._cur[lane] = 0
+            self._taken[lane] = 0
 
         items = []
-        for idx, item in enumerate(self.items):
-            if item["method"] == method or item["method"] == "_debug":
-                items.append(self.items.pop(idx))
-                if not all:
-                    break
+        while True:
+            best = -1
+            for lane in range(lanes):
+                if only >= 0 and lane != only and lane != debug_lane: continue
+                k = self._cur[lane]
+                while k < self._live[lane] and not self._match(self._slots[self._slot(lane, k)], method, id, debug):
+                    k += 1
+                self._cur[lane] = k
+                if k < self._live[lane] and (best < 0 or self._seqs[self._slot(lane, k)] < best_seq):
+                    best = lane
+                    best_seq = self._seqs[self._slot(lane, k)]
+            if best < 0: break
+
+            items.append(self._slots[self._slot(best, self._cur[best])])
+            self._cur[best] += 1
+            self._taken[best] += 1
+            if not all: break
 
+        if remove:
+            for lane in range(lanes):
+                if self._taken[lane]: self._take(lane, method, id, debug, self._taken[lane])
         return items
 
-    def peek(self, method=None, all=False):
+    # ===================================================================================
+    # API
+
+    def put(self, item):
+        """ Put an item into the queue
+        - not from a function run by micropython.schedule(), see put_deferred()
+        - with the BLOCK policy, a full lane is polled every BLOCK_POLL_MS on the calling thread, for up
+          to block_ms, unless the caller is the thread that gets the items, it could never make room
+
+        :param item: dict of format, {"method": <class_method>, "args": <args>, "id": <id>}
+        :return: True on queue, False if an item was dropped, or too many items
+        """
+        if self.rid is not None and "id" not in item:
+            item["id"] = self.rid
+
+        lane = self._lane(item["method"])
+        if self.policy == self.BLOCK and self._live[lane] >= self._cap[lane] and \
+                _thread.get_ident() != self._consumer:
+            deadline = time.ticks_add(time.ticks_ms(), self.block_ms)
+            while self._live[lane] >= self._cap[lane] and time.ticks_diff(deadline, time.ticks_ms()) > 0:
+                time.sleep_ms(self.BLOCK_POLL_MS)
+
+        self._acquire()
+        try:
+            ret = self._put(item)
+        finally:
+            self._release()
+
+        if self.on_put is not None: self.on_put()
+        return ret
+
+    def put_deferred(self, item):
+        """ Put an item into the queue from a function run by micropython.schedule()
+        - never waits, if the queue is busy the item is held until the thread using the queue is done
+        - the item must have its "id", the request being processed is not the one that scheduled this
+
+        :param item: dict of format, {"method": <class_method>, "args": <args>, "id": <id>}
+        :return: True if queued or held, False if an item was dropped
+        """
+        if self._lock.acquire(0):
+            self._owner = _thread.get_ident()
+            try:
+                self._drain()
+                ret = self._put(item)
+            finally:
+                self._release()
+        else:
+            nxt = (self._def_in + 1) % len(self._deferred)
+            if nxt == self._def_out:
+                self._def_dropped[self._lane(item["method"])] += 1
+                ret = False
+            else:
+                self._deferred[self._def_in] = item
+                self._def_in = nxt
+                ret = True
+
+        if self.on_put is not None: self.on_put()
+        return ret
+
+    def get(self, method=None, all=False, id=None):
+        """ Get an item from the queue
+        - "_debug" items are always returned with the items of method
+
+        :param method: set to class_method to return a specific result
+        :param all: when set return all
+        :param id: set to a request id to return the result(s) of that request
+        :return: [item, ...]
+        """
+        self._acquire()
+        try:
+            self._consumer = self._owner
+            return self._collect(method, id, True, all, True)
+        finally:
+            self._release()
+
+    def peek(self, method=None, all=False, id=None):
         """ Peek at item(s) in the queue, does not remove item(s)
 
         :param method: if set, returns first item matching method string
         :param all: if set returns all items, if method is set, then all items with method returned
+        :param id: if set, returns first item matching request id
         :return: None for no item, or [item(s)]
         """
-        if method is None:
-            if all:
-                return self.items
-
-            if self.items: return [self.items[0]]
-            else: return []
-
-        items = []
-        for idx, item in enumerate(self.items):
-            if item["method"] == method:
-                items.append(self.items[idx])
-                if not all:
-                    break
-
-        return items
+        self._acquire()
+        try:
+            return self._collect(method, id, False, all, False)
+        finally:
+            self._release()
 
     def update(self, item_update):
         """ Update an item in queue, or append item if it doesn't exist
+        - items are matched by method, and by id if item_update has one, the item keeps its place
 
         :param item_update: new item, of format, {"method": <class_method>, "args": <args>}
         :return:
         """
-        if self.items:
-            for idx, item in enumerate(self.items):
-                if item["method"] == item_update["method"]:
-                    self.items[idx] = item_update
+        self._acquire()
+        try:
+            method = item_update["method"]
+            rid = item_update.get("id", None)
+            lane = self._lane(method)
+            for k in range(self._live[lane]):
+                slot = self._slot(lane, k)
+                item = self._slots[slot]
+                if item["method"] == method and (rid is None or item.get("id", None) == rid):
+                    self._slots[slot] = item_update
                     return
+        finally:
+            self._release()
 
         # if no matching, append this item
-        self.items.append(item)
+        self.put(item_update)
+
+    def dropped(self, method=None):
+        """ items dropped from the lane of method since the queue was made, not reset by stats()
+
+        :param method: method of the lane, None for the shared lane
+        :return: #
+        """
+        return self._dropped_total[self._lane(method)]
+
+    def stats(self, reset=False):
+        """ queue statistics
+        - "high" is the most items held, since the queue was made or the last reset
+        - "deferred" is items put_deferred() is holding until the queue is free
+
+        :param reset: start the dropped counts and high water marks over, after reading them
+        :return: {"policy": <policy>, "size": <#>, "items": <#>, "high": <#>, "dropped": <#>, "deferred": <#>,
+                  "lanes": {<method>|"*": {"size": <#>, "items": <#>, "high": <#>, "dropped": <#>}, ...}}
+        """
+        lanes = {}
+        for lane, name in enumerate(self._lane_names):
+            lanes[name or "*"] = {"size": self._cap[lane], "items": self._live[lane], "high": self._high[lane],
+                                  "dropped": self._dropped[lane]}
+        deferred = (self._def_in - self._def_out) % len(self._deferred)
+        stats = {"policy": self.policy, "size": len(self._slots), "items": len(self), "high": self._high_all,
+                 "dropped": sum(self._dropped), "deferred": deferred, "lanes": lanes}
+
+        if reset:
+            for lane in range(len(self._cap)):
+                self._dropped[lane] = 0
+                self._high[lane] = self._live[lane]
+            self._high_all = len(self)
+        return stats
@@ -23,14 +23,22 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
+import sys
+import gc
 import time
+import _thread
+import json
 import micropython
 
+from upyrpc_const import *
 from upyrpc_queue import MicroPyQueue
+from upyrpc_frame import encode_obj, read_frame
 
 micropython.alloc_emergency_exception_buf(100)
 __DEBUG_FILE = "upyrpc_server"
 
+_GENERATOR = type((lambda: (yield))())  # type of a coroutine method's return, see _dispatch()
+
 
 class MicroPyServer(object):
     """ Async Worker MicroPython Server
@@ -38,59 +46,114 @@ class MicroPyServer(object):
 
     !! This is a base class and should not be used directly !!
 
-    cmds: Are in this format: {"method": <class_method>, "args": {<args>}}
+    The server thread sleeps until cmd() wakes it, so commands start right away.  Set
+    SERVER_WAKEUP = False for the old behaviour, polling every SERVER_CMD_SLEEP_MS.
+
+    cmds: Are in this format: {"method": <class_method>, "args": {<args>}, "id": <id>}
+
+    ret: Are in this format: {"method": <class_method>, "value": { ...}, "id": <id>}
+
+    The "id" is optional and chosen by the client.  Every return item put while a command is
+    being processed is stamped with the command's id, so clients can have several commands of
+    the same method outstanding and fetch each result by id.
 
-    ret: Are in this format: {"method": <class_method>, "value": { ...}}
+    The server keeps running after the client closes the port, a client can attach to it
+    again without a soft reset, see ping().
+
+    Every command run is timed, see stats().
+
+    A recipe is a list of commands with limits on their results, run with one consolidated result,
+    and cached by its hash, see recipe().
+
+    Queued commands are run by priority, see METHOD_PRIORITY, and in order within a priority.  A
+    method that waits can be a coroutine, a generator that yields the milliseconds it waits for,
+    other commands run while it waits, see _run_next().
     """
+    VERSION = None             # set by the subclass, reported by ping()
+    SERVER_WAKEUP = True       # cmd() wakes the server thread, else it polls
+    SERVER_CMD_SLEEP_MS = 100  # polling time for processing new commands, if SERVER_WAKEUP is False
+
+    CMD_QUEUE_SIZE = MicroPyQueue.MAX_ITEMS
+    RET_QUEUE_SIZE = MicroPyQueue.MAX_ITEMS
+    RET_QUEUE_LANES = None  # {<method>: <size>} methods with their own part of the return queue
+    RET_QUEUE_POLICY = MicroPyQueue.DROP_OLDEST
+
+    PRIORITY_CONTROL = 0  # short control methods, run ahead of the others
+    PRIORITY_NORMAL = 1
+    PRIORITY_BULK = 2     # long acquisitions, run when nothing else is ready
+    METHOD_PRIORITY = {"ping": PRIORITY_CONTROL, "stats": PRIORITY_CONTROL, "queue_stats": PRIORITY_CONTROL,
+                       "recipe": PRIORITY_BULK}  # {<method>: <priority>}, methods not listed are PRIORITY_NORMAL
+    SERVER_TASK_POLL_MS = 2  # polling time for new commands, while coroutine methods wait
+
+    RECIPE_CACHE = 4                          # recipes kept in memory, least recently used are dropped
+    RECIPE_FILE = "upyrpc_recipe_{}.json"     # saved recipes, by hash
+    RECIPE_HASH_MAX = 64                      # hex digits of a recipe hash, at most
+
     def __init__(self, debug=False):
-        self._cmd = MicroPyQueue()
-        self._ret = MicroPyQueue()
+        self._cmd = MicroPyQueue(self.CMD_QUEUE_SIZE, policy=MicroPyQueue.REJECT)
+        self._ret = MicroPyQueue(self.RET_QUEUE_SIZE, self.RET_QUEUE_LANES, self.RET_QUEUE_POLICY)
         self._debug_flag = debug
+        self._start_s = time.time()
+        self._method_stats = {}  # method -> [calls, total us, max us], see stats()
+        self._gc_alloc = gc.mem_alloc()
+        self._gc_collections = 0
+        self._recipes = {}  # hash -> steps, see recipe()
+        self._recipes_used = []  # hashes, least recently used first
+        self._push = False  # push mode, results are written to the client as soon as they are put
+        self._write = None  # stream write function while serving frames
+        self._write_lock = _thread.allocate_lock()
+        self._ready = [[] for p in range(self.PRIORITY_BULK + 1)]  # commands taken off the queue, by priority
+        self._tasks = []  # coroutine methods that are waiting, see _dispatch()
+
+        # the server thread blocks on this lock while idle, releasing it wakes the thread
+        self._wake = _thread.allocate_lock()
+        self._wake.acquire()
+        self._ret.on_put = self._wakeup  # so results put by other threads are pushed right away
 
     # ===================================================================================
     # Public API to send commands and get results from the MicroPy Server
     #
     def cmd(self, cmd):
         """ Send (Add) a command to the MicroPy Server command queue
-        - commands are executed in the order they are received
+        - commands are executed in the order they are received, within their priority, see METHOD_PRIORITY
 
-        :param cmd: dict format {"method": <class_method>, "args": {<args>}}
+        :param cmd: dict format {"method": <class_method>, "args": {<args>}, "id": <id>}
         :return: success (True/False)
         """
-        if not isinstance(cmd, dict):
-            self._ret.put({"method": "cmd", "value": "cmd must be a dict", "success": False})
+        err = self._check_cmd(cmd)
+        if err:
+            rid = cmd.get("id", None) if isinstance(cmd, dict) else None
+            self._ret.put({"method": "cmd", "value": err, "success": False, "id": rid})
             return False
 
-        if not cmd.get("method", False):
-            self._ret.put({"method": "cmd", "value": "cmd dict must have method key", "success": False})
+        if not self._cmd.put(cmd):
+            self._ret.put({"method": "cmd", "value": "command queue is full", "success": False, "id": cmd.get("id", None)})
             return False
 
-        if not getattr(self, cmd["method"], False):
-            self._ret.put({"method": "cmd", "value": "'{}' invalid method".format(cmd["method"]), "success": False})
-            return False
-
-        self._cmd.put(cmd)
+        self._wakeup()
         return True
 
-    def ret(self, method=None, all=False):
+    def ret(self, method=None, all=False, id=None):
         """ return result(s) of command
 
         :param method: string, if specified, only results of that command are returned
         :param all: True, will return all commands, otherwise only ONE return result is retrieved
+        :param id: if specified, only results of the command with this id are returned
         :return: success (True|False)
         """
-        _ret = self._ret.get(method, all)
+        _ret = self._ret.get(method, all, id)
         print(_ret)
         return True
 
-    def peek(self, method=None, all=False):
+    def peek(self, method=None, all=False, id=None):
         """ Peek at item(s) in the queue, does not remove item(s)
 
         :param method:
         :param all:
+        :param id:
         :return: success (True|False)
         """
-        ret = self._ret.peek(method, all)
+        ret = self._ret.peek(method, all, id)
         print(ret)
         return True
 
@@ -102,23 +165,509 @@ class MicroPyServer(object):
         """
         return self._ret.update(item_update)
 
+    def serve_frames(self):
+        """ Serve framed binary requests on the REPL stream, see upyrpc_frame.py
+        - the client exec's this once, and then talks frames instead of exec'ing a python string per call
+        - returns when a FRAME_EXIT is received, which gives the REPL back to the client
+        - keyboard interrupt is disabled while serving because frames may contain 0x03 (ctrl-C), instead
+          a ctrl-C between frames ends serving without a reply, so a client that is not framing, like
+          one that died while framing and a new one entering the raw REPL, can still break in
+        - in push mode (FRAME_CONFIG {"push": True}) the _run thread writes results as FRAME_PUSH
+          frames as soon as they are put, the client does not need to poll for them
+
+        :return: None
+        """
+        read = sys.stdin.buffer.read
+        self._write = sys.stdout.buffer.write
+
+        micropython.kbd_intr(-1)
+        try:
+            while True:
+                frame = read_frame(read, 0x03)
+                if frame is None:
+                    self._send(FRAME_ERROR, "crc error")
+                    continue
+
+                ftype, payload = frame
+                if payload is None:
+                    with self._write_lock:  # ctrl-C, the client is not framing, so nothing is written
+                        self._push = False
+                        self._write = None
+                    break
+
+                if ftype == FRAME_EXIT:
+                    # nothing may be written after this reply, the REPL owns the stream again
+                    with self._write_lock:
+                        self._push = False
+                        self._write(encode_obj(FRAME_REPLY, True))
+                        self._write = None
+                    break
+
+                try:
+                    req = json.loads(payload)
+                except ValueError:
+                    self._send(FRAME_ERROR, "invalid payload")
+                    continue
+
+                if ftype == FRAME_CMD:
+                    value = self.cmd(req)
+                elif ftype == FRAME_RET:
+                    value = self._ret.get(req.get("method", None), req.get("all", False), req.get("id", None))
+                elif ftype == FRAME_PEEK:
+                    value = self._ret.peek(req.get("method", None), req.get("all", False), req.get("id", None))
+                elif ftype == FRAME_CONFIG:
+                    self._push = bool(req.get("push", self._push))
+                    self._wakeup()  # push anything already queued
+                    value = {"push": self._push}
+                else:
+                    self._send(FRAME_ERROR, "unknown frame type {}".format(ftype))
+                    continue
+
+                self._send(FRAME_REPLY, value)
+        finally:
+            self._push = False
+            self._write = None
+            micropython.kbd_intr(3)
+
+    # ===================================================================================
+    # RPC methods common to all servers
+
+    def batch(self, args):
+        """ Run a list of commands in order, and put all their results as one result
+        - saves a round trip to the server per command
+
+        args: { 'cmds': [cmd, ...], 'stop': True/False }
+        :param cmds: list of cmd dicts, see cmd()
+        :param stop: if set, stop at the first command that fails, default False
+        :return: {'results': [result, ...]}, success is True if all commands succeeded
+        """
+        cmds = args.get("cmds", [])
+        stop = args.get("stop", False)
+        rid = self._ret.rid
+
+        results = []
+        success = True
+        for idx, cmd in enumerate(cmds):
+            err = self._check_cmd(cmd)
+            if err:
+                result = {"method": "cmd", "value": err, "success": False}
+            else:
+                result = self._dispatch_collect(cmd, "{}.{}".format(rid, idx))
+
+            results.append(result)
+            if not result["success"]:
+                success = False
+                if stop: break
+
+        self._ret.put({"method": "batch", "value": {"results": results}, "success": success})
+
+    def recipe(self, args):
+        """ Run a recipe, a list of steps, and put one consolidated result
+        - a step is a command with limits on values of its result,
+            {"method": <class_method>, "args": {<args>}, "limits": {<value key>: [<lo>|None, <hi>|None], ...}}
+        - recipes are cached by hash, after a recipe is sent once only its hash is needed, when the hash
+          is not cached the result is not successful and has 'cached': False
+        - only steps that failed or have limits are in the results, unless 'full' is set
+
+        args: { 'hash': <hash>, 'steps': [step, ...], 'save': True/False, 'stop': True/False, 'full': True/False }
+        :param hash: hash of the steps, made by the client, lower case hex digits
+        :param steps: the steps, only needed if the recipe is not cached
+        :param save: save the recipe to a file too, so it is still cached after a reset
+        :param stop: stop at the first step that fails, or is out of its limits
+        :param full: put the whole result of every step in the results
+        :return: {'hash': <hash>, 'passed': True|False, 'steps': <steps run>, 'failed': [<step index>, ...],
+                  'results': [{'step': <index>, 'method': <method>, 'success': True|False,
+                               'value': {<value key>: <value>, ...}, 'fail': [<value key>, ...]}, ...]}
+                  success is True if the recipe ran, see 'passed' for the outcome
+        """
+        h = args.get("hash", None)
+        if not isinstance(h, str) or not 0 < len(h) <= self.RECIPE_HASH_MAX or \
+                not all(c in "0123456789abcdef" for c in h):
+            # the hash is a file name too
+            value = {'err': "hash must be 1 to {} lower case hex digits".format(self.RECIPE_HASH_MAX)}
+            self._ret.put({"method": "recipe", "value": value, "success": False})
+            return
+
+        steps = args.get("steps", None)
+        upload = steps is not None
+        if not upload:
+            steps = self._recipe_get(h)
+            if steps is None:
+                value = {'err': "recipe {} is not cached".format(h), 'cached': False}
+                self._ret.put({"method": "recipe", "value": value, "success": False})
+                return
+
+        err = self._recipe_check(steps)
+        if err:
+            value = {'err': "recipe {}: {}".format(h, err)}
+            self._ret.put({"method": "recipe", "value": value, "success": False})
+            return
+
+        if upload:
+            self._recipe_use(h, steps)
+            if args.get("save", False):
+                try:
+                    with open(self.RECIPE_FILE.format(h), "w") as f:
+                        json.dump(steps, f)
+                except OSError as e:
+                    value = {'err': "recipe {} not saved: {}".format(h, e)}
+                    self._ret.put({"method": "recipe", "value": value, "success": False})
+                    return
+
+        stop = args.get("stop", False)
+        full = args.get("full", False)
+        rid = self._ret.rid
+
+        results = []
+        failed = []
+        run = 0
+        for idx, step in enumerate(steps):
+            run += 1
+            err = self._check_cmd(step)
+            if err:
+                result = {"method": "cmd", "value": err, "success": False}
+            else:
+                result = self._dispatch_collect(step, "{}.{}".format(rid, idx))
+
+            limits = step.get("limits", None) if isinstance(step, dict) else None
+            fail = self._recipe_limits(result, limits) if limits else []
+            if not result["success"] or fail:
+                failed.append(idx)
+
+            if full:
+                result["step"] = idx
+                result["fail"] = fail
+                results.append(result)
+            elif limits or not result["success"]:
+                value = result["value"]
+                if limits and isinstance(value, dict):
+                    value = dict((k, value.get(k, None)) for k in limits)
+                results.append({"step": idx, "method": result["method"], "success": result["success"],
+                                "value": value, "fail": fail})
+
+            if stop and failed: break
+
+        value = {"hash": h, "passed": not failed, "steps": run, "failed": failed, "results": results}
+        self._ret.put({"method": "recipe", "value": value, "success": True})
+
+    def ping(self, args):
+        """ Cheap handshake, a client uses it to check for a running server it can attach to
+
+        args: None
+        :return: {'version': self.VERSION, 'uptime_s': <seconds since the server started>}
+        """
+        value = {"version": self.VERSION, "uptime_s": time.time() - self._start_s}
+        self._ret.put({"method": "ping", "value": value, "success": True})
+
+    def stats(self, args):
+        """ Server health statistics
+        - the execution time of a method is only the time until it returns, work it scheduled
+          or started on a thread is not included, a coroutine method returns when it ends
+        - "collections" counts the garbage collections seen between commands, by the heap
+          getting smaller, MicroPython does not count them
+
+        args: { 'reset': True/False }
+        :param reset: start the method stats, collections, dropped counts and high water marks over,
+                      after reading them
+        :return: {'methods': {<method>: {'calls': #, 'total_us': #, 'max_us': #}, ...},
+                  'cmd': <stats>, 'ret': <stats>, see MicroPyQueue.stats(),
+                  'sched': {'ready': [<commands ready, by priority>], 'tasks': <coroutine methods waiting>},
+                  'mem': {'free': #, 'alloc': #, 'collections': #}, 'uptime_s': #}
+        """
+        reset = args.get("reset", False)
+        self._gc_check()
+
+        methods = {}
+        for method, s in self._method_stats.items():
+            methods[method] = {"calls": s[0], "total_us": s[1], "max_us": s[2]}
+        value = {"methods": methods,
+                 "cmd": self._cmd.stats(reset), "ret": self._ret.stats(reset),
+                 "sched": {"ready": [len(r) for r in self._ready], "tasks": len(self._tasks)},
+                 "mem": {"free": gc.mem_free(), "alloc": gc.mem_alloc(), "collections": self._gc_collections},
+                 "uptime_s": time.time() - self._start_s}
+
+        if reset:
+            self._method_stats = {}
+            self._gc_collections = 0
+        self._ret.put({"method": "stats", "value": value, "success": True})
+
+    def queue_stats(self, args):
+        """ Statistics of the command and return queues, including counts of dropped items
+
+        args: None
+        :return: {'cmd': <stats>, 'ret': <stats>}, see MicroPyQueue.stats()
+        """
+        self._ret.put({"method": "queue_stats", "value": {"cmd": self._cmd.stats(), "ret": self._ret.stats()}, "success": True})
+
     # ===================================================================================
     # private
 
+    def _check_cmd(self, cmd):
+        """ check a command before it is queued
+
+        :param cmd: dict format {"method": <class_method>, "args": {<args>}, "id": <id>}
+        :return: None if the command is valid, else an error message
+        """
+        if not isinstance(cmd, dict):
+            return "cmd must be a dict"
+
+        if not cmd.get("method", False):
+            return "cmd dict must have method key"
+
+        if not getattr(self, cmd["method"], False):
+            return "'{}' invalid method".format(cmd["method"])
+
+        return None
+
+    def _dispatch(self, cmd, wait=True):
+        """ run a command
+        - results put while the method runs are stamped with the request id,
+          methods that post later (threads, scheduled) must copy self._ret.rid
+        - a coroutine method, a generator that yields the ms it waits for, is run to its end here,
+          unless wait is False, then it is returned as a task, for _run_next() to step
+        - a method that raises fails with the error as its result, the server keeps running
+
+        :param cmd: dict format {"method": <class_method>, "args": {<args>}, "id": <id>}
+        :param wait: run a coroutine method to its end
+        :return: task [<generator>, <id>, <method>, <start us>, <due ms>, <priority>], or None
+        """
+        method = getattr(self, cmd["method"], None)
+        if method is None:
+            return None  # methods should always be found because they are checked before being queued
+
+        rid = self._ret.rid
+        self._ret.rid = cmd.get("id", None)
+        start = time.ticks_us()
+        task = None
+        try:
+            gen = method(cmd.get("args", {}))
+            if isinstance(gen, _GENERATOR):
+                if not wait:
+                    task = [gen, self._ret.rid, cmd["method"], start, time.ticks_ms(), self._priority(cmd["method"])]
+                    return task
+                for ms in gen:
+                    if ms: time.sleep_ms(ms)
+        except Exception as e:
+            self._ret.put({"method": cmd["method"], "value": {'err': str(e)}, "success": False})
+        finally:
+            self._ret.rid = rid
+            if task is None: self._method_time(cmd["method"], time.ticks_diff(time.ticks_us(), start))
+        return None
+
+    def _step(self, task):
+        """ resume a coroutine method until it yields, or ends
+        - it goes to the back of the tasks, so tasks of the same priority take turns
+
+        :param task: see _dispatch()
+        """
+        self._tasks.remove(task)
+        rid = self._ret.rid
+        self._ret.rid = task[1]
+        try:
+            ms = next(task[0])
+        except StopIteration:
+            self._method_time(task[2], time.ticks_diff(time.ticks_us(), task[3]))
+            return
+        except Exception as e:
+            # the task is dropped, see _dispatch()
+            self._ret.put({"method": task[2], "value": {'err': str(e)}, "success": False})
+            self._method_time(task[2], time.ticks_diff(time.ticks_us(), task[3]))
+            return
+        finally:
+            self._ret.rid = rid
+
+        task[4] = time.ticks_add(time.ticks_ms(), ms or 0)
+        self._tasks.append(task)
+
+    def _priority(self, name):
+        return self.METHOD_PRIORITY.get(name, self.PRIORITY_NORMAL)
+
+    def _run_next(self):
+        """ run the next ready command, or step the next coroutine method that is due, highest priority first
+        - a command runs before a coroutine method of the same priority is stepped
+        - commands are taken off the queue while there is room, so a full queue still rejects commands
+
+        :return: True if something was run
+        """
+        room = self.CMD_QUEUE_SIZE - sum(len(r) for r in self._ready)
+        while room > 0:
+            item = self._cmd.get()
+            if not item: break
+            self._ready[self._priority(item[0]["method"])].append(item[0])
+            room -= 1
+
+        now = time.ticks_ms()
+        for prio in range(len(self._ready)):
+            if self._ready[prio]:
+                task = self._dispatch(self._ready[prio].pop(0), wait=False)
+                if task: self._tasks.append(task)
+                return True
+
+            for task in self._tasks:
+                if task[5] == prio and time.ticks_diff(task[4], now) <= 0:
+                    self._step(task)
+                    return True
+        return False
+
+    def _task_wait_ms(self):
+        """ ms until the next coroutine method is due, None if there are none
+        """
+        now = time.ticks_ms()
+        wait = None
+        for task in self._tasks:
+            ms = max(0, time.ticks_diff(task[4], now))
+            if wait is None or ms < wait: wait = ms
+        return wait
+
+    def _method_time(self, name, us):
+        """ add a run of a method to the stats
+        """
+        s = self._method_stats.get(name, None)
+        if s is None:
+            self._method_stats[name] = [1, us, us]
+            return
+        s[0] += 1
+        s[1] += us
+        if us > s[2]: s[2] = us
+
+    def _gc_check(self):
+        """ count a garbage collection if the heap got smaller since the last check
+        """
+        alloc = gc.mem_alloc()
+        if alloc < self._gc_alloc: self._gc_collections += 1
+        self._gc_alloc = alloc
+
+    def _recipe_get(self, h):
+        """ steps of a cached recipe, from memory or its file, None if it is not cached
+        """
+        steps = self._recipes.get(h, None)
+        if steps is None:
+            try:
+                with open(self.RECIPE_FILE.format(h)) as f:
+                    steps = json.load(f)
+            except (OSError, ValueError):
+                return None
+
+        self._recipe_use(h, steps)
+        return steps
+
+    def _recipe_use(self, h, steps):
+        """ cache a recipe in memory, as the most recently used
+        """
+        if h in self._recipes: self._recipes_used.remove(h)
+        self._recipes[h] = steps
+        self._recipes_used.append(h)
+        while len(self._recipes_used) > self.RECIPE_CACHE:
+            self._recipes.pop(self._recipes_used.pop(0), None)
+
+    def _recipe_check(self, steps):
+        """ check the shape of the steps of a recipe, before it is cached or run
+        - the steps are commands, they are checked as they run, see _check_cmd()
+
+        :param steps: [step, ...]
+        :return: None if the steps are valid, else an error message
+        """
+        if not isinstance(steps, list):
+            return "steps must be a list"
+
+        for idx, step in enumerate(steps):
+            limits = step.get("limits", None) if isinstance(step, dict) else None
+            if limits is None: continue
+            if not isinstance(limits, dict):
+                return "step {} limits must be a dict".format(idx)
+            for key, lohi in limits.items():
+                if not isinstance(lohi, list) or len(lohi) != 2:
+                    return "step {} limits of {} must be [lo, hi]".format(idx, key)
+                for v in lohi:
+                    if v is not None and (not isinstance(v, (int, float)) or isinstance(v, bool)):
+                        return "step {} limits of {} must be numbers or None".format(idx, key)
+        return None
+
+    def _recipe_limits(self, result, limits):
+        """ value keys of a result that are out of their limits, or missing
+
+        :param result: result dict
+        :param limits: {<value key>: [<lo>|None, <hi>|None], ...}
+        :return: [<value key>, ...]
+        """
+        value = result["value"]
+        fail = []
+        for key, (lo, hi) in limits.items():
+            v = value.get(key, None) if isinstance(value, dict) else None
+            if not isinstance(v, (int, float)) or (lo is not None and v < lo) or (hi is not None and v > hi):
+                fail.append(key)
+        return fail
+
+    def _dispatch_collect(self, cmd, sub_id):
+        """ run a command and take its result off the return queue, for commands run by other commands
+        - debug items are put back with the id of the outer command
+
+        :param cmd: dict format {"method": <class_method>, "args": {<args>}}
+        :param sub_id: id for the command, unique within the outer command
+        :return: result dict {"method": <class_method>, "value": { ...}, "success": True|False}
+        """
+        self._dispatch({"method": cmd["method"], "args": cmd.get("args", {}), "id": sub_id})
+
+        result = None
+        for item in self._ret.get(id=sub_id, all=True):
+            if item["method"] == "_debug":
+                item["id"] = self._ret.rid
+                self._ret.put(item)
+            elif result is None:
+                item.pop("id")
+                result = item
+
+        if result is None:
+            result = {"method": cmd["method"], "value": {'err': "no result"}, "success": False}
+        return result
+
+    def _send(self, ftype, obj):
+        """ write a frame to the client, safe to call from the REPL and _run threads
+        """
+        frame = encode_obj(ftype, obj)
+        with self._write_lock:
+            if self._write is not None:
+                self._write(frame)
+
+    def _push_results(self):
+        """ push mode: send every queued result to the client
+        """
+        while True:
+            # results are only taken off the queue while they can be written, so none are lost on exit
+            with self._write_lock:
+                if not self._push: break
+                items = self._ret.get()
+                if not items: break
+                self._write(encode_obj(FRAME_PUSH, items[0]))
+
+    def _wakeup(self):
+        """ wake the server thread if it is idle
+        """
+        if self._wake.locked():
+            try:
+                self._wake.release()
+            except RuntimeError:
+                pass  # another thread woke it first
+
     def _run(self):
         # run on thread
         while True:
-            item = self._cmd.get()
-            if item:
-                method = item[0]["method"]
-                args = item[0]["args"]
-                method = getattr(self, method, None)
-                if method is not None:
-                    method(args)
-                    # methods should always be found because they are checked before being queued
-
-            # allows other threads to run, but generally speaking there should be no other threads(?)
-            time.sleep_ms(self.SERVER_CMD_SLEEP_MS)
+            ran = self._run_next()
+            if ran: self._gc_check()
+
+            # results put by threads and scheduled functions are pushed here too
+            if self._push: self._push_results()
+
+            if not self.SERVER_WAKEUP:
+                # allows other threads to run, but generally speaking there should be no other threads(?)
+                time.sleep_ms(self.SERVER_CMD_SLEEP_MS if not self._tasks else self.SERVER_TASK_POLL_MS)
+            elif not ran and not len(self._cmd):
+                wait = self._task_wait_ms()
+                if wait is None:
+                    self._wake.acquire()  # idle until cmd(), or a result to push, wakes this thread
+                elif wait:
+                    # the lock can not be waited on with a timeout, so poll for commands until a task is due
+                    time.sleep_ms(min(wait, self.SERVER_TASK_POLL_MS))
 
     def _debug(self, msg, line=0, file=__DEBUG_FILE, name="unknown"):
         """ Add debug statement